@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the granule name decoding on a synthetic 20 year half-hourly catalog.
+
+Run from the repo root with:
+    python benchmarks/bench_catalog.py
+"""
+from time import perf_counter
+import pandas as pd
+from nasadap.util import decode_granule_names
+
+###############################
+### Parameters
+
+name_template = '3B-HHR.MS.MRG.3IMERG.{date}-S{start}-E{end}.{minutes:04}.V06B.HDF5'
+from_date = '2000-06-01'
+years = 20
+
+###############################
+### Functions
+
+
+def synthetic_names(from_date, years):
+    times = pd.date_range(from_date, pd.Timestamp(from_date) + pd.DateOffset(years=years), freq='30min', inclusive='left')
+    end_times = times + pd.Timedelta('29min 59s')
+    minutes = (times.hour * 60 + times.minute).tolist()
+    dates = times.strftime('%Y%m%d').tolist()
+    starts = times.strftime('%H%M%S').tolist()
+    ends = end_times.strftime('%H%M%S').tolist()
+    names = [name_template.format(date=d, start=s, end=e, minutes=m) for d, s, e, m in zip(dates, starts, ends, minutes)]
+    return dates, names
+
+
+def string_decode(dates, names):
+    """
+    The previous row by row string splitting and re-parsing in parse_dates/parse_nasa_catalog.
+    """
+    date_df = pd.DataFrame({'date': pd.to_datetime(dates, format='%Y%m%d'), 'start_time': [n.split('-S')[1][:6] for n in names], 'end_time': [n.split('0-E')[1][:6] for n in names]})
+    date_df['start_time'] = pd.to_datetime(date_df['start_time'], format='%H%M%S', errors='coerce').dt.time.astype(str) + 'Z+00'
+    date_df['end_time'] = pd.to_datetime(date_df['end_time'], format='%H%M%S', errors='coerce').dt.time.astype(str) + 'Z+00'
+    from_date = pd.to_datetime(date_df['date'].astype(str) + 'T' +  date_df['start_time'])
+    to_date = pd.to_datetime(date_df['date'].astype(str) + 'T' +  date_df['end_time'])
+    return from_date, to_date
+
+
+def vector_decode(dates, names):
+    from_date, to_date = decode_granule_names(names)
+    return pd.DatetimeIndex(from_date).tz_localize('utc'), pd.DatetimeIndex(to_date).tz_localize('utc')
+
+
+def timeit(func, *args, repeat=3):
+    times = []
+    for i in range(repeat):
+        t1 = perf_counter()
+        output = func(*args)
+        times.append(perf_counter() - t1)
+    return min(times), output
+
+
+###############################
+### Run
+
+if __name__ == '__main__':
+    dates, names = synthetic_names(from_date, years)
+    print('{n} granule names'.format(n=len(names)))
+
+    t_string, (from1, to1) = timeit(string_decode, dates, names, repeat=1)
+    t_vector, (from2, to2) = timeit(vector_decode, dates, names)
+
+    assert (from1.values == from2.values).all() and (to1.values == to2.values).all()
+
+    print('string split and re-parse: {t:.3f} s'.format(t=t_string))
+    print('vectorized decoding: {t:.3f} s'.format(t=t_vector))
+    print('speedup: {s:.0f}x'.format(s=t_string / t_vector))
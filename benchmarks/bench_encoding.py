@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the size and read throughput of the cache encoding profiles. It writes synthetic half-hourly granules of precipitationCal and randomError over a New Zealand sized bounding box (0.1 degree cells) with each profile and reads them back with read_granules.
+
+Run from the repo root with:
+    python benchmarks/bench_encoding.py
+"""
+import os
+import glob
+import shutil
+import tempfile
+from time import perf_counter
+import numpy as np
+import pandas as pd
+import xarray as xr
+from nasadap.encoding import encoding_profiles, get_profile, quantize, netcdf_encoding
+from nasadap.reader import read_granules
+
+###############################
+### Parameters
+
+name_template = '3B-HHR-E.MS.MRG.3IMERG.{date}-S{start}-E{end}.{minutes:04}.V06B.nc4'
+from_date = '2019-01-01'
+n_granules = 500
+dataset_types = ['precipitationCal', 'randomError']
+lon = np.arange(165.05, 181, 0.1, dtype='f4')
+lat = np.arange(-48.95, -33, 0.1, dtype='f4')
+fill_value = np.float32(-9999.9)
+
+###############################
+### Functions
+
+
+def synthetic_granules():
+    """
+    Precipitation like fields. About 20% of the cells are wet with gamma distributed smooth rates and the rest are zero.
+    """
+    rng = np.random.default_rng(0)
+    times = pd.date_range(from_date, periods=n_granules, freq='30min')
+    ds_list = []
+    for t in times:
+        coarse = rng.gamma(0.5, 2, (len(lon) // 10 + 1, len(lat) // 10 + 1)).astype('f4')
+        field = np.kron(coarse, np.ones((10, 10), 'f4'))[:len(lon), :len(lat)] * rng.uniform(0.5, 1.5, (len(lon), len(lat))).astype('f4')
+        field[field < np.quantile(field, 0.8)] = 0
+        field[:3, :3] = fill_value
+        end_time = t + pd.Timedelta('29min 59.999s')
+        ds = xr.Dataset({'precipitationCal': (('time', 'lon', 'lat'), field[None], {'units': 'mm/hr', '_FillValue': fill_value}),
+                         'randomError': (('time', 'lon', 'lat'), (field * 0.3 + 0.1)[None], {'units': 'mm/hr', '_FillValue': fill_value})},
+                        coords={'time': [end_time], 'lon': lon, 'lat': lat})
+        name = name_template.format(date=t.strftime('%Y%m%d'), start=t.strftime('%H%M%S'), end=end_time.strftime('%H%M%S'), minutes=t.hour * 60 + t.minute)
+        ds_list.append((name, ds))
+    return ds_list
+
+
+def write_granules(cache_dir, ds_list, profile):
+    for name, ds in ds_list:
+        ds1 = quantize(ds, profile)
+        ds1.to_netcdf(os.path.join(cache_dir, name), encoding=netcdf_encoding(ds1, profile))
+
+
+###############################
+### Run
+
+if __name__ == '__main__':
+    ds_list = synthetic_granules()
+    print('{n} granules of {lon} x {lat} cells'.format(n=n_granules, lon=len(lon), lat=len(lat)))
+    print('{p:<14} {s:>10} {r:>10} {w:>10} {e:>10}'.format(p='profile', s='MB', r='read s', w='write s', e='max err'))
+
+    results = {}
+    for name in encoding_profiles:
+        try:
+            profile = get_profile(name)
+        except ValueError as err:
+            print('{p:<14} skipped: {e}'.format(p=name, e=err))
+            continue
+        cache_dir = tempfile.mkdtemp()
+        try:
+            t1 = perf_counter()
+            write_granules(cache_dir, ds_list, profile)
+            t_write = perf_counter() - t1
+            paths = sorted(glob.glob(os.path.join(cache_dir, '*.nc4')))
+            size = sum(os.path.getsize(p) for p in paths)
+            t1 = perf_counter()
+            ds = read_granules(paths, dataset_types)
+            t_read = perf_counter() - t1
+        finally:
+            shutil.rmtree(cache_dir)
+        results[name] = ds
+        ref = results['none']['precipitationCal'].values
+        values = ds['precipitationCal'].values
+        wet = ref > 0
+        err = float(np.max(np.abs(values[wet] - ref[wet]) / ref[wet]))
+        print('{p:<14} {s:>10.1f} {r:>10.2f} {w:>10.2f} {e:>10.4f}'.format(p=name, s=size / 1024**2, r=t_read, w=t_write, e=err))
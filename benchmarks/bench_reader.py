@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the local read of Nasa.get_data on 10k cached granules. It writes synthetic half-hourly granules with the layout of the netcdf cache into a temporary directory and reads the bounding box with the previous open_mfdataset path and with read_granules.
+
+Run from the repo root with:
+    python benchmarks/bench_reader.py
+"""
+import os
+import shutil
+import tempfile
+from time import perf_counter
+import numpy as np
+import pandas as pd
+import xarray as xr
+from nasadap.reader import read_granules
+
+###############################
+### Parameters
+
+name_template = '3B-HHR-E.MS.MRG.3IMERG.{date}-S{start}-E{end}.{minutes:04}.V06B.nc4'
+from_date = '2019-01-01'
+n_granules = 10000
+dataset_types = ['precipitationCal', 'randomError']
+lon = np.arange(160.05, 180, 0.1, dtype='f4')
+lat = np.arange(-49.95, -30, 0.1, dtype='f4')
+min_lat = -48
+max_lat = -35
+min_lon = 165
+max_lon = 178
+
+###############################
+### Functions
+
+
+def write_granules(cache_dir):
+    times = pd.date_range(from_date, periods=n_granules, freq='30min')
+    rng = np.random.default_rng(0)
+    paths = []
+    for t in times:
+        end_time = t + pd.Timedelta('29min 59.999s')
+        name = name_template.format(date=t.strftime('%Y%m%d'), start=t.strftime('%H%M%S'), end=end_time.strftime('%H%M%S'), minutes=t.hour * 60 + t.minute)
+        data = rng.random((1, len(lon), len(lat)), dtype='f4')
+        data[data < 0.05] = -9999.9
+        ds = xr.Dataset({ar: (('time', 'lon', 'lat'), data, {'units': 'mm/hr', '_FillValue': np.float32(-9999.9)}) for ar in dataset_types}, coords={'time': [end_time], 'lon': lon, 'lat': lat}, attrs={'FileHeader': name})
+        path = os.path.join(cache_dir, name)
+        ds.to_netcdf(path)
+        paths.append(path)
+    return paths
+
+
+def mfdataset_read(paths):
+    """
+    The previous local read of get_data.
+    """
+    ds = xr.open_mfdataset(paths, concat_dim='time', combine='nested', parallel=True, preprocess=lambda x: x[dataset_types].sel(lat=slice(min_lat, max_lat), lon=slice(min_lon, max_lon)))
+    return ds[dataset_types].sel(lat=slice(min_lat, max_lat), lon=slice(min_lon, max_lon)).load()
+
+
+def batched_read(paths):
+    return read_granules(paths, dataset_types, min_lat, max_lat, min_lon, max_lon)
+
+
+def timeit(func, *args):
+    t1 = perf_counter()
+    output = func(*args)
+    return perf_counter() - t1, output
+
+
+###############################
+### Run
+
+if __name__ == '__main__':
+    cache_dir = tempfile.mkdtemp()
+    try:
+        print('Writing {n} synthetic granules...'.format(n=n_granules))
+        paths = write_granules(cache_dir)
+
+        t_mf, ds1 = timeit(mfdataset_read, paths)
+        t_batch, ds2 = timeit(batched_read, paths)
+    finally:
+        shutil.rmtree(cache_dir)
+
+    assert ds1.identical(ds2)
+
+    print('open_mfdataset: {t:.2f} s'.format(t=t_mf))
+    print('read_granules: {t:.2f} s'.format(t=t_batch))
+    print('speedup: {s:.1f}x'.format(s=t_mf / t_batch))
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the dap and hdf5 transports of Nasa.get_data at high concurrency. It downloads the same period and bounding box with both transports into separate temporary cache directories.
+
+It needs an Earthdata login. Run from the repo root with:
+    NASA_USERNAME=... NASA_PASSWORD=... python benchmarks/bench_transport.py
+"""
+import os
+import shutil
+import tempfile
+from time import perf_counter
+from nasadap import Nasa
+
+###############################
+### Parameters
+
+username = os.environ.get('NASA_USERNAME')
+password = os.environ.get('NASA_PASSWORD')
+
+mission = 'gpm'
+product = '3IMERGHHE'
+version = 6
+dataset_types = ['precipitationCal']
+from_date = '2019-03-28'
+to_date = '2019-03-29'
+min_lat = -49
+max_lat = -33
+min_lon = 165
+max_lon = 180
+dl_sim_count = 60
+
+###############################
+### Functions
+
+
+def run(transport):
+    cache_dir = tempfile.mkdtemp()
+    try:
+        ge = Nasa(username, password, mission, cache_dir)
+        t1 = perf_counter()
+        ds = ge.get_data(product, version, dataset_types, from_date, to_date, min_lat, max_lat, min_lon, max_lon, dl_sim_count=dl_sim_count, transport=transport).load()
+        t2 = perf_counter() - t1
+        stats = ge.download_stats
+        stats.update(ge.session_pool.stats())
+        ge.close()
+    finally:
+        shutil.rmtree(cache_dir)
+    return t2, ds, stats
+
+
+###############################
+### Run
+
+if __name__ == '__main__':
+    if (username is None) or (password is None):
+        raise ValueError('Set the NASA_USERNAME and NASA_PASSWORD environment variables')
+
+    results = {}
+    for transport in ['dap', 'hdf5']:
+        results[transport] = run(transport)
+
+    assert results['dap'][1].equals(results['hdf5'][1])
+
+    for transport, (t, ds, stats) in results.items():
+        print('{transport}: {t:.1f} s, {n} granules, {throughput:.2f} files/s, final limit {limit}, {requests} requests'.format(transport=transport, t=t, n=len(ds.time), **stats))
+    print('speedup: {s:.1f}x'.format(s=results['dap'][0] / results['hdf5'][0]))
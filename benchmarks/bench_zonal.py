@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the zonal means of half-hourly granules over catchments. It makes synthetic star shaped catchments over a New Zealand sized grid (0.1 degree cells), computes and caches their weights, and reduces synthetic half-hourly data to catchment means with zonal_mean.
+
+Run from the repo root with:
+    python benchmarks/bench_zonal.py
+"""
+import shutil
+import tempfile
+from time import perf_counter
+import numpy as np
+import pandas as pd
+import xarray as xr
+from nasadap.zonal import zonal_weights, zonal_mean
+
+###############################
+### Parameters
+
+n_zones = 2000
+n_vertices = 200
+n_steps = 4000
+lon = np.arange(165.05, 181, 0.1)
+lat = np.arange(-48.95, -33, 0.1)
+
+###############################
+### Functions
+
+
+def synthetic_zones():
+    rng = np.random.default_rng(0)
+    angles = np.linspace(0, 2 * np.pi, n_vertices, endpoint=False)
+    zones = {}
+    for i in range(n_zones):
+        x, y = rng.uniform(166, 180), rng.uniform(-48, -34)
+        r = rng.uniform(0.05, 0.4) * (1 + 0.3 * np.sin(angles * rng.integers(3, 9)))
+        zones['zone_{}'.format(i)] = {'type': 'Polygon', 'coordinates': [np.column_stack([x + r * np.cos(angles), y + r * np.sin(angles)]).tolist()]}
+    return zones
+
+
+def synthetic_data():
+    data = np.random.default_rng(0).gamma(0.5, 2, (n_steps, len(lon), len(lat))).astype('f4')
+    return xr.Dataset({'precipitationCal': (('time', 'lon', 'lat'), data, {'units': 'mm/hr'})}, coords={'time': pd.date_range('2019-01-01 00:29:59.999', periods=n_steps, freq='30min'), 'lon': lon, 'lat': lat})
+
+
+###############################
+### Run
+
+if __name__ == '__main__':
+    zones = synthetic_zones()
+    ds = synthetic_data()
+    cache_dir = tempfile.mkdtemp()
+    try:
+        t1 = perf_counter()
+        w = zonal_weights(lon, lat, zones, cache_dir=cache_dir)
+        t_weights = perf_counter() - t1
+        t1 = perf_counter()
+        zonal_weights(lon, lat, zones, cache_dir=cache_dir)
+        t_cached = perf_counter() - t1
+        t1 = perf_counter()
+        zm = zonal_mean(ds, zones, cache_dir=cache_dir)
+        t_mean = perf_counter() - t1
+    finally:
+        shutil.rmtree(cache_dir)
+
+    steps_per_year = 365 * 48
+    print('{z} zones over {lon} x {lat} cells with {nnz} weights'.format(z=n_zones, lon=len(lon), lat=len(lat), nnz=w['weights'].nnz))
+    print('weights: {t:.2f} s, cached: {c:.3f} s'.format(t=t_weights, c=t_cached))
+    print('zonal_mean of {n} time steps: {t:.2f} s ({y:.1f} s per year of half-hourly data)'.format(n=n_steps, t=t_mean, y=t_mean / n_steps * steps_per_year))
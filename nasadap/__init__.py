@@ -1,3 +1,5 @@
 from nasadap.core import Nasa
-from nasadap.util import parse_nasa_catalog, mission_product_dict
+from nasadap.util import parse_nasa_catalog, get_catalog_bounds, mission_product_dict
+from nasadap.catalog import get_catalog
 from nasadap import agg
+from nasadap import zonal
@@ -3,10 +3,21 @@
 Aggregation functions♀
 """
 import os
+import json
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
 import xarray as xr
-from nasadap import Nasa, parse_nasa_catalog
+import netCDF4
+from xarray.coding.times import encode_cf_datetime
+from nasadap import Nasa
+from nasadap import catalog
+from nasadap.catalog import get_catalog, update_catalog
+from nasadap.encoding import get_profile, quantize, netcdf_encoding, compressions
+from nasadap.reader import netcdf_lock, hdf5_lock
+from nasadap.pipeline import run_pipeline
+from nasadap.rollup import Rollup, rollup_levels, rollup_chunks, check_levels
+from nasadap.util import product_freq
 #from core import Nasa
 #from util import parse_nasa_catalog
 
@@ -16,12 +27,15 @@ from nasadap import Nasa, parse_nasa_catalog
 
 sp_file_name = '{mission}_{product}_v{version:02}'
 file_name = '{mission}_{product}_v{version:02}_{from_date}-{to_date}.nc4'
+manifest_name = '{mission}_{product}_v{version:02}_manifest.json'
+rollup_file_name = '{mission}_{product}_v{version:02}_{level}_{year}.nc4'
+append_time_units = 'milliseconds since 1970-01-01'
 
 ####################################################
 ### Aggregate files
 
 
-def time_combine(mission, product, version, datasets, save_dir, username, password, cache_dir, tz_hour_gmt, freq, min_lat, max_lat, min_lon, max_lon, dl_sim_count):
+def time_combine(mission, product, version, datasets, save_dir, username, password, cache_dir, tz_hour_gmt, freq, min_lat, max_lat, min_lon, max_lon, dl_sim_count, encoding='none', incremental=False, workers=1, prefetch=0):
     """
     Function to aggregate the data from the cache to netcdf files and update the cache if new data has been added to the NASA server.
 
@@ -54,86 +68,445 @@ def time_combine(mission, product, version, datasets, save_dir, username, passwo
     max_lon : int, float, or None
         The maximum lon to extract in WGS84 decimal degrees.
     dl_sim_count : int
-        The number of simultaneous downloads on a single thread. Speed could be increase with more simultaneous downloads, but up to a limit of the PC's single thread speed.
+        The max number of simultaneous downloads. The number of simultaneous downloads is adjusted to the server's latency and error rates up to this max.
+    encoding : str or dict
+        The encoding profile of the aggregated files and the cache. See encoding_profiles in the encoding module.
+    incremental : bool
+        Should only the new time steps be appended to the files? There's one file per period with an unlimited time dimension, and the last time step that has been aggregated is kept in a manifest. The new granules are streamed a day at a time and appended, so an update only costs the new data rather than rewriting the latest file. The incremental files are separate from the files of the default mode.
+    workers : int
+        The number of worker processes that aggregate the periods concurrently (other than in the incremental mode). The workers share the cache and dl_sim_count is split between them. The days that neighbouring periods both need after the time zone shift are downloaded before the workers start, so no two workers download and write the same granules. 1 runs the periods one after another in this process.
+    prefetch : int
+        With one worker, the number of periods that can be downloaded ahead of the one being combined and written. The download, the combine (time zone shift and merge), and the write of consecutive periods run in a pipeline of threads, so the network and the disk are busy at the same time. Up to 2 * prefetch + 3 periods can be in memory at once. 0 runs the three steps of each period one after another. A ValueError is raised if it's combined with workers > 1.
 
     Returns
     -------
     None
     """
-    time_dict = {'long_name': 'time', 'tz': 'GMT{}'.format(tz_hour_gmt)}
-
     if isinstance(datasets, str):
         datasets = [datasets]
 
-    ge = Nasa(username, password, mission, cache_dir)
+    if (workers > 1) and (prefetch > 0):
+        raise ValueError('prefetch can only be used with one worker')
+    profile = get_profile(encoding)
+    ge = Nasa(username, password, mission, cache_dir, cache_encoding=encoding)
     sp_file_name1 = sp_file_name.format(mission=mission, product=product, version=version)
     product_path = os.path.join(save_dir, mission + '_' + product)
     if not os.path.exists(product_path):
         os.makedirs(product_path)
-    files1 = [os.path.join(product_path, f) for f in os.listdir(product_path) if sp_file_name1 in f]
+
+    if incremental:
+        append_combine(ge, mission, product, version, datasets, product_path, tz_hour_gmt, freq, min_lat, max_lat, min_lon, max_lon, dl_sim_count, profile)
+        return
+    files1 = sorted(os.path.join(product_path, f) for f in os.listdir(product_path) if sp_file_name1 in f)
 
     print('*Reading existing files...')
-    min_max = parse_nasa_catalog(mission, product, version, min_max=True)
+    min_max = get_catalog(mission, product, version, ge.cache_dir, min_max=True)
     end_date = str(min_max['to_date'].iloc[-1].date())
     if files1:
         latest_file = files1[-1]
-        ds0 = xr.open_dataset(latest_file)
-        ds1 = ds0.copy()
-        ds0.close()
-        del ds0
-        time0 = ds1.time.to_index()
+        with netcdf_lock:
+            with xr.open_dataset(latest_file) as ds0:
+                time0 = ds0.time.to_index()
         start_date = str(time0.max().date())
-        max_test_date = ds1.time.max().values
+        max_test_date = time0.max().to_datetime64()
     else:
         start_date = str(min_max['from_date'].iloc[0].date())
         max_test_date = np.datetime64('1900-01-01')
         latest_file = None
-        ds1 = None
 
     ### Prepare the date ranges
     end_dates = pd.date_range(start_date, end_date, freq=freq)
     if not end_date in end_dates:
         end_dates = end_dates.append(pd.to_datetime([end_date]))
-    start_dates1 = pd.PeriodIndex(end_dates, freq=freq).astype('datetime64[ns]').values
+    start_dates1 = pd.PeriodIndex(end_dates, freq=freq).astype('datetime64[ns]').values.copy()
     start_dates1[0] = start_date
     if pd.Timestamp(start_dates1[0]) > end_dates[0]:
         start_dates1[0] = end_dates[0]
     start_dates = pd.to_datetime(start_dates1)
     dates = list(zip(start_dates, end_dates))
 
+    ### Only the first period is merged with the latest file, so the others are independent
     print('*Reading new files...')
-    new_paths = []
-    for s, e in dates:
-        print(str(s.date()), str(e.date()))
-        s1 = str((s - pd.DateOffset(hours=tz_hour_gmt)).date())
-        e1 =  str((e + pd.DateOffset(hours=tz_hour_gmt)).date())
-        ds2 = ge.get_data(product, version, datasets, from_date=s1, to_date=e1, min_lat=min_lat, max_lat=max_lat, min_lon=min_lon, max_lon=max_lon, dl_sim_count=dl_sim_count).load()
-        ds2['time'] = ds2.time.to_index() + pd.DateOffset(hours=tz_hour_gmt)
-        ds2['time'].attrs = time_dict
-        ds2 = ds2.sel(time=slice(s, str(e.date())))
-        if max_test_date != ds2.time.max().values:
-            print('*New data will be added')
-            if isinstance(ds1, xr.Dataset):
-                ds2 = ds2.combine_first(ds1).sortby('time')
-                ds1.close()
-                s = pd.Timestamp(ds2.time.min().data).floor('D')
-            attr_dict = {key: value for key, value in ds2.attrs.items() if key in ['title']}
-            if not 'title' in attr_dict:
-                attr_dict['title'] = ' '.join([mission, product])
-            attr_dict.update({'ProductionTime': pd.Timestamp.now().isoformat(), 'institution': 'Environment Canterbury', 'source': 'Aggregated from NASA data'})
-            ds2.attrs = attr_dict
-            print('*Saving new data...')
-            new_dates = ds2.time.to_index().strftime('%Y%m%d')
-            new_file_name = file_name.format(mission=mission, product=product, version=version, from_date=min(new_dates), to_date=max(new_dates))
-            new_file_path = os.path.join(product_path, new_file_name)
-            ds2.to_netcdf(new_file_path)
-            ds2.close()
-        else:
-            ds1 = None
-            new_file_path = None
-            print('*No data to be updated')
-        new_paths.append(new_file_path)
+    period_args = (mission, product, version, datasets, product_path, tz_hour_gmt, min_lat, max_lat, min_lon, max_lon)
+    jobs = [dict(start=s, end=e, latest_file=latest_file if i == 0 else None, max_test_date=max_test_date) for i, (s, e) in enumerate(dates)]
+    workers = min(workers, len(jobs))
+    if workers > 1:
+        ## The catalog store is built (or its background build is waited for) before the workers start, so they only read it
+        update_catalog(mission, product, version, ge.cache_dir)
+
+        ## The days that are shared by neighbouring periods are cached first, so the workers only read them
+        days = shared_days(dates, tz_hour_gmt)
+        if days:
+            print('*Downloading the days that are shared by the periods...')
+        for day in days:
+            ge.get_data(product, version, datasets, from_date=day, to_date=day, min_lat=min_lat, max_lat=max_lat, min_lon=min_lon, max_lon=max_lon, dl_sim_count=dl_sim_count)
+        ge.close()
+        login = (username, password, mission, cache_dir, encoding)
+        period_dl_count = max(dl_sim_count // workers, 1)
+        with ProcessPoolExecutor(workers) as executor:
+            futures = [executor.submit(period_worker, login, period_args, period_dl_count, **job) for job in jobs]
+            new_paths = [f.result() for f in futures]
+    elif prefetch > 0:
+        stages = [lambda job: (job, fetch_period(ge, product, version, datasets, tz_hour_gmt, min_lat, max_lat, min_lon, max_lon, job['start'], job['end'], dl_sim_count)),
+                  lambda x: transform_period(x[1], mission, product, tz_hour_gmt, profile=profile, **x[0]),
+                  lambda ds2: write_period(ds2, mission, product, version, product_path, profile)]
+        new_paths = list(run_pipeline(jobs, stages, prefetch))
+    else:
+        new_paths = [combine_period(ge, *period_args, dl_sim_count=dl_sim_count, profile=profile, **job) for job in jobs]
+
     if isinstance(latest_file, str) & isinstance(new_paths[0], str):
-        if os.path.split(latest_file)[1] != os.path.split(new_file_path)[1]:
+        if os.path.split(latest_file)[1] != os.path.split(new_paths[0])[1]:
             print('*Removing old file')
             os.remove(latest_file)
+
+
+def combine_period(ge, mission, product, version, datasets, product_path, tz_hour_gmt, min_lat, max_lat, min_lon, max_lon, start, end, dl_sim_count, profile, latest_file=None, max_test_date=None):
+    """
+    Function to aggregate one period of time_combine and save it to a netcdf file. If latest_file is passed, then it's merged with the new data. Returns the path of the new file or None if there's no new data.
+    """
+    ds2 = fetch_period(ge, product, version, datasets, tz_hour_gmt, min_lat, max_lat, min_lon, max_lon, start, end, dl_sim_count)
+    ds2 = transform_period(ds2, mission, product, tz_hour_gmt, start, end, profile, latest_file, max_test_date)
+    return write_period(ds2, mission, product, version, product_path, profile)
+
+
+def fetch_period(ge, product, version, datasets, tz_hour_gmt, min_lat, max_lat, min_lon, max_lon, start, end, dl_sim_count):
+    """
+    Function to get the data of a period of time_combine (in UTC) from the cache and the NASA server.
+    """
+    print(str(start.date()), str(end.date()))
+    s1, e1 = period_days(start, end, tz_hour_gmt)
+    return ge.get_data(product, version, datasets, from_date=s1, to_date=e1, min_lat=min_lat, max_lat=max_lat, min_lon=min_lon, max_lon=max_lon, dl_sim_count=dl_sim_count).load()
+
+
+def period_days(start, end, tz_hour_gmt):
+    """
+    Function to get the first and last UTC days (as str) that are downloaded for a period of time_combine.
+    """
+    s1 = str((start - pd.DateOffset(hours=tz_hour_gmt)).date())
+    e1 = str((end + pd.DateOffset(hours=tz_hour_gmt)).date())
+    return s1, e1
+
+
+def shared_days(dates, tz_hour_gmt):
+    """
+    Function to get the UTC days (as str) that are downloaded for more than one of the (start, end) periods of time_combine.
+    """
+    counts = pd.Series(0, index=pd.DatetimeIndex([]))
+    for start, end in dates:
+        days = pd.date_range(*period_days(start, end, tz_hour_gmt), freq='D')
+        counts = counts.add(pd.Series(1, index=days), fill_value=0)
+    return [str(day.date()) for day in counts.index[counts > 1]]
+
+
+def transform_period(ds2, mission, product, tz_hour_gmt, start, end, profile, latest_file=None, max_test_date=None):
+    """
+    Function to shift the data of a period to the time zone, merge it with latest_file if it's passed, and bit round it. Returns None if there's no new data.
+    """
+    time_dict = {'long_name': 'time', 'tz': 'GMT{}'.format(tz_hour_gmt)}
+    ds2['time'] = ds2.time.to_index() + pd.DateOffset(hours=tz_hour_gmt)
+    ds2['time'].attrs = time_dict
+    ds2 = ds2.sel(time=slice(start, str(end.date())))
+    if max_test_date == ds2.time.max().values:
+        print('*No data to be updated')
+        return None
+
+    print('*New data will be added')
+    if isinstance(latest_file, str):
+        with netcdf_lock:
+            with xr.open_dataset(latest_file) as ds0:
+                ds1 = ds0.load()
+        ds2 = ds2.combine_first(ds1).sortby('time')
+    attr_dict = {key: value for key, value in ds2.attrs.items() if key in ['title']}
+    if not 'title' in attr_dict:
+        attr_dict['title'] = ' '.join([mission, product])
+    attr_dict.update({'ProductionTime': pd.Timestamp.now().isoformat(), 'institution': 'Environment Canterbury', 'source': 'Aggregated from NASA data'})
+    ds2.attrs = attr_dict
+
+    return quantize(ds2, profile)
+
+
+def write_period(ds2, mission, product, version, product_path, profile):
+    """
+    Function to save the output of transform_period to a netcdf file named by its dates. Returns the file path or None if ds2 is None.
+    """
+    if ds2 is None:
+        return None
+
+    print('*Saving new data...')
+    new_dates = ds2.time.to_index().strftime('%Y%m%d')
+    new_file_name = file_name.format(mission=mission, product=product, version=version, from_date=min(new_dates), to_date=max(new_dates))
+    new_file_path = os.path.join(product_path, new_file_name)
+    with netcdf_lock:
+        ds2.to_netcdf(new_file_path, encoding=netcdf_encoding(ds2, profile))
+    ds2.close()
+
+    return new_file_path
+
+
+def period_worker(login, period_args, dl_sim_count, **job):
+    """
+    Function to run combine_period in a worker process of time_combine. Each worker has its own Nasa session on the shared cache. The workers don't build the catalog store, as the parent process builds it.
+    """
+    catalog.background_builds = False
+    username, password, mission, cache_dir, encoding = login
+    ge = Nasa(username, password, mission, cache_dir, cache_encoding=encoding)
+    try:
+        new_file_path = combine_period(ge, *period_args, dl_sim_count=dl_sim_count, profile=get_profile(encoding), **job)
+    finally:
+        ge.close()
+
+    return new_file_path
+
+
+def read_manifest(path):
+    """
+    Function to read the manifest of the incremental files. Returns None if it doesn't exist.
+    """
+    if os.path.isfile(path):
+        with open(path, 'r') as f:
+            manifest = json.load(f)
+    else:
+        manifest = None
+
+    return manifest
+
+
+def save_manifest(manifest, path):
+    """
+    Function to save the manifest of the incremental files. The file is written to a temp file first and then moved so that readers never see a partial file.
+    """
+    temp_path = path + '.' + str(os.getpid())
+    with open(temp_path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(temp_path, path)
+
+
+def append_netcdf(path, ds, overwrite=False):
+    """
+    Function to append the time steps of a dataset to a netcdf file with an unlimited time dimension. Only the time steps after the last time step of the file are appended, so appending the same data again does nothing.
+
+    Parameters
+    ----------
+    path : str
+        The netcdf file path.
+    ds : xarray dataset
+        The time steps with the same variables, lon, and lat as the file.
+    overwrite : bool
+        Should the time steps of the file from the first time step of ds onwards be overwritten instead?
+
+    Returns
+    -------
+    int
+        The number of written time steps.
+    """
+    with netcdf_lock, hdf5_lock:
+        with netCDF4.Dataset(path, 'a') as nc:
+            time = nc['time']
+            values = encode_cf_datetime(ds.time.values, time.units, getattr(time, 'calendar', 'standard'))[0]
+            n = len(time)
+            if overwrite and len(values):
+                n = int(np.searchsorted(np.asarray(time[:]), values[0]))
+            elif n:
+                index = np.flatnonzero(values > time[n - 1])
+                ds = ds.isel(time=index)
+                values = values[index]
+            k = len(values)
+            if k:
+                time[n:(n + k)] = values
+                for ar in ds.data_vars:
+                    data = ds[ar].transpose(*nc[ar].dimensions).values
+                    nc[ar][n:(n + k)] = np.ma.masked_invalid(data) if data.dtype.kind == 'f' else data
+                nc.setncattr('ProductionTime', pd.Timestamp.now().isoformat())
+
+    return k
+
+
+def new_netcdf(path, ds, profile, time_chunk):
+    """
+    Function to save a dataset to a new netcdf file with an unlimited time dimension that append_netcdf can append to. The variables are chunked by time_chunk time steps and always compressed with the encoding profile, as the file grows past min_compress_size.
+    """
+    encoding = {ar: dict(compressions[profile['compression']], chunksizes=(time_chunk,) + ds[ar].shape[1:]) for ar in ds.data_vars}
+    encoding['time'] = {'units': append_time_units, 'dtype': 'int64'}
+    with netcdf_lock:
+        ds.to_netcdf(path, encoding=encoding, unlimited_dims=['time'])
+
+
+def append_combine(ge, mission, product, version, datasets, product_path, tz_hour_gmt, freq, min_lat, max_lat, min_lon, max_lon, dl_sim_count, profile):
+    """
+    Function to append the new time steps to the incremental files of time_combine. The granules after the last aggregated time step (the high-water mark in the manifest) are streamed a day at a time with iter_data, shifted to the time zone, and appended to the file of their period. The manifest is updated after each day.
+    """
+    time_dict = {'long_name': 'time', 'tz': 'GMT{}'.format(tz_hour_gmt)}
+    manifest_path = os.path.join(product_path, manifest_name.format(mission=mission, product=product, version=version))
+    settings = {'mission': mission, 'product': product, 'version': version, 'datasets': datasets, 'tz_hour_gmt': tz_hour_gmt, 'freq': freq, 'bbox': [min_lat, max_lat, min_lon, max_lon]}
+
+    manifest = read_manifest(manifest_path)
+    if manifest is None:
+        manifest = dict(settings, last_time=None, files={})
+    elif any(manifest[k] != v for k, v in settings.items()):
+        raise ValueError('The datasets, time zone, freq, and bounding box must be the same as the existing incremental files: ' + str({k: manifest[k] for k in settings}))
+
+    min_max = get_catalog(mission, product, version, ge.cache_dir, min_max=True)
+    if manifest['last_time'] is None:
+        last_time = None
+        from_date = str(min_max['from_date'].iloc[0].date())
+    else:
+        last_time = pd.Timestamp(manifest['last_time'])
+        from_date = str((last_time - pd.DateOffset(hours=tz_hour_gmt)).date())
+    to_date = str(min_max['to_date'].iloc[-1].date())
+
+    print('*Appending the time steps after {t}...'.format(t=last_time))
+    day_slots = int(pd.Timedelta(days=1) / pd.Timedelta(product_freq[product]))
+    n_new = 0
+    for ds in ge.iter_data(product, version, datasets, from_date=from_date, to_date=to_date, min_lat=min_lat, max_lat=max_lat, min_lon=min_lon, max_lon=max_lon, dl_sim_count=dl_sim_count):
+        ds = ds.assign_coords(time=ds.time.to_index() + pd.DateOffset(hours=tz_hour_gmt))
+        if last_time is not None:
+            ds = ds.isel(time=np.flatnonzero(ds.time.to_index() > last_time))
+        if not len(ds.time):
+            continue
+        ds = quantize(ds, profile)
+
+        periods = pd.PeriodIndex(ds.time.to_index(), freq=freq)
+        for period in periods.unique():
+            ds1 = ds.isel(time=np.flatnonzero(periods == period))
+            period_name = str(period)
+            if period_name in manifest['files']:
+                new_file_path = os.path.join(product_path, manifest['files'][period_name])
+                n_new += append_netcdf(new_file_path, ds1)
+            else:
+                new_file_name = file_name.format(mission=mission, product=product, version=version, from_date=period.start_time.strftime('%Y%m%d'), to_date=period.end_time.strftime('%Y%m%d'))
+                new_file_path = os.path.join(product_path, new_file_name)
+                ds1 = ds1.copy()
+                ds1['time'].attrs = time_dict
+                ds1.attrs = {'title': ' '.join([mission, product]), 'ProductionTime': pd.Timestamp.now().isoformat(), 'institution': 'Environment Canterbury', 'source': 'Aggregated from NASA data'}
+                new_netcdf(new_file_path, ds1, profile, day_slots)
+                n_new += len(ds1.time)
+                manifest['files'][period_name] = new_file_name
+
+        last_time = ds.time.to_index().max()
+        manifest['last_time'] = last_time.isoformat()
+        save_manifest(manifest, manifest_path)
+
+    if n_new:
+        print('*Appended {n} time steps up to {t}'.format(n=n_new, t=last_time))
+    else:
+        print('*No data to be updated')
+
+
+####################################################
+### Rollups
+
+
+def rollup_combine(mission, product, version, datasets, save_dir, username, password, cache_dir, tz_hour_gmt, min_lat, max_lat, min_lon, max_lon, dl_sim_count, levels=('h', 'D', 'M'), encoding='none'):
+    """
+    Function to resample the data from the cache to a rollup pyramid of sums, means, and maxima (e.g. hourly, daily, and monthly) in the time zone and update it if new data has been added to the NASA server. The granules are streamed a day at a time and each level is computed from the one below it, so the memory use doesn't depend on the date range. Each level has a netcdf file per year in the rollup folder of the product.
+
+    The time of a bin is its start in the time zone. The bins at the end of the data are saved with complete set to 0 and are recomputed on the next update, which starts from the first incomplete bin of the coarsest level. The steps variable is the number of time steps in a bin (e.g. the first day of the data is usually only partly covered in the time zone). Sums of rates per hour (e.g. precipitationCal in mm/hr) are totals (mm).
+
+    Parameters
+    ----------
+    mission : str
+        Mission name.
+    product : str
+        The product associated with the mission.
+    datasets : str or list of str
+        The dataset(s) to be resampled.
+    save_dir : str
+        The path to where the rollup folder of the product should be saved.
+    username : str
+        The username for the login.
+    password : str
+        The password for the login.
+    cach_dir : str or None
+        A path to cache the netcdf files for future reading. If None, the currently working directory is used.
+    tz_hour_gmt : int
+        The timezone hour from GMT. e.g. GMT+12 would simply be 12.
+    min_lat : int, float, or None
+        The minimum lat to extract in WGS84 decimal degrees.
+    max_lat : int, float, or None
+        The maximum lat to extract in WGS84 decimal degrees.
+    min_lon : int, float, or None
+        The minimum lon to extract in WGS84 decimal degrees.
+    max_lon : int, float, or None
+        The maximum lon to extract in WGS84 decimal degrees.
+    dl_sim_count : int
+        The max number of simultaneous downloads.
+    levels : list or tuple of str
+        The levels of the pyramid from fine to coarse. Any of 'h' (hourly), 'D' (daily), 'M' (monthly), and 'Y' (yearly).
+    encoding : str or dict
+        The encoding profile of the files and the cache. See encoding_profiles in the encoding module.
+
+    Returns
+    -------
+    None
+    """
+    if isinstance(datasets, str):
+        datasets = [datasets]
+    levels = list(levels)
+    check_levels(levels)
+
+    profile = get_profile(encoding)
+    ge = Nasa(username, password, mission, cache_dir, cache_encoding=encoding)
+    rollup_path = os.path.join(save_dir, mission + '_' + product, 'rollup')
+    if not os.path.exists(rollup_path):
+        os.makedirs(rollup_path)
+
+    manifest_path = os.path.join(rollup_path, manifest_name.format(mission=mission, product=product, version=version))
+    settings = {'mission': mission, 'product': product, 'version': version, 'datasets': list(datasets), 'tz_hour_gmt': tz_hour_gmt, 'bbox': [min_lat, max_lat, min_lon, max_lon], 'levels': levels}
+    manifest = read_manifest(manifest_path)
+    if manifest is None:
+        manifest = dict(settings, files={})
+    elif any(manifest[k] != v for k, v in settings.items()):
+        raise ValueError('The datasets, time zone, bounding box, and levels must be the same as the existing rollup: ' + str({k: manifest[k] for k in settings}))
+
+    ### Start from the first incomplete bin of the coarsest level
+    min_max = get_catalog(mission, product, version, ge.cache_dir, min_max=True)
+    top = levels[-1]
+    if top in manifest['files']:
+        with netcdf_lock:
+            with xr.open_dataset(os.path.join(rollup_path, manifest['files'][top])) as ds0:
+                times = ds0.time.to_index()
+                incomplete = np.flatnonzero(ds0['complete'].values == 0)
+        if len(incomplete):
+            start_time = times[incomplete[0]]
+        else:
+            start_time = (times[-1].to_period(top) + 1).start_time
+        from_date = str((start_time - pd.DateOffset(hours=tz_hour_gmt)).date())
+    else:
+        start_time = None
+        from_date = str(min_max['from_date'].iloc[0].date())
+    to_date = str(min_max['to_date'].iloc[-1].date())
+
+    print('*Resampling the time steps from {t}...'.format(t=start_time if start_time is not None else from_date))
+    rollup = Rollup(levels, product_freq[product])
+    attrs = {'title': ' '.join([mission, product]), 'institution': 'Environment Canterbury', 'source': 'Resampled from NASA data'}
+    time_dict = {'long_name': 'start time of the bin', 'tz': 'GMT{}'.format(tz_hour_gmt)}
+
+    def save_bins(partial=False):
+        for level, ds1 in rollup.pop(partial).items():
+            years = ds1.time.to_index().year
+            for year in np.unique(years):
+                ds2 = ds1.isel(time=np.flatnonzero(years == year))
+                new_file_name = rollup_file_name.format(mission=mission, product=product, version=version, level=rollup_levels[level], year=year)
+                new_file_path = os.path.join(rollup_path, new_file_name)
+                if os.path.isfile(new_file_path):
+                    append_netcdf(new_file_path, ds2, overwrite=True)
+                else:
+                    ds2['time'].attrs = time_dict
+                    ds2.attrs = dict(attrs, freq=rollup_levels[level], ProductionTime=pd.Timestamp.now().isoformat())
+                    new_netcdf(new_file_path, ds2, profile, rollup_chunks[level])
+                manifest['files'][level] = new_file_name
+
+    for ds in ge.iter_data(product, version, datasets, from_date=from_date, to_date=to_date, min_lat=min_lat, max_lat=max_lat, min_lon=min_lon, max_lon=max_lon, dl_sim_count=dl_sim_count):
+        ds = ds.assign_coords(time=ds.time.to_index() + pd.DateOffset(hours=tz_hour_gmt))
+        if start_time is not None:
+            ds = ds.isel(time=np.flatnonzero(ds.time.to_index() >= start_time))
+        if len(ds.time):
+            rollup.add(ds)
+            save_bins()
+
+    save_bins(True)
+    save_manifest(manifest, manifest_path)
+    if rollup.last_time is None:
+        print('*No data to be resampled')
+    else:
+        print('*Resampled up to {t}'.format(t=rollup.last_time))
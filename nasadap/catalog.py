@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent on-disk store of the NASA Hyrax catalog.
+"""
+import os
+import pickle
+import threading
+import pandas as pd
+from nasadap.util import mission_product_dict, parse_catalog_refs, parse_refs_xml, parse_dates_xml, process_date_list, get_product_dir, get_catalog_bounds
+from nasadap.crawler import fetch_catalogs
+
+###############################################
+### Parameters
+
+catalog_file_name = 'catalog.pickle'
+catalog_max_age = 1800
+
+## Should get_catalog build a missing store in the background? It's turned off in the worker processes of time_combine, so they don't each crawl the server.
+background_builds = True
+
+## The threads that build the catalog stores in the background by store path. The threads of the parent don't exist in a forked process.
+_builds = {}
+_builds_lock = threading.Lock()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_builds.clear)
+
+###############################################
+### Functions
+
+
+def catalog_path(cache_dir, mission, product, version):
+    """
+    Function to get the path of the catalog store for a mission, product, and version.
+
+    Parameters
+    ----------
+    cache_dir : str
+        The cache directory used by the Nasa class.
+    mission : str
+        Mission name.
+    product : str
+        The product associated with the mission.
+    version : int
+        The product version.
+
+    Returns
+    -------
+    str
+    """
+    product_dir = get_product_dir(mission, product, version)
+    path = os.path.join(cache_dir, mission_product_dict[mission]['process_level'], product_dir, catalog_file_name)
+
+    return path
+
+
+def read_catalog(path):
+    """
+    Function to read the catalog store. Returns None if it doesn't exist.
+    """
+    if os.path.isfile(path):
+        with open(path, 'rb') as handle:
+            store = pickle.load(handle)
+    else:
+        store = None
+
+    return store
+
+
+def partial_path(path):
+    """
+    Function to get the path of the partial catalog store of an unfinished build.
+    """
+    return path + '.partial'
+
+
+def save_catalog(store, path):
+    """
+    Function to save the catalog store. The file is written to a temp file first and then moved so that readers never see a partial file.
+    """
+    cat_dir = os.path.split(path)[0]
+    if not os.path.exists(cat_dir):
+        os.makedirs(cat_dir)
+    temp_path = path + '.' + str(os.getpid())
+    with open(temp_path, 'wb') as handle:
+        pickle.dump(store, handle, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, path)
+
+
+def update_catalog(mission, product, version, cache_dir, max_age=catalog_max_age):
+    """
+    Function to update the catalog store from the NASA Hyrax server and return all of the granules. Only the newest year and day catalogs are re-crawled along with any year or day catalogs that are new or whose modified date has changed. The day catalogs are crawled a year at a time, and while the store is first built the crawled years are saved to a partial store, so a build that's interrupted (e.g. a background build when the process exits) continues from there on the next call.
+
+    Parameters
+    ----------
+    mission : str
+        Mission name.
+    product : str
+        The product associated with the mission.
+    version : int
+        The product version.
+    cache_dir : str
+        The cache directory used by the Nasa class.
+    max_age : int
+        The number of seconds since the last refresh within which the store is returned without contacting the server. Pass 0 to always refresh.
+
+    Returns
+    -------
+    DataFrame
+        Same structure as the output of parse_nasa_catalog.
+    """
+    path = catalog_path(cache_dir, mission, product, version)
+
+    ## Wait for a background build of the store rather than crawling the server twice
+    thread = _builds.get(path)
+    if (thread is not None) and (thread is not threading.current_thread()):
+        thread.join()
+
+    store = read_catalog(path)
+    now = pd.Timestamp.now(tz='utc')
+
+    if isinstance(store, dict):
+        building = False
+        if (now - store['refreshed']).total_seconds() < max_age:
+            return store['granules'].copy()
+    else:
+        building = True
+        store = read_catalog(partial_path(path))
+        if store is None:
+            store = {'years': {}, 'days': {}, 'granules': None}
+
+    print('Updating the catalog from the NASA server...')
+
+    ## Parse available years
+    base_url = mission_product_dict[mission]['base_url']
+    years_url = '/'.join([base_url, 'opendap/hyrax', mission_product_dict[mission]['process_level'], get_product_dir(mission, product, version)])
+    years_lst = parse_catalog_refs(years_url)
+    if not years_lst:
+        raise ValueError('No combination of product and version in specified mission')
+    years_dict = {int(y[0]): y[2] for y in years_lst}
+
+    old_days = store['days']
+    if old_days:
+        last_old_day = max(old_days)
+    else:
+        last_old_day = None
+    last_year = max(years_dict)
+    crawl_years = [y for y, m in years_dict.items() if (y not in store['years']) or (m != store['years'][y]) or (y == last_year) or (last_old_day is not None and y == last_old_day.year)]
+
+    ## Parse available days of the changed years
+    contents = fetch_catalogs(['/'.join([years_url, str(y)]) for y in crawl_years])
+
+    days_dict = {}
+    for y, content in zip(crawl_years, contents):
+        for name, ID, modified in parse_refs_xml(content):
+            date = pd.Timestamp(str(y)) + pd.Timedelta(days=int(name) - 1)
+            days_dict[date] = [base_url + ID, modified]
+
+    if days_dict:
+        last_day = max(days_dict)
+    else:
+        last_day = None
+    crawl_days = {d: v for d, v in days_dict.items() if (d not in old_days) or (v[1] != old_days[d]) or (d == last_day) or (d == last_old_day)}
+
+    ## Parse the granules of the changed days a year at a time
+    crawl_dates = sorted(crawl_days)
+    if not isinstance(store['granules'], pd.DataFrame):
+        store['granules'] = process_date_list([], mission, product, version)
+    for year in sorted(set(d.year for d in crawl_dates)):
+        year_dates = [d for d in crawl_dates if d.year == year]
+        contents = fetch_catalogs([crawl_days[d][0] for d in year_dates])
+        new_df = process_date_list([parse_dates_xml(d, content) for d, content in zip(year_dates, contents)], mission, product, version)
+
+        old_df = store['granules']
+        old_dates = old_df['from_date'].dt.tz_convert(None).dt.floor('D')
+        store['granules'] = pd.concat([old_df[~old_dates.isin(year_dates)], new_df])
+        store['days'].update({d: crawl_days[d][1] for d in year_dates})
+        if building:
+            save_catalog(store, partial_path(path))
+
+    date_df = store['granules'].sort_values('from_date').reset_index(drop=True)
+
+    ## Save the updated store
+    store['years'].update(years_dict)
+    store['granules'] = date_df
+    store['refreshed'] = now
+    save_catalog(store, path)
+    if building and os.path.isfile(partial_path(path)):
+        os.remove(partial_path(path))
+
+    return date_df.copy()
+
+
+def build_catalog(mission, product, version, cache_dir):
+    """
+    Function to build (or refresh) the catalog store in a background thread. Only one build of a store runs at a time, and update_catalog waits for it to finish. An error of the build is printed rather than raised, as the store is then built on a later call.
+
+    Returns
+    -------
+    threading.Thread
+    """
+    def build():
+        try:
+            update_catalog(mission, product, version, cache_dir, 0)
+        except Exception as err:
+            print('The catalog store could not be built: {err}'.format(err=err))
+
+    path = catalog_path(cache_dir, mission, product, version)
+    with _builds_lock:
+        thread = _builds.get(path)
+        if (thread is None) or (not thread.is_alive()):
+            print('Building the catalog store in the background...')
+            thread = threading.Thread(target=build, daemon=True)
+            _builds[path] = thread
+            thread.start()
+
+    return thread
+
+
+def get_catalog(mission, product, version, cache_dir, from_date=None, to_date=None, min_max=False, max_age=catalog_max_age):
+    """
+    Function to get the NASA catalog via the local catalog store. It has the same inputs and outputs as parse_nasa_catalog, but only contacts the NASA server when the store needs refreshing.
+
+    Parameters
+    ----------
+    mission : str
+        Mission name.
+    product : str
+        The product associated with the mission.
+    version : int
+        The product version.
+    cache_dir : str
+        The cache directory used by the Nasa class.
+    from_date : str or None
+        The start date to query.
+    end_date : str or None
+        The end date to query.
+    min_max : bool
+        Should only the first and last granules of the product and version be returned? If the store doesn't exist yet, then only the outer year and day catalogs are requested via get_catalog_bounds and the store is built in the background (build_catalog) unless background_builds is False. The first build crawls every day catalog of the product, so it shares the connection to the server with the downloads of the first request, and the later requests use the store (and its irregular day checks) once it's saved. A build that doesn't finish before the process exits continues from its partial store on the next call.
+    max_age : int
+        The number of seconds since the last refresh within which the store is returned without contacting the server. Pass 0 to always refresh.
+
+    Returns
+    -------
+    DataFrame
+    """
+    if min_max and not os.path.isfile(catalog_path(cache_dir, mission, product, version)):
+        if background_builds:
+            build_catalog(mission, product, version, cache_dir)
+        return get_catalog_bounds(mission, product, version, from_date, to_date)
+
+    date_df = update_catalog(mission, product, version, cache_dir, max_age)
+    dates = date_df['from_date'].dt.tz_convert(None).dt.floor('D')
+
+    if isinstance(from_date, str):
+        date_df = date_df[(dates >= from_date)]
+        dates = dates[date_df.index]
+
+    if isinstance(to_date, str):
+        date_df = date_df[(dates <= to_date)]
+        dates = dates[date_df.index]
+
+    if min_max:
+        if date_df.empty:
+            raise ValueError('There are no granules between from_date and to_date')
+        date_df = date_df.iloc[[0, -1]]
+
+    return date_df.reset_index(drop=True)
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Pool of authenticated requests sessions for the simultaneous downloads.
+"""
+import threading
+from queue import LifoQueue, Empty
+import requests
+from requests.adapters import HTTPAdapter
+
+###############################################
+### Parameters
+
+pool_hosts = 4
+
+###############################################
+### Functions
+
+
+class SessionPool(object):
+    """
+    Class to hand out authenticated requests sessions to the download threads. requests sessions are not thread safe, so each thread checks out its own session for a granule and returns it afterwards. The sessions are reused across granules (and across get_data calls) so that their keep-alive connections are reused. All of the sessions share the cookie jar and auth of the session that logged in to URS, so the login is not repeated.
+
+    Parameters
+    ----------
+    session : requests.Session
+        The authenticated session.
+    size : int
+        The max number of sessions in the pool. It should be the max number of simultaneous downloads.
+
+    Returns
+    -------
+    SessionPool object
+    """
+    def __init__(self, session, size):
+        self.session = session
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._idle = LifoQueue()
+        self._sessions = []
+        self._lock = threading.Lock()
+
+    def _new_session(self):
+        session = requests.Session()
+        session.cookies = self.session.cookies
+        session.auth = self.session.auth
+        session.verify = self.session.verify
+        session.headers.update({k: v for k, v in self.session.headers.items() if k.lower() != 'connection'})
+        adapter = HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=1)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def resize(self, size):
+        """
+        Change the max number of sessions in the pool. Idle sessions above the new size are closed.
+        """
+        with self._lock:
+            self.size = size
+            while len(self._sessions) > size:
+                try:
+                    session = self._idle.get_nowait()
+                except Empty:
+                    break
+                self._sessions.remove(session)
+                session.close()
+
+    def get(self):
+        """
+        Check out a session. An idle session is reused if there is one, otherwise a new one is created.
+
+        Returns
+        -------
+        requests.Session
+        """
+        try:
+            session = self._idle.get_nowait()
+            with self._lock:
+                self.hits += 1
+        except Empty:
+            with self._lock:
+                self.misses += 1
+                session = self._new_session()
+                self._sessions.append(session)
+        return session
+
+    def put(self, session):
+        """
+        Return a checked out session to the pool.
+        """
+        with self._lock:
+            if len(self._sessions) > self.size:
+                self._sessions.remove(session)
+                session.close()
+                return
+        self._idle.put(session)
+
+    def stats(self):
+        """
+        The session and connection reuse counters. The connection counters are summed over the urllib3 connection pools of all of the sessions.
+
+        Returns
+        -------
+        dict
+        """
+        requests1 = 0
+        connections = 0
+        with self._lock:
+            for session in self._sessions:
+                for adapter in set(session.adapters.values()):
+                    poolmanager = getattr(adapter, 'poolmanager', None)
+                    if poolmanager is None:
+                        continue
+                    for key in poolmanager.pools.keys():
+                        pool = poolmanager.pools.get(key)
+                        if pool is not None:
+                            requests1 += pool.num_requests
+                            connections += pool.num_connections
+            stats = {'sessions': len(self._sessions), 'session_hits': self.hits, 'session_misses': self.misses, 'requests': requests1, 'connection_hits': requests1 - connections, 'connection_misses': connections}
+        return stats
+
+    def close(self):
+        """
+        Close all of the sessions in the pool.
+        """
+        with self._lock:
+            for session in self._sessions:
+                session.close()
+            self._sessions = []
+            self._idle = LifoQueue()
@@ -5,77 +5,270 @@ Created on Wed Sep 12 10:27:09 2018
 @author: MichaelK
 """
 import os
-import pickle
 import pandas as pd
 import xarray as xr
-import requests
-from time import sleep
-from lxml import etree
+import netCDF4
 import itertools
+from collections import deque
 from multiprocessing.pool import ThreadPool
-#from pydap.client import open_url
 from pydap.cas.urs import setup_session
-from nasadap.util import parse_nasa_catalog, mission_product_dict, master_datasets
+from nasadap.util import mission_product_dict, master_datasets, product_freq, parse_catalog_xml, decode_granule_names
+from nasadap.catalog import get_catalog, update_catalog, catalog_path, catalog_max_age
+from nasadap.crawler import fetch_catalogs, crawl
+from nasadap.grid import read_grid, save_grid, resolve_grid, grid_slice, bbox_tiles, tiles_extent
+from nasadap.transport import dap_granule, hdf5_granule, granule_time, resolve_layout, transports
+from nasadap.connections import SessionPool
+from nasadap.cube import Cube
+from nasadap.index import open_index, index_variables, index_sources, index_tiles, update_index, touch_index, remove_index, add_stats
+from nasadap.store import cache_formats, store_dir_name, store_path, granule_slots, write_store, read_store, zarr
+from nasadap.eviction import evict_files, evict_stores
+from nasadap.reader import read_granules, read_file, read_bbox, decode_times, nc_attrs, netcdf_lock, hdf5_lock
+from nasadap.encoding import encoding_profiles, get_profile, quantize
+from nasadap.tiles import write_granule
+from nasadap.scheduler import AdaptiveLimiter, error_status, backoff_wait, retries, throttle_codes
 #from util import parse_nasa_catalog, mission_product_dict, master_datasets
 
 #######################################
 ### Parameters
 
-file_index_name = 'file_index.pickle'
+## The default max number of simultaneous downloads. The session pool starts at this size and is resized to the dl_sim_count of each request.
+default_dl_sim_count = 30
 
 #######################################
 
 
-def download_files(url, path, session, master_dataset_list, dataset_types, min_lat, max_lat, min_lon, max_lon):
+def cache_path(url, cache_dir):
+    """
+    Function to convert a NASA url to the local cache file path.
+    """
+    if 'hyrax/' in url:
+        split_text = 'hyrax/'
+    else:
+        split_text = 'opendap/'
+    path = os.path.join(cache_dir, os.path.splitext(url.split(split_text)[1])[0].replace('/', os.sep) + '.nc4')
+    return path
+
+
+def download_files(url, path, session_pool, dataset_list, dataset_types, grid, min_lat, max_lat, min_lon, max_lon, limiter, transport='dap', cube=None, slot=None, cache_format='netcdf', extent=None, encoding=encoding_profiles['none']):
+    """
+    Function to download the dataset_list variables of a granule and save them to the cache. The extent (min_lat, max_lat, min_lon, max_lon) of the download is normally the missing tiles of the bounding box and defaults to the bounding box. The downloaded tiles are written into the tiled cache file of the granule (see tiles.py), so the tiles and variables that were cached before are kept. Each attempt waits for a download slot of the limiter and failed attempts are retried with an exponential backoff. The transport is either 'dap' or 'hdf5'. If a cube is passed, then the granule is written into its time slot and True is returned instead of the dataset. If the cache_format is 'zarr', then nothing is saved and the dataset_list variables of the bounding box are returned to be written to the store. The float variables are bit rounded and the new variables of the cache file are compressed with the encoding profile.
+    """
 #    print('Downloading and saving to...')
     print(path)
 #    print(url)
-    counter = 4
-    while counter > 0:
-        try:
-            store = xr.backends.PydapDataStore.open(url, session=session)
-            ds = xr.open_dataset(store, decode_cf=False)
-
-            if 'nlon' in ds:
-                ds = ds.rename({'nlon': 'lon', 'nlat': 'lat'})
-            ds2 = ds[master_dataset_list].sel(lat=slice(min_lat, max_lat), lon=slice(min_lon, max_lon))
+    if extent is None:
+        extent = (min_lat, max_lat, min_lon, max_lon)
+    grid_dict = grid_slice(grid, *extent)
+    cached = (cache_format == 'netcdf') and os.path.isfile(path)
 
-            lat = ds2.lat.values
-            lon = ds2.lon.values
+    lon = grid_dict['lon']
+    lat = grid_dict['lat']
+    for attempt in range(1, retries + 1):
+        start = limiter.acquire()
+        session = session_pool.get()
+        try:
+            if transport == 'hdf5':
+                attrs, data_dict, attrs_dict = hdf5_granule(url, session, dataset_list, grid_dict, grid['hdf5'])
+            else:
+                attrs, data_dict, attrs_dict = dap_granule(url, session, dataset_list, grid_dict)
+            ds_date = granule_time(attrs)
 
-            ds_date1 = ds.attrs['FileHeader'].split(';\n')
-            ds_date2 = dict([t.split('=') for t in ds_date1 if t != ''])
-            ds_date = pd.to_datetime([ds_date2['StopGranuleDateTime']]).tz_convert(None)
-            ds2['time'] = ds_date
+            ds2 = xr.Dataset(coords={'time': ds_date, 'lon': lon, 'lat': lat}, attrs=attrs)
+            ds2['lon'].attrs = grid_dict['lon_attrs']
+            ds2['lat'].attrs = grid_dict['lat_attrs']
 
-            for ar in ds2.data_vars:
-                da1 = xr.DataArray(ds2[ar].values.reshape(1, len(lon), len(lat)), coords=[ds_date, lon, lat], dims=['time', 'lon', 'lat'], name=ar)
-                da1.attrs = ds2[ar].attrs
+            for ar in dataset_list:
+                data = data_dict[ar]
+                if grid_dict['transpose']:
+                    data = data.reshape(1, len(lat), len(lon)).transpose(0, 2, 1)
+                da1 = xr.DataArray(data.reshape(1, len(lon), len(lat)), coords=[ds_date, lon, lat], dims=['time', 'lon', 'lat'], name=ar)
+                da1.attrs = attrs_dict[ar]
                 ds2[ar] = da1
+            ds2 = quantize(ds2, encoding)
 
-            counter = 0
+            limiter.release(start)
+            break
         except Exception as err:
             print(err)
-            print('Retrying in 3 seconds...')
-            counter = counter - 1
-            sleep(3)
+            status = error_status(err)
+            if status == 404:
+                limiter.release(start, 'not_found')
+                return None
+            elif status in throttle_codes:
+                limiter.release(start, 'throttled')
+            else:
+                limiter.release(start, 'error')
+            if attempt == retries:
+                raise err
+            print('Retrying...')
+            backoff_wait(attempt)
+        finally:
+            session_pool.put(session)
+
+    if cache_format == 'zarr':
+        return ds2
+
+    ## Save data as cache. The downloaded tiles are written into the tiled cache file of the granule.
+    write_granule(path, grid, ds2, encoding)
+
+    ## The bounding box is read back from the cache file if it had other tiles or variables before
+    if cached:
+        with netcdf_lock:
+            with xr.open_dataset(path) as ds:
+                ds3 = ds[dataset_types].sel(lat=slice(min_lat, max_lat), lon=slice(min_lon, max_lon)).load()
+    else:
+        ds3 = xr.decode_cf(ds2[dataset_types].sel(lat=slice(min_lat, max_lat), lon=slice(min_lon, max_lon)))
+    if cube is not None:
+        cube.write(slot, ds3)
+        return True
 
-    ## Save data as cache
-    if not os.path.isfile(path):
-#        print('Saving data to...')
-#        print(path)
-        ds2.to_netcdf(path)
+    return ds3
 
-    return ds2[dataset_types]
 
+def read_local(path, dataset_types, min_lat, max_lat, min_lon, max_lon, cube, slot):
+    """
+    Function to read the bounding box of a cached granule into its time slot of a cube. The raw arrays are read with netCDF4 and decoded straight into the cube.
+    """
+    content = read_file(path)
+    with netcdf_lock, hdf5_lock:
+        with netCDF4.Dataset('granule.nc4', memory=content) as nc:
+            nc.set_auto_maskandscale(False)
+            lon, lat, arrays = read_bbox(nc, dataset_types, min_lat, max_lat, min_lon, max_lon)
+            attrs = nc_attrs(nc)
+            var_attrs = {ar: nc_attrs(nc[ar]) for ar in arrays}
+            time = nc['time']
+            time_value, units = time[0], time.getncattr('units')
+
+    cube.write_arrays(slot, decode_times([time_value], [units])[0], lon, lat, arrays, attrs, var_attrs)
+    return True
 
-def parse_dap_xml(date, file_path, mission, product, version, process_level, base_url):
+
+def dap_catalog_url(date, file_path, mission, product, version, process_level, base_url):
     path1 = file_path.format(mission=mission.upper(), product=product, year=date.year, dayofyear=date.dayofyear, version=version)
     path2 = '/'.join([process_level, path1])
-    url1 = '/'.join([base_url, 'opendap', path2, 'catalog.xml'])
-    page1 = requests.get(url1)
-    et = etree.fromstring(page1.content)
-    urls2 = [base_url + c.attrib['ID'] for c in et.getchildren()[3].getchildren() if not '.xml' in c.attrib['ID']]
+    url1 = '/'.join([base_url, 'opendap', path2])
+    return url1
+
+
+def template_urls(file_path, mission, product, version, process_level, base_url, from_date, to_date):
+    """
+    Function to generate the granule urls of a product directly from its file path template rather than parsing the day catalogs.
+
+    Parameters
+    ----------
+    file_path : str
+        The file path template from the mission_product_dict.
+    mission : str
+        Mission name.
+    product : str
+        The product associated with the mission.
+    version : int
+        The product version.
+    process_level : str
+        The process level from the mission_product_dict.
+    base_url : str
+        The base url of the server.
+    from_date : Timestamp
+        The start time of the first granule.
+    to_date : Timestamp
+        The start time of the last granule.
+
+    Returns
+    -------
+    dict
+        The urls as keys and the dates (days) as values.
+    """
+    freq = pd.Timedelta(product_freq[product])
+    times = pd.date_range(from_date, to_date, freq=freq)
+    end_times = times + freq - pd.Timedelta(seconds=1)
+    minutes = times.hour * 60 + times.minute
+
+    fields = zip(times.year, times.dayofyear, times.strftime('%Y%m%d'), times.strftime('%H%M%S'), end_times.strftime('%H%M%S'), minutes)
+    url_base = '/'.join([base_url, 'opendap', process_level])
+    urls = ['/'.join([url_base, file_path.format(mission=mission.upper(), product=product, version=version, year=y, dayofyear=doy, date=d, time_start=s, time_end=e, minutes='{:04}'.format(m))]) for y, doy, d, s, e, m in fields]
+
+    return dict(zip(urls, times.floor('D')))
+
+
+def irregular_days(url_dates, date_df, base_url):
+    """
+    Function to compare the generated granule urls to the stored catalog. Only the days before the last day in the catalog are compared.
+
+    Parameters
+    ----------
+    url_dates : dict
+        The output of template_urls.
+    date_df : DataFrame
+        The catalog DataFrame from the catalog store.
+    base_url : str
+        The base url of the server.
+
+    Returns
+    -------
+    dict
+        The dates of days whose file names differ from the generated ones as keys and the catalog urls of those days as values.
+    """
+    cat_dates = date_df['from_date'].dt.tz_convert(None).dt.floor('D')
+    gen_names = pd.Series(url_dates)
+    gen_names = gen_names[gen_names < cat_dates.max()]
+    if gen_names.empty:
+        return {}
+    gen_names.index = [u.rsplit('/', 1)[1] for u in gen_names.index]
+
+    in_range = cat_dates.isin(set(gen_names))
+    cat_names = pd.Series(cat_dates[in_range].tolist(), index=date_df['file_name'][in_range].values, dtype=object)
+
+    diff_dates = set(cat_names[~cat_names.index.isin(gen_names.index)]) | set(gen_names[~gen_names.index.isin(cat_names.index)])
+
+    irr_df = date_df[in_range & cat_dates.isin(diff_dates)]
+    irr_dict = {d: [] for d in diff_dates}
+    for d, u in zip(cat_dates[irr_df.index], irr_df['file_url']):
+        irr_dict[d].append(base_url + u)
+
+    return irr_dict
+
+
+def changed_granules(cached, sources):
+    """
+    Function to compare the source modified dates and sizes of the cached granules with the catalog.
+
+    Parameters
+    ----------
+    cached : dict
+        The file paths as keys and tuples of the modified date and size recorded in the index as values.
+    sources : dict
+        The file paths as keys and tuples of the modified date and size in the catalog as values.
+
+    Returns
+    -------
+    list of str, list of str
+        The paths of the granules that have changed and the paths of the granules without a recorded modified date or size.
+    """
+    changed = []
+    unknown = []
+    for path, (modified0, size0) in cached.items():
+        if path not in sources:
+            continue
+        modified1, size1 = sources[path]
+        if (modified0 is None) and (size0 is None):
+            unknown.append(path)
+        elif (modified0 is not None) and (modified1 is not None) and (pd.Timestamp(modified0) != pd.Timestamp(modified1)):
+            changed.append(path)
+        elif (size0 is not None) and (size1 is not None) and (int(size0) != int(size1)):
+            changed.append(path)
+
+    return changed, unknown
+
+
+def grid_resolved(grid, transport):
+    """
+    Function to check if a grid descriptor has been resolved for the transport (the 'hdf5' transport also needs the hdf5 layout).
+    """
+    return (grid is not None) and ((transport != 'hdf5') or ('hdf5' in grid))
+
+
+def parse_dap_xml(content, base_url):
+    urls2 = [base_url + i for i in parse_catalog_xml(content)['ID']]
     return urls2
 
 
@@ -93,6 +286,14 @@ class Nasa(object):
         Mission name.
     cach_dir : str or None
         A path to cache the netcdf files for future reading. If None, the currently working directory is used.
+    cache_format : str
+        How the granules are cached. 'netcdf' saves a netcdf file per granule. 'zarr' writes the granules into one chunked and compressed zarr store per month (requires zarr and dask), which is much faster to read for long periods.
+    cache_size : int or None
+        The max size in bytes of the cache of each product. The least recently used granules (or month stores for the zarr cache) are evicted after each request until the cache is within the size. None for no limit.
+    cache_age : str, Timedelta, or None
+        The max time since the last access of the cached granules (e.g. '90D'). Older granules are evicted after each request. None for no limit. The granules that were accessed within the last evict_grace (see eviction.py) are never evicted, as another process that shares the cache could be reading them.
+    cache_encoding : str or dict
+        The encoding profile of the cached granules. 'none' (the default) for no compression, 'lossless' for zlib with shuffle, 'compact' for zlib with shuffle and the float variables bit rounded to the keepbits in imerg_keepbits (at most 0.4% relative error for the precipitation), and 'compact_zstd' for the same with zstd (requires netCDF4 with zstandard support). Or a dict with the compression and the keepbits of the variables. The zarr cache uses the bit rounding but the compression of zarr. The profile only applies to the variables that are new to a cache file, so a cache with granules of different profiles can be read and appended to.
 
     Returns
     -------
@@ -101,10 +302,10 @@ class Nasa(object):
     missions_products = {m: list(mission_product_dict[m]['products'].keys()) for m in mission_product_dict}
 
 
-    def __init__(self, username, password, mission, cache_dir=None):
-        self.session(username, password, mission, cache_dir)
+    def __init__(self, username, password, mission, cache_dir=None, cache_format='netcdf', cache_size=None, cache_age=None, cache_encoding='none'):
+        self.session(username, password, mission, cache_dir, cache_format, cache_size, cache_age, cache_encoding)
 
-    def session(self, username, password, mission, cache_dir=None):
+    def session(self, username, password, mission, cache_dir=None, cache_format='netcdf', cache_size=None, cache_age=None, cache_encoding='none'):
         """
         Function to initiate a dap session.
 
@@ -118,6 +319,14 @@ class Nasa(object):
             Mission name.
         cach_dir : str or None
             A path to cache the netcdf files for future reading. If None, the currently working directory is used.
+        cache_format : str
+            How the granules are cached. Either 'netcdf' or 'zarr'.
+        cache_size : int or None
+            The max size in bytes of the cache of each product.
+        cache_age : str, Timedelta, or None
+            The max time since the last access of the cached granules.
+        cache_encoding : str or dict
+            The encoding profile of the cached granules.
 
         Returns
         -------
@@ -137,13 +346,24 @@ class Nasa(object):
         else:
             self.cache_dir = os.getcwd()
 
+        if cache_format not in cache_formats:
+            raise ValueError('cache_format must be one of: ' + ', '.join(cache_formats))
+        if (cache_format == 'zarr') and (zarr is None):
+            raise ImportError('The zarr cache format requires zarr and dask')
+        self.cache_format = cache_format
+        self.cache_size = cache_size
+        self.cache_age = cache_age
+        self.cache_encoding = get_profile(cache_encoding)
+
         self.session = setup_session(username, password, check_url='/'.join([self.mission_dict['base_url'], 'opendap',  self.mission_dict['process_level']]))
+        self.session_pool = SessionPool(self.session, default_dl_sim_count)
 
 
     def close(self):
         """
-        Closes the session.
+        Closes the session and the session pool.
         """
+        self.session_pool.close()
         self.session.close()
 
 
@@ -175,37 +395,13 @@ class Nasa(object):
         return master_datasets[product]
 
 
-    def get_data(self, product, version, dataset_types, from_date=None, to_date=None, min_lat=None, max_lat=None, min_lon=None, max_lon=None, dl_sim_count=30, check_local=True):
+    def _granule_plan(self, product, version, dataset_types, from_date, to_date, min_lat, max_lat, min_lon, max_lon, check_local, url_mode, transport, sync=False):
         """
-        Function to download trmm or gpm data and convert it to an xarray dataset.
-
-        Parameters
-        ----------
-        product : str
-            Data product associated with the mission.
-        dataset_types : str or list of str
-            The dataset types variable to be extracted.
-        from_date : str or None
-            The start date that you want data in the format 2000-01-01.
-        to_date : str or None
-            The end date that you want data in the format 2000-01-01.
-        min_lat : int, float, or None
-            The minimum lat to extract in WGS84 decimal degrees.
-        max_lat : int, float, or None
-            The maximum lat to extract in WGS84 decimal degrees.
-        min_lon : int, float, or None
-            The minimum lon to extract in WGS84 decimal degrees.
-        max_lon : int, float, or None
-            The maximum lon to extract in WGS84 decimal degrees.
-        dl_sim_count : int
-            The number of simultaneous downloads on a single thread. Speed could be increased with more simultaneous downloads, but up to a limit of the PC's single thread speed. Also, NASA's opendap server seems to have a limit to the total number of simultaneous downloads. 50-60 seems to be around the max.
-        check_local : bool
-            Should the local files be checked and read? Pass False if you only want to download files and not check for local files. Any local files will be overwritten!
+        Function to determine the granule urls, cache paths, and which of them need to be downloaded. A cached granule needs to be downloaded if it's missing any of the dataset types or any of the tiles of the bounding box.
 
         Returns
         -------
-        xarray dataset
-            Coordinates are time, lon, lat
+        dict
         """
         if product not in self.mission_dict['products']:
             raise ValueError('product must be one of: ' + ', '.join(self.mission_dict['products'].keys()))
@@ -214,10 +410,23 @@ class Nasa(object):
             file_path1 = product_dict[product]
         master_dataset_list = master_datasets[product]
 
+        if transport not in transports:
+            raise ValueError('transport must be one of: ' + ', '.join(transports))
+        if (transport == 'hdf5') and (not file_path1.endswith('.HDF5')):
+            raise ValueError('The hdf5 transport is only available for products with HDF5 files')
+
         if isinstance(dataset_types, str):
             dataset_types = [dataset_types]
+        if not set(dataset_types).issubset(master_dataset_list):
+            raise ValueError('dataset_types must be in: ' + ', '.join(master_dataset_list))
 
-        min_max = parse_nasa_catalog(self.mission, product, version, min_max=True)
+        ## The catalog store is only read once. If it doesn't exist yet, then get_catalog requests the bounds and builds it in the background.
+        if sync or os.path.isfile(catalog_path(self.cache_dir, self.mission, product, version)):
+            cat_df = update_catalog(self.mission, product, version, self.cache_dir, 0 if sync else catalog_max_age)
+            min_max = cat_df.iloc[[0, -1]].reset_index(drop=True)
+        else:
+            cat_df = None
+            min_max = get_catalog(self.mission, product, version, self.cache_dir, min_max=True)
         min_date = min_max['from_date'][0].tz_convert(None)
         max_date = min_max['to_date'].iloc[-1].tz_convert(None)
 
@@ -241,79 +450,578 @@ class Nasa(object):
         base_url = self.mission_dict['base_url']
 
         ## Determine what files are needed
-        if 'dayofyear' in file_path1:
+        process_level = self.mission_dict['process_level']
+        file_path = os.path.split(file_path1)[0]
+        url_dates = {}
+        if ('dayofyear' in file_path1) and (url_mode == 'template'):
+            print('Generating urls...')
+            freq = pd.Timedelta(product_freq[product])
+            start = max(from_date.floor('D'), min_date)
+            end = min(to_date.floor('D') + pd.Timedelta(days=1) - freq, max_date - freq + pd.Timedelta(seconds=1))
+            url_dates = template_urls(file_path1, self.mission, product, version, process_level, base_url, start, end)
+
+            if cat_df is not None:
+                irr_dict = irregular_days(url_dates, cat_df, base_url)
+                if irr_dict:
+                    print('Using the catalog urls for {n} irregular day(s)...'.format(n=len(irr_dict)))
+                    url_dates = {u: d for u, d in url_dates.items() if d not in irr_dict}
+                    for d, urls in irr_dict.items():
+                        url_dates.update({u: d for u in urls})
+            url_list = list(url_dates.keys())
+        elif 'dayofyear' in file_path1:
             print('Parsing file list from NASA server...')
-            file_path = os.path.split(file_path1)[0]
-            iter2 = [(date, file_path, self.mission, product, version, self.mission_dict['process_level'], base_url) for date in dates]
-            url_list1 = ThreadPool(30).starmap(parse_dap_xml, iter2)
-            url_list = list(itertools.chain.from_iterable(url_list1))
+            cat_urls = [dap_catalog_url(date, file_path, self.mission, product, version, process_level, base_url) for date in dates]
+            contents = fetch_catalogs(cat_urls)
+            url_list = list(itertools.chain.from_iterable(parse_dap_xml(c, base_url) for c in contents))
         elif 'month' in file_path1:
             print('Generating urls...')
             url_list = ['/'.join([base_url, 'opendap', self.mission_dict['process_level'],  file_path1.format(mission=self.mission.upper(), product=product, year=d.year, month=d.month, date=d.strftime('%Y%m%d'), version=version)]) for d in dates]
 
-        if 'hyrax' in url_list[0]:
-            split_text = 'hyrax/'
-        else:
-            split_text = 'opendap/'
-        url_dict = {u: os.path.join(self.cache_dir, os.path.splitext(u.split(split_text)[1])[0].replace('/', '\\') + '.nc4') for u in url_list}
+        url_dict = {u: cache_path(u, self.cache_dir) for u in url_list}
         path_set = set(url_dict.values())
 
-        save_dirs = set([os.path.split(u)[0] for u in url_dict.values()])
-        for path in save_dirs:
-            if not os.path.exists(path):
-                os.makedirs(path)
+        if self.cache_format == 'netcdf':
+            save_dirs = set([os.path.split(u)[0] for u in url_dict.values()])
+            for path in save_dirs:
+                if not os.path.exists(path):
+                    os.makedirs(path)
 
         ## Find out what files exist locally
         product_dir = file_path1.split('/')[0].format(mission=self.mission.upper(), product=product, version=version)
         product_path = os.path.join(self.cache_dir, self.mission_dict['process_level'], product_dir)
-        file_index_path = os.path.join(product_path, file_index_name)
+        store_dir = os.path.join(product_path, store_dir_name)
+        if self.cache_format == 'zarr':
+            index = open_index(store_dir, master_dataset_list)
+        else:
+            index = open_index(product_path, master_dataset_list)
+        file_index = index_variables(index, path_set)
 
-        if os.path.isfile(file_index_path):
-            with open(file_index_path, 'rb') as handle:
-                master_set = pickle.load(handle)
+        ## The cached granules of the request are touched before they're read, so the other processes that share the cache don't evict them in the meantime (see evict_grace)
+        touch_index(index, list(file_index))
+
+        ## Remove the granules whose files were deleted outside of nasadap
+        if self.cache_format == 'zarr':
+            months = granule_slots(decode_granule_names([os.path.split(p)[1] for p in file_index])[0], product_freq[product])[0]
+            stale = [p for p, m in zip(file_index, months) if not os.path.isdir(store_path(store_dir, m))]
         else:
-            print('Building index of existing local files...')
-            master_set = set()
-            for path, subdirs, files in os.walk(product_path):
-                for name in files:
-                    master_set.add(os.path.join(path, name))
-            with open(file_index_path, 'wb') as handle:
-                pickle.dump(master_set, handle, protocol=pickle.HIGHEST_PROTOCOL)
+            stale = [p for p in file_index if not os.path.isfile(p)]
+        if stale:
+            print('Removing {n} deleted file(s) from the index...'.format(n=len(stale)))
+            remove_index(index, stale)
+            for p in stale:
+                file_index.pop(p)
 
-        ## Load in files locally and remotely
+        ## The source modified dates and sizes from the stored catalog
+        if cat_df is not None:
+            granules = cat_df[cat_df['file_name'].isin(set(u.rsplit('/', 1)[1] for u in url_dict))]
+            modified = [None if pd.isnull(m) else str(m) for m in granules['modified_date']]
+            sizes = [None if pd.isnull(z) else int(z) for z in granules['file_size']]
+            sources = dict(zip(granules['file_name'], zip(modified, sizes)))
+        else:
+            sources = {}
+
+        ## Remove the cached granules whose catalog entries have changed since they were downloaded
+        if sync and check_local:
+            path_sources = {u0: sources[u.rsplit('/', 1)[1]] for u, u0 in url_dict.items() if u.rsplit('/', 1)[1] in sources}
+            changed, unknown = changed_granules(index_sources(index, file_index), path_sources)
+            if self.cache_format == 'netcdf':
+                changed.extend([p for p in unknown if (path_sources[p][0] is not None) and (pd.Timestamp(path_sources[p][0]) > pd.Timestamp(os.path.getmtime(p), unit='s', tz='utc'))])
+            adopt = [p for p in unknown if p not in changed]
+            update_index(index, [{'path': p, 'variables': [], 'modified_date': path_sources[p][0], 'source_size': path_sources[p][1]} for p in adopt])
+            if changed:
+                print('{n} cached granule(s) have changed on the NASA server and will be downloaded again...'.format(n=len(changed)))
+                if self.cache_format == 'netcdf':
+                    for p in changed:
+                        os.remove(p)
+                remove_index(index, changed)
+                for p in changed:
+                    file_index.pop(p)
+
+        ## The tiles of the bounding box. Variables cached before the tiles were indexed have no tiles and are assumed to cover it.
+        grid = read_grid(product_path)
+        if grid is None:
+            bbox_set = None
+            tile_index = {}
+        else:
+            bbox_set = bbox_tiles(grid, min_lat, max_lat, min_lon, max_lon)
+            tile_index = index_tiles(index, path_set)
+
+        dl_tiles = {}
         if check_local:
             print('Checking if files exist locally...')
-            local_set = path_set.intersection(master_set)
-            remote_dict = {url: local for url, local in url_dict.items() if local not in local_set}
+            dl_dict = {}
+            for url, local in url_dict.items():
+                variables = file_index.get(local, set())
+                tiles = tile_index.get(local, {})
+                dl_list = [d for d in dataset_types if d not in variables]
+                missing = set()
+                for d in dataset_types:
+                    if (d in variables) and (d in tiles) and (not tiles[d].issuperset(bbox_set)):
+                        dl_list.append(d)
+                        missing.update(bbox_set - tiles[d])
+                if dl_list:
+                    dl_dict[url] = [d for d in dataset_types if d in dl_list]
+                    if missing and all(d in variables for d in dl_list):
+                        dl_tiles[url] = missing
+            remote_dict = {url: url_dict[url] for url in dl_dict}
+            local_set = path_set.difference(remote_dict.values())
         else:
             local_set = set()
             remote_dict = url_dict.copy()
+            dl_dict = {url: dataset_types for url in remote_dict}
+
+        plan = {'product': product, 'version': version, 'master_dataset_list': master_dataset_list, 'dataset_types': dataset_types, 'file_path': file_path, 'url_dict': url_dict, 'url_dates': url_dates, 'product_path': product_path, 'store_dir': store_dir, 'index': index, 'file_index': file_index, 'sources': sources, 'local_set': local_set, 'remote_dict': remote_dict, 'dl_dict': dl_dict, 'dl_tiles': dl_tiles, 'hits': len(local_set), 'misses': len(remote_dict)}
+
+        return plan
+
+
+    def _product_grid(self, plan, transport):
+        """
+        Function to read the grid of the product from the cache or to resolve it from one of the remote granules. If none of the remote granules exist (e.g. generated urls of days with irregular file names), then the grid is resolved from the catalog urls of their first day. The grid is only saved once it's resolved.
+        """
+        grid = read_grid(plan['product_path'])
+        if not grid_resolved(grid, transport):
+            print('Resolving the product grid...')
+            urls = list(plan['remote_dict'])
+            grid = self._resolve_grid(urls, grid, plan, transport)
+            url_dates = plan['url_dates']
+            if (not grid_resolved(grid, transport)) and any(u in url_dates for u in urls):
+                first_date = min(url_dates[u] for u in urls if u in url_dates)
+                new_dict = self._catalog_urls(plan, [u for u in urls if url_dates.get(u) == first_date])
+                grid = self._resolve_grid(list(new_dict), grid, plan, transport)
+            if not grid_resolved(grid, transport):
+                raise ValueError('The grid of {product} version {version} could not be resolved, as none of the requested granules were found on the NASA server'.format(product=plan['product'], version=plan['version']))
+            save_grid(grid, plan['product_path'])
+
+        return grid
+
+
+    def _resolve_grid(self, urls, grid, plan, transport):
+        """
+        Function to resolve the grid (and the hdf5 layout if the transport is 'hdf5') from the first of the urls that exists. Urls that don't exist are skipped, so the grid is returned unresolved if none of them exist.
+        """
+        session = self.session_pool.get()
+        try:
+            for u in urls:
+                try:
+                    if grid is None:
+                        grid = resolve_grid(u, session, plan['master_dataset_list'][0])
+                    if transport == 'hdf5':
+                        grid['hdf5'] = resolve_layout(u, session, plan['master_dataset_list'])
+                    break
+                except Exception as err:
+                    if error_status(err) != 404:
+                        raise err
+        finally:
+            self.session_pool.put(session)
+
+        return grid
+
+
+    def _catalog_urls(self, plan, not_found):
+        """
+        Function to parse the day catalogs of generated urls that don't exist. Returns the urls and cache paths of the granules in those days that weren't generated.
+        """
+        print('{n} generated url(s) were not found, parsing their days from the NASA server...'.format(n=len(not_found)))
+        base_url = self.mission_dict['base_url']
+        url_dates = plan['url_dates']
+        nf_dates = sorted(set(url_dates[u] for u in not_found if u in url_dates))
+        cat_urls = [dap_catalog_url(date, plan['file_path'], self.mission, plan['product'], plan['version'], self.mission_dict['process_level'], base_url) for date in nf_dates]
+        results = crawl([u + '/catalog.xml' for u in cat_urls])
+        names = set(u.rsplit('/', 1)[1] for u in plan['url_dict'])
+        new_urls = [u for r in results if r.status == 200 for u in parse_dap_xml(r.content, base_url) if u.rsplit('/', 1)[1] not in names]
 
+        new_dict = {u: cache_path(u, self.cache_dir) for u in new_urls}
+        if self.cache_format == 'netcdf':
+            for path in set([os.path.split(u)[0] for u in new_dict.values()]):
+                if not os.path.exists(path):
+                    os.makedirs(path)
+        plan['dl_dict'].update({u: plan['dataset_types'] for u in new_dict})
+
+        return new_dict
+
+
+    def _download_extents(self, plan, urls, grid, min_lat, max_lat, min_lon, max_lon):
+        """
+        Function to get the extents of the downloads of granules. The extent of a cached granule is the bounding box of its missing tiles, and the extent of the others is the bounding box of all of the tiles of the bounding box.
+        """
+        bbox_set = bbox_tiles(grid, min_lat, max_lat, min_lon, max_lon)
+        extents = {}
+        for u in urls:
+            tiles = plan['dl_tiles'].get(u, bbox_set)
+            plan['dl_tiles'][u] = tiles
+            if tiles:
+                extents[u] = tiles_extent(grid, tiles)
+            else:
+                extents[u] = (min_lat, max_lat, min_lon, max_lon)
+        return extents
+
+
+    def _update_index(self, plan, done, not_found, grid):
+        """
+        Function to add the downloaded granules with the tiles of their download extents to the granule index. The source modified date and size are only recorded for granules that weren't cached yet, as the granules that were cached before could be from an older version of the source.
+        """
+        records = []
+        for u, u0 in done.items():
+            record = {'path': u0, 'variables': plan['dl_dict'][u], 'size': os.path.getsize(u0) if os.path.isfile(u0) else None}
+            if u0 not in plan['file_index']:
+                record['modified_date'], record['source_size'] = plan['sources'].get(u.rsplit('/', 1)[1], (None, None))
+            tiles = plan['dl_tiles'].get(u)
+            if tiles:
+                extent = tiles_extent(grid, tiles)
+                record.update(dict(zip(['min_lat', 'max_lat', 'min_lon', 'max_lon'], extent)))
+                record['tiles'] = bbox_tiles(grid, *extent)
+            records.append(record)
+        done_paths = set(done.values())
+        for u in not_found:
+            u0 = plan['url_dict'][u]
+            if u0 not in done_paths:
+                records.append({'path': u0, 'variables': [], 'status': 'not_found'})
+
+        update_index(plan['index'], records)
+        for u, u0 in done.items():
+            plan['file_index'][u0] = plan['file_index'].get(u0, set()).union(plan['dl_dict'][u])
+
+
+    def _cache_stats(self, plan, paths):
+        """
+        Function to record the access of the granules of a request, evict the least recently used granules that are over the cache budget, and save and print the cache stats. The granules of the request are never evicted.
+        """
+        index = plan['index']
+        touch_index(index, paths)
+        if self.cache_format == 'zarr':
+            months = granule_slots(decode_granule_names([os.path.split(p)[1] for p in paths])[0], product_freq[plan['product']])[0]
+            evicted = evict_stores(index, plan['store_dir'], self.cache_size, self.cache_age, set(months))
+        else:
+            evicted = evict_files(index, self.cache_size, self.cache_age, set(paths))
+
+        stats = {'hits': plan['hits'], 'misses': plan['misses'], 'evictions': evicted['evictions'], 'evicted_bytes': evicted['evicted_bytes']}
+        totals = add_stats(index, stats)
+        stats['size'] = evicted['size']
+        stats.update({'total_' + k: v for k, v in totals.items()})
+        self.cache_stats = stats
+        print('Cache stats: {hits} hits, {misses} misses, {evictions} evictions ({evicted_bytes} bytes), {size} bytes cached'.format(**stats))
+
+
+    def _read_store(self, plan, paths, min_lat, max_lat, min_lon, max_lon):
+        """
+        Function to read the granules of the cache paths from the zarr store.
+        """
+        times = decode_granule_names([os.path.split(p)[1] for p in paths])[0]
+        return read_store(plan['store_dir'], times, plan['dataset_types'], product_freq[plan['product']], min_lat, max_lat, min_lon, max_lon)
+
+
+    def _download_stats(self, limiter):
+        """
+        Function to save and print the download and connection stats.
+        """
+        self.download_stats = limiter.stats()
+        print('Download stats: {completed} completed, {errors} errors, {throttled} throttled, final limit {limit}, {throughput:.2f} files/s'.format(**self.download_stats))
+        print('Connection stats: {sessions} sessions, {connection_hits} reused and {connection_misses} new connections for {requests} requests'.format(**self.session_pool.stats()))
+
+
+    def _cube_data(self, plan, min_lat, max_lat, min_lon, max_lon, dl_sim_count, url_mode, transport):
+        """
+        Function to read the local files and download the remote files into a preallocated cube.
+        """
+        dataset_types = plan['dataset_types']
+        remote_dict = plan['remote_dict']
+        dl_dict = plan['dl_dict']
+
+        items = sorted(plan['url_dict'].items(), key=lambda x: x[1])
+        if remote_dict:
+            grid = self._product_grid(plan, transport)
+        else:
+            grid = read_grid(plan['product_path'])
+
+        if grid is None:
+            with netcdf_lock:
+                with xr.open_dataset(items[0][1]) as ds:
+                    ds1 = ds.sel(lat=slice(min_lat, max_lat), lon=slice(min_lon, max_lon))
+                    grid_dict = {'lon': ds1.lon.values, 'lat': ds1.lat.values, 'lon_attrs': ds1.lon.attrs, 'lat_attrs': ds1.lat.attrs}
+        else:
+            grid_dict = grid_slice(grid, min_lat, max_lat, min_lon, max_lon)
+
+        cube = Cube(len(items), grid_dict['lon'], grid_dict['lat'], grid_dict['lon_attrs'], grid_dict['lat_attrs'])
+
+        print('Reading local files and downloading files from NASA into the output arrays...')
+        limiter = AdaptiveLimiter(dl_sim_count)
+        self.session_pool.resize(dl_sim_count)
+        pool = ThreadPool(dl_sim_count)
+
+        local_iter = [(u0, dataset_types, min_lat, max_lat, min_lon, max_lon, cube, i) for i, (u, u0) in enumerate(items) if u not in remote_dict]
+        extents = self._download_extents(plan, remote_dict, grid, min_lat, max_lat, min_lon, max_lon) if remote_dict else {}
+        remote_iter = [(u, u0, self.session_pool, dl_dict[u], dataset_types, grid, min_lat, max_lat, min_lon, max_lon, limiter, transport, cube, i, 'netcdf', extents[u], self.cache_encoding) for i, (u, u0) in enumerate(items) if u in remote_dict]
+        remote_res = pool.starmap_async(download_files, remote_iter)
+        pool.starmap(read_local, local_iter)
+        output = remote_res.get()
+
+        not_found = [r[0] for r, o in zip(remote_iter, output) if o is None]
+        for u in not_found:
+            remote_dict.pop(u)
+
+        ds_all = cube.to_dataset()
+
+        ## Fall back to the day catalogs for generated urls that don't exist
+        if not_found and (url_mode == 'template'):
+            new_dict = self._catalog_urls(plan, not_found)
+            if new_dict:
+                extents = self._download_extents(plan, new_dict, grid, min_lat, max_lat, min_lon, max_lon)
+                iter3 = [(u, u0, self.session_pool, dataset_types, dataset_types, grid, min_lat, max_lat, min_lon, max_lon, limiter, transport, None, None, 'netcdf', extents[u], self.cache_encoding) for u, u0 in new_dict.items()]
+                output2 = pool.starmap(download_files, iter3)
+                ds_all = xr.concat([ds_all] + [o for o in output2 if o is not None], dim='time').sortby('time')
+                remote_dict.update({u: u0 for (u, u0), o in zip(new_dict.items(), output2) if o is not None})
+        pool.close()
+
+        if remote_dict:
+            self._download_stats(limiter)
+
+        ## Update the file index
+        self._update_index(plan, remote_dict, not_found, grid)
+        self._cache_stats(plan, [u0 for u, u0 in items])
+        plan['index'].close()
+
+        return ds_all
+
+
+    def get_data(self, product, version, dataset_types, from_date=None, to_date=None, min_lat=None, max_lat=None, min_lon=None, max_lon=None, dl_sim_count=default_dl_sim_count, check_local=True, url_mode='template', transport='dap', preallocate=False, sync=False):
+        """
+        Function to download trmm or gpm data and convert it to an xarray dataset. The granules are downloaded and cached as whole 5 degree tiles of the grid that cover the bounding box, so requests with overlapping bounding boxes only download the tiles that aren't cached yet.
+
+        Parameters
+        ----------
+        product : str
+            Data product associated with the mission.
+        dataset_types : str or list of str
+            The dataset types variable to be extracted. Only the dataset types that are missing from the cached files are downloaded and they are merged into the cached files.
+        from_date : str or None
+            The start date that you want data in the format 2000-01-01.
+        to_date : str or None
+            The end date that you want data in the format 2000-01-01.
+        min_lat : int, float, or None
+            The minimum lat to extract in WGS84 decimal degrees.
+        max_lat : int, float, or None
+            The maximum lat to extract in WGS84 decimal degrees.
+        min_lon : int, float, or None
+            The minimum lon to extract in WGS84 decimal degrees.
+        max_lon : int, float, or None
+            The maximum lon to extract in WGS84 decimal degrees.
+        dl_sim_count : int
+            The max number of simultaneous downloads. The number of simultaneous downloads starts at a quarter of this and is adjusted to the latency and the error/throttle rates of the server (additive increase/multiplicative decrease). The final limit and download stats are printed and saved in the download_stats attribute.
+        check_local : bool
+            Should the local files be checked and read? Pass False if you only want to download files and not check for local files. The dataset types in any local files will be overwritten!
+        url_mode : str
+            How the granule urls are determined. 'template' generates them from the file path template and only parses the day catalogs for days where a generated url doesn't exist or where the stored catalog differs from the template. 'catalog' parses the day catalogs of every requested day.
+        transport : str
+            How the granules are downloaded. 'dap' reads the bounding box via opendap. 'hdf5' reads the bounding box from the raw HDF5 files with http range requests (requires h5py). The HDF5 layout is resolved once per product and version and stored in the cache.
+        preallocate : bool
+            Should the output be allocated up front as one (time, lon, lat) array per dataset type? The download threads then write each granule straight into its time slot rather than the granules being concatenated at the end, which roughly halves the allocations and peak memory of large requests.. Only available with the netcdf cache_format.
+        sync : bool
+            Should the cached granules be synced with the NASA catalog? The catalog store is updated (only the changed year and day catalogs are crawled) and the cached granules whose source modified date or size in the catalog differ from the ones recorded when they were downloaded are downloaded again. Granules cached before the source was recorded are compared with the modified time of their files (netcdf cache) or adopt the current catalog entry (zarr cache).
+
+        Returns
+        -------
+        xarray dataset
+            Coordinates are time, lon, lat
+        """
+        if preallocate and (self.cache_format == 'zarr'):
+            raise ValueError('preallocate is only available with the netcdf cache_format')
+        plan = self._granule_plan(product, version, dataset_types, from_date, to_date, min_lat, max_lat, min_lon, max_lon, check_local, url_mode, transport, sync)
+        if preallocate:
+            return self._cube_data(plan, min_lat, max_lat, min_lon, max_lon, dl_sim_count, url_mode, transport)
+
+        dataset_types = plan['dataset_types']
+        local_set = plan['local_set']
+        remote_dict = plan['remote_dict']
+        dl_dict = plan['dl_dict']
+
+        ## Load in files locally and remotely
         ds_list = []
-        if local_set:
+        not_found = []
+        grid = None
+        if local_set and (self.cache_format == 'netcdf'):
             print('Reading local files...')
             local_list = list(local_set)
             local_list.sort()
-            ds = xr.open_mfdataset(local_list, concat_dim='time', parallel=True)
-            ds2 = ds[dataset_types].sel(lat=slice(min_lat, max_lat), lon=slice(min_lon, max_lon))
-            ds.close()
-            ds_list.append(ds2)
+            ds_list.append(read_granules(local_list, dataset_types, min_lat, max_lat, min_lon, max_lon, read_grid(plan['product_path'])))
 
         if remote_dict:
+            ## Get the grid index of the bounding box
+            grid = self._product_grid(plan, transport)
+
             print('Downloading files from NASA...')
+            limiter = AdaptiveLimiter(dl_sim_count)
+            self.session_pool.resize(dl_sim_count)
+
+            extents = self._download_extents(plan, remote_dict, grid, min_lat, max_lat, min_lon, max_lon)
+            iter1 = [(u, u0, self.session_pool, dl_dict[u], dataset_types, grid, min_lat, max_lat, min_lon, max_lon, limiter, transport, None, None, self.cache_format, extents[u], self.cache_encoding) for u, u0 in remote_dict.items()]
+
+            pool = ThreadPool(dl_sim_count)
+            output = pool.starmap(download_files, iter1)
 
-            iter1 = [(u, u0, self.session, master_dataset_list, dataset_types, min_lat, max_lat, min_lon, max_lon) for u, u0 in remote_dict.items()]
+            not_found = [u for u, o in zip(list(remote_dict.keys()), output) if o is None]
+            ds_list.extend([o for o in output if o is not None])
+            for u in not_found:
+                remote_dict.pop(u)
 
-            output = ThreadPool(dl_sim_count).starmap(download_files, iter1)
+            ## Fall back to the day catalogs for generated urls that don't exist
+            if not_found and (url_mode == 'template'):
+                new_dict = self._catalog_urls(plan, not_found)
+                if new_dict:
+                    extents = self._download_extents(plan, new_dict, grid, min_lat, max_lat, min_lon, max_lon)
+                    iter3 = [(u, u0, self.session_pool, dataset_types, dataset_types, grid, min_lat, max_lat, min_lon, max_lon, limiter, transport, None, None, self.cache_format, extents[u], self.cache_encoding) for u, u0 in new_dict.items()]
+                    output2 = pool.starmap(download_files, iter3)
+                    ds_list.extend([o for o in output2 if o is not None])
+                    remote_dict.update({u: u0 for (u, u0), o in zip(new_dict.items(), output2) if o is not None})
+            pool.close()
 
-            ds_list.extend(output)
+            self._download_stats(limiter)
 
-        ds_all = xr.concat(ds_list, dim='time').sortby('time')
+        if self.cache_format == 'zarr':
+            print('Writing to and reading from the zarr store...')
+            write_store(plan['store_dir'], ds_list, product_freq[plan['product']], grid)
+            ds_all = self._read_store(plan, list(local_set) + list(remote_dict.values()), min_lat, max_lat, min_lon, max_lon)
+        else:
+            ds_all = xr.concat(ds_list, dim='time').sortby('time')
 
         ## Update the file index
-        master_set.update(set(remote_dict.values()))
-        with open(file_index_path, 'wb') as handle:
-            pickle.dump(master_set, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        self._update_index(plan, remote_dict, not_found, grid)
+        self._cache_stats(plan, list(local_set) + list(remote_dict.values()))
+        plan['index'].close()
 
         return ds_all
 
+
+    def iter_data(self, product, version, dataset_types, from_date=None, to_date=None, min_lat=None, max_lat=None, min_lon=None, max_lon=None, dl_sim_count=default_dl_sim_count, check_local=True, url_mode='template', transport='dap', buffer_size=None, sync=False):
+        """
+        Generator to download trmm or gpm data and yield it as time ordered xarray datasets while the downloads are running. Each dataset is the granules of one catalog directory (a day for the half-hourly products). At most buffer_size granules are downloaded ahead of the one being yielded, so the memory use doesn't depend on the date range. The parameters are the same as get_data.
+
+        Parameters
+        ----------
+        product : str
+            Data product associated with the mission.
+        dataset_types : str or list of str
+            The dataset types variable to be extracted.
+        from_date : str or None
+            The start date that you want data in the format 2000-01-01.
+        to_date : str or None
+            The end date that you want data in the format 2000-01-01.
+        min_lat : int, float, or None
+            The minimum lat to extract in WGS84 decimal degrees.
+        max_lat : int, float, or None
+            The maximum lat to extract in WGS84 decimal degrees.
+        min_lon : int, float, or None
+            The minimum lon to extract in WGS84 decimal degrees.
+        max_lon : int, float, or None
+            The maximum lon to extract in WGS84 decimal degrees.
+        dl_sim_count : int
+            The max number of simultaneous downloads.
+        check_local : bool
+            Should the local files be checked and read?
+        url_mode : str
+            How the granule urls are determined. Either 'template' or 'catalog'.
+        transport : str
+            How the granules are downloaded. Either 'dap' or 'hdf5'.
+        buffer_size : int or None
+            The max number of granules that are downloaded ahead. If None, then twice the dl_sim_count.
+        sync : bool
+            Should the cached granules whose source has changed in the NASA catalog be downloaded again? See get_data.
+
+        Yields
+        ------
+        xarray dataset
+            Coordinates are time, lon, lat
+        """
+        plan = self._granule_plan(product, version, dataset_types, from_date, to_date, min_lat, max_lat, min_lon, max_lon, check_local, url_mode, transport, sync)
+        dataset_types = plan['dataset_types']
+        remote_dict = plan['remote_dict']
+        dl_dict = plan['dl_dict']
+        grid = None
+
+        if buffer_size is None:
+            buffer_size = 2 * dl_sim_count
+
+        if remote_dict:
+            grid = self._product_grid(plan, transport)
+            limiter = AdaptiveLimiter(dl_sim_count)
+            self.session_pool.resize(dl_sim_count)
+            pool = ThreadPool(dl_sim_count)
+
+        def submit(u, u0, dl_list):
+            if u in dl_dict:
+                extent = self._download_extents(plan, [u], grid, min_lat, max_lat, min_lon, max_lon)[u]
+                return pool.apply_async(download_files, (u, u0, self.session_pool, dl_list, dataset_types, grid, min_lat, max_lat, min_lon, max_lon, limiter, transport, None, None, self.cache_format, extent, self.cache_encoding))
+            else:
+                return None
+
+        def result(u, u0, res, done):
+            if (res is None) and (self.cache_format == 'zarr'):
+                return True
+            elif res is None:
+                with netcdf_lock:
+                    with xr.open_dataset(u0) as ds:
+                        return ds[dataset_types].sel(lat=slice(min_lat, max_lat), lon=slice(min_lon, max_lon)).load()
+            else:
+                ds = res.get()
+                if ds is not None:
+                    done[u] = u0
+                    ds = ds.load()
+                return ds
+
+        def batch(found, not_found, done):
+            if not_found and (url_mode == 'template'):
+                new_dict = self._catalog_urls(plan, not_found)
+                new_res = [(u, u0, submit(u, u0, dataset_types)) for u, u0 in new_dict.items()]
+                for u, u0, res in new_res:
+                    ds = result(u, u0, res, done)
+                    if ds is not None:
+                        found.append((u0, ds))
+            ds_list = [ds for u0, ds in found if ds is not True]
+            if self.cache_format == 'zarr':
+                write_store(plan['store_dir'], ds_list, product_freq[plan['product']], grid)
+            self._update_index(plan, done, not_found, grid)
+            served.extend([u0 for u0, ds in found])
+            if found and (self.cache_format == 'zarr'):
+                return self._read_store(plan, [u0 for u0, ds in found], min_lat, max_lat, min_lon, max_lon).load()
+            elif ds_list:
+                return xr.concat(ds_list, dim='time').sortby('time')
+
+        print('Streaming files...')
+        items = sorted(plan['url_dict'].items(), key=lambda x: x[1])
+        window = deque()
+        found = []
+        not_found = []
+        done = {}
+        served = []
+        batch_dir = None
+        try:
+            for i in range(len(items) + buffer_size):
+                if i < len(items):
+                    u, u0 = items[i]
+                    window.append((u, u0, submit(u, u0, dl_dict.get(u))))
+                if (len(window) > buffer_size) or ((i >= len(items)) and window):
+                    u, u0, res = window.popleft()
+                    u_dir = os.path.split(u0)[0]
+                    if (batch_dir is not None) and (u_dir != batch_dir):
+                        ds = batch(found, not_found, done)
+                        found = []
+                        not_found = []
+                        done = {}
+                        if ds is not None:
+                            yield ds
+                    batch_dir = u_dir
+                    ds = result(u, u0, res, done)
+                    if ds is None:
+                        not_found.append(u)
+                    else:
+                        found.append((u0, ds))
+            ds = batch(found, not_found, done)
+            if ds is not None:
+                yield ds
+        finally:
+            if remote_dict:
+                pool.close()
+                pool.join()
+                self._download_stats(limiter)
+            self._cache_stats(plan, served)
+            plan['index'].close()
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+Asyncio crawler for the NASA Hyrax catalogs. The crawls run in one long-lived event loop with one pooled client session per host, so the keep-alive connections are reused across crawls.
+"""
+import os
+import atexit
+import asyncio
+import random
+import threading
+from collections import namedtuple
+from urllib.parse import urlsplit
+import aiohttp
+
+###############################################
+### Parameters
+
+crawl_sim_count = 30
+retries = 4
+backoff = 1
+timeout = 120
+
+FetchResult = namedtuple('FetchResult', ['url', 'status', 'content', 'attempts', 'error'])
+
+## The event loop of the crawler, the process that started it, and the client sessions by host
+_loop = None
+_loop_pid = None
+_sessions = {}
+_loop_lock = threading.Lock()
+
+## The sessions of the parent of a forked process. They belong to the loop of the parent, so they can't be closed and are only kept from being garbage collected (which warns about unclosed sessions).
+_parent_sessions = []
+
+###############################################
+### Functions
+
+
+async def fetch(session, semaphore, url, retries=retries, backoff=backoff):
+    """
+    Coroutine to get a single url with retries. The wait between retries is an exponential backoff with jitter. A 404 is not retried.
+    """
+    status = None
+    error = None
+    for attempt in range(1, retries + 1):
+        async with semaphore:
+            try:
+                async with session.get(url) as resp:
+                    status = resp.status
+                    if status == 200:
+                        content = await resp.read()
+                        return FetchResult(url, status, content, attempt, None)
+                    error = resp.reason
+                    if status == 404:
+                        break
+            except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                status = None
+                error = repr(err)
+        if attempt < retries:
+            await asyncio.sleep(backoff * 2**(attempt - 1) * random.uniform(0.5, 1.5))
+
+    return FetchResult(url, status, None, attempt, error)
+
+
+def crawler_loop():
+    """
+    Function to get the event loop of the crawler. The loop runs forever in a daemon thread, so the client sessions and their keep-alive connections are reused by all of the crawls of the process. A new loop is started in a forked process.
+    """
+    global _loop, _loop_pid, _sessions
+    with _loop_lock:
+        if (_loop is None) or (_loop_pid != os.getpid()):
+            _parent_sessions.extend(_sessions.values())
+            _loop = asyncio.new_event_loop()
+            _loop_pid = os.getpid()
+            _sessions = {}
+            threading.Thread(target=_loop.run_forever, daemon=True).start()
+    return _loop
+
+
+def host_session(url):
+    """
+    Function to get the pooled client session of the host of a url. It must be called in the crawler loop.
+    """
+    host = urlsplit(url).netloc
+    session = _sessions.get(host)
+    if (session is None) or session.closed:
+        connector = aiohttp.TCPConnector(limit=crawl_sim_count, limit_per_host=crawl_sim_count)
+        session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout))
+        _sessions[host] = session
+    return session
+
+
+async def crawl_async(urls, sim_count=crawl_sim_count, retries=retries, backoff=backoff):
+    """
+    Coroutine to get many urls concurrently with the pooled client session of each host.
+    """
+    semaphore = asyncio.Semaphore(sim_count)
+    results = await asyncio.gather(*[fetch(host_session(url), semaphore, url, retries, backoff) for url in urls])
+
+    return list(results)
+
+
+async def close_async():
+    """
+    Coroutine to close the pooled client sessions.
+    """
+    sessions = list(_sessions.values())
+    _sessions.clear()
+    for session in sessions:
+        await session.close()
+
+
+def close_sessions():
+    """
+    Function to close the pooled client sessions of the crawler. New sessions are opened by the next crawl.
+    """
+    if (_loop is not None) and (_loop_pid == os.getpid()) and _loop.is_running():
+        asyncio.run_coroutine_threadsafe(close_async(), _loop).result()
+
+
+def run_coroutine(coro):
+    """
+    Function to run a coroutine in the crawler loop from synchronous code and wait for its result. It works whether or not an event loop is already running in the current thread (e.g. in Jupyter).
+    """
+    return asyncio.run_coroutine_threadsafe(coro, crawler_loop()).result()
+
+
+def crawl(urls, sim_count=crawl_sim_count, retries=retries, backoff=backoff):
+    """
+    Function to get many urls concurrently.
+
+    Parameters
+    ----------
+    urls : list of str
+        The urls to get.
+    sim_count : int
+        The max number of simultaneous requests.
+    retries : int
+        The max number of attempts per url.
+    backoff : int or float
+        The base number of seconds to wait between attempts. It's doubled after every failed attempt.
+
+    Returns
+    -------
+    list of FetchResult
+        In the same order as the urls.
+    """
+    if not urls:
+        return []
+
+    return run_coroutine(crawl_async(urls, sim_count, retries, backoff))
+
+
+def fetch_catalogs(urls, sim_count=crawl_sim_count):
+    """
+    Function to get the catalog.xml content of many Hyrax catalog directories. Raises an error if any of the catalogs could not be downloaded.
+
+    Parameters
+    ----------
+    urls : list of str
+        The urls of the catalog directories (without the catalog.xml).
+    sim_count : int
+        The max number of simultaneous requests.
+
+    Returns
+    -------
+    list of bytes
+    """
+    results = crawl([u + '/catalog.xml' for u in urls], sim_count)
+    failed = [r for r in results if r.status != 200]
+    if failed:
+        raise IOError('Could not get {count} catalog(s), e.g. {url}: {status} {error}'.format(count=len(failed), url=failed[0].url, status=failed[0].status, error=failed[0].error))
+
+    return [r.content for r in results]
+
+
+atexit.register(close_sessions)
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Preallocated output cube that the download threads write the granules into.
+"""
+import threading
+import numpy as np
+import xarray as xr
+from xarray.conventions import decode_cf_variable
+
+###############################################
+### Functions
+
+
+class Cube(object):
+    """
+    Class of a preallocated (time, lon, lat) output cube. The arrays of the variables are allocated once when the first granule is written, and each granule is copied straight into its time slot. The granules can be written from many threads since each one has its own slot.
+
+    Parameters
+    ----------
+    n_times : int
+        The number of time slots (granules).
+    lon : ndarray
+        The lon coordinates of the bounding box.
+    lat : ndarray
+        The lat coordinates of the bounding box.
+    lon_attrs : dict
+        The attributes of the lon coordinate.
+    lat_attrs : dict
+        The attributes of the lat coordinate.
+
+    Returns
+    -------
+    Cube object
+    """
+    def __init__(self, n_times, lon, lat, lon_attrs, lat_attrs):
+        self.lon = lon
+        self.lat = lat
+        self.lon_attrs = lon_attrs
+        self.lat_attrs = lat_attrs
+        self.time = np.full(n_times, np.datetime64('NaT'), 'datetime64[ns]')
+        self.data = {}
+        self.attrs = {}
+        self.var_attrs = {}
+        self._attrs_slot = n_times
+        self._lock = threading.Lock()
+
+    def write(self, slot, ds):
+        """
+        Write a single granule dataset into a time slot.
+
+        Parameters
+        ----------
+        slot : int
+            The time slot.
+        ds : xarray dataset
+            The granule with the time, lon, and lat dims.
+        """
+        ds = ds.transpose('time', 'lon', 'lat')
+        self.write_arrays(slot, ds.time.values[0], ds.lon.values, ds.lat.values, {ar: ds[ar].values[0] for ar in ds.data_vars}, ds.attrs, {ar: ds[ar].attrs for ar in ds.data_vars})
+
+    def write_arrays(self, slot, time, lon, lat, arrays, attrs, var_attrs):
+        """
+        Write the (lon, lat) arrays of the variables of a granule into a time slot. The fill values, scale factors, and offsets in the attributes of the variables are decoded like xarray's decode_cf. The arrays can be a block of the cube (e.g. a cached granule that doesn't cover all of the bounding box) and the rest of the slot is filled with NaN.
+
+        Parameters
+        ----------
+        slot : int
+            The time slot.
+        time : datetime64
+            The time of the granule.
+        lon : ndarray
+            The lon coordinates of the arrays.
+        lat : ndarray
+            The lat coordinates of the arrays.
+        arrays : dict of ndarray
+            The raw or decoded (lon, lat) arrays of the variables.
+        attrs : dict
+            The global attributes of the granule.
+        var_attrs : dict of dict
+            The attributes of the variables.
+        """
+        i = int(np.abs(self.lon - lon[0]).argmin()) if len(lon) else 0
+        j = int(np.abs(self.lat - lat[0]).argmin()) if len(lat) else 0
+        decoded_attrs = {}
+        for ar, values in arrays.items():
+            var = decode_cf_variable(ar, xr.Variable(('lon', 'lat'), values, var_attrs[ar]), decode_times=False)
+            values = var.values
+            decoded_attrs[ar] = var.attrs
+            if ar not in self.data:
+                with self._lock:
+                    if ar not in self.data:
+                        self.data[ar] = np.empty((len(self.time), len(self.lon), len(self.lat)), values.dtype)
+            if values.shape != self.data[ar].shape[1:]:
+                self.data[ar][slot] = np.nan if self.data[ar].dtype.kind == 'f' else 0
+            self.data[ar][slot, i:(i + values.shape[0]), j:(j + values.shape[1])] = values
+        self.time[slot] = time
+
+        with self._lock:
+            if slot < self._attrs_slot:
+                self._attrs_slot = slot
+                self.attrs = attrs
+                self.var_attrs = decoded_attrs
+
+    def to_dataset(self):
+        """
+        Convert the cube to an xarray dataset without copying. The time slots that weren't written are removed.
+
+        Returns
+        -------
+        xarray dataset
+        """
+        ds = xr.Dataset({ar: (('time', 'lon', 'lat'), arr, self.var_attrs.get(ar, {})) for ar, arr in self.data.items()}, coords={'time': self.time, 'lon': self.lon, 'lat': self.lat}, attrs=self.attrs)
+        ds['lon'].attrs = self.lon_attrs
+        ds['lat'].attrs = self.lat_attrs
+        filled = ~np.isnat(self.time)
+        if not filled.all():
+            ds = ds.isel(time=np.flatnonzero(filled))
+        return ds
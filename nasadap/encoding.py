@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Encoding profiles of the cached granules and the aggregated files. A profile is a compression (zlib or zstd with shuffle) and the number of mantissa bits that are kept by bit rounding each float variable. Bit rounding sets the trailing mantissa bits to zero, so the compression works much better at the cost of a bounded relative error.
+"""
+import numpy as np
+import netCDF4
+
+###############################################
+### Parameters
+
+compressions = {None: {}, 'zlib': {'zlib': True, 'complevel': 4, 'shuffle': True}, 'zstd': {'compression': 'zstd', 'complevel': 4, 'shuffle': True}}
+
+## The variables smaller than this (in bytes) aren't compressed, as the chunk index of a compressed variable is bigger than the savings
+min_compress_size = 16384
+
+## The mantissa bits kept for the float variables of IMERG. The relative error is at most 2**-(keepbits + 1) (0.4% for 7 bits). The integer variables (IRkalmanFilterWeight and probabilityLiquidPrecipitation) are only compressed.
+imerg_keepbits = {'precipitationCal': 7, 'HQprecipitation': 7, 'IRprecipitation': 7, 'randomError': 5, 'precipitationQualityIndex': 7}
+
+encoding_profiles = {'none': {'compression': None, 'keepbits': {}},
+                     'lossless': {'compression': 'zlib', 'keepbits': {}},
+                     'compact': {'compression': 'zlib', 'keepbits': imerg_keepbits},
+                     'compact_zstd': {'compression': 'zstd', 'keepbits': imerg_keepbits}}
+
+###############################################
+### Functions
+
+
+def get_profile(encoding):
+    """
+    Function to get and check an encoding profile.
+
+    Parameters
+    ----------
+    encoding : str or dict
+        The name of a profile in encoding_profiles or a dict with the compression (None, 'zlib', or 'zstd') and the keepbits of the variables.
+
+    Returns
+    -------
+    dict
+    """
+    if isinstance(encoding, str):
+        if encoding not in encoding_profiles:
+            raise ValueError('encoding must be one of: ' + ', '.join(encoding_profiles))
+        profile = encoding_profiles[encoding]
+    elif isinstance(encoding, dict):
+        profile = {'compression': encoding.get('compression'), 'keepbits': encoding.get('keepbits', {})}
+        if profile['compression'] not in compressions:
+            raise ValueError('compression must be None, zlib, or zstd')
+    else:
+        raise ValueError('encoding must be a str or dict')
+
+    if (profile['compression'] == 'zstd') and (not getattr(netCDF4, '__has_zstandard_support__', False)):
+        raise ValueError('The zstd compression requires netCDF4 with zstandard support')
+
+    return profile
+
+
+def bit_round(values, keepbits, fill_value=None):
+    """
+    Function to round the mantissas of float values to keepbits bits (round half to even). The NaNs and fill values are kept as is.
+
+    Parameters
+    ----------
+    values : ndarray
+        float32 or float64 values.
+    keepbits : int
+        The number of mantissa bits to keep.
+    fill_value : float or None
+        The fill value of the variable.
+
+    Returns
+    -------
+    ndarray
+    """
+    values = np.asarray(values)
+    if (values.dtype.kind != 'f') or (values.dtype.itemsize not in (4, 8)):
+        raise ValueError('Only float32 and float64 values can be bit rounded')
+    values = values.astype(values.dtype.newbyteorder('='), copy=False)
+    if values.dtype.itemsize == 4:
+        int_dtype, mantissa_bits = np.uint32, 23
+    else:
+        int_dtype, mantissa_bits = np.uint64, 52
+
+    drop_bits = mantissa_bits - keepbits
+    if drop_bits <= 0:
+        return values
+
+    bits = values.view(int_dtype)
+    half = int_dtype((1 << (drop_bits - 1)) - 1)
+    mask = int_dtype(np.iinfo(int_dtype).max ^ ((1 << drop_bits) - 1))
+    rounded = ((bits + half + ((bits >> int_dtype(drop_bits)) & int_dtype(1))) & mask).view(values.dtype)
+
+    keep = np.isnan(values)
+    if fill_value is not None:
+        keep |= values == fill_value
+
+    return np.where(keep, values, rounded)
+
+
+def quantize(ds, profile):
+    """
+    Function to bit round the float variables of a dataset with the keepbits of an encoding profile.
+
+    Parameters
+    ----------
+    ds : xarray dataset
+        The dataset.
+    profile : dict
+        The encoding profile from get_profile.
+
+    Returns
+    -------
+    xarray dataset
+    """
+    keepbits = profile['keepbits']
+    ds = ds.copy()
+    for ar in ds.data_vars:
+        if (ar in keepbits) and (ds[ar].dtype.kind == 'f'):
+            ds[ar] = ds[ar].copy(data=bit_round(ds[ar].values, keepbits[ar], ds[ar].attrs.get('_FillValue', ds[ar].encoding.get('_FillValue'))))
+    return ds
+
+
+def netcdf_encoding(ds, profile):
+    """
+    Function to get the to_netcdf encoding of the variables of a dataset for the compression of an encoding profile. Variables smaller than min_compress_size aren't compressed.
+    """
+    compression = compressions[profile['compression']]
+    return {ar: compression.copy() if ds[ar].nbytes >= min_compress_size else {} for ar in ds.data_vars}
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Eviction of the least recently used granules to keep the cache of a product within a size and/or age budget.
+
+The cache can be shared by several processes (e.g. the workers of time_combine), and there's no lock between the readers and the eviction of another process. A request touches its cached granules in the index when it's planned, and the granules (or month stores) that were accessed within evict_grace are never evicted, so a granule can only be evicted while it's being read if the request reading it takes longer than evict_grace. The cache can then be over its budget by the granules of the last evict_grace.
+"""
+import os
+import shutil
+import pandas as pd
+from nasadap.index import remove_index
+from nasadap.store import store_path
+
+###############################################
+### Parameters
+
+evict_grace = '2h'
+
+###############################################
+### Functions
+
+
+def dir_size(path):
+    """
+    Function to get the total size of the files in a directory.
+    """
+    size = 0
+    for root, subdirs, files in os.walk(path):
+        for name in files:
+            size += os.path.getsize(os.path.join(root, name))
+    return size
+
+
+def select_evictions(units, max_size=None, max_age=None, grace=None):
+    """
+    Function to select the cache units to evict. Units are evicted from the least recently used until the total size is within max_size, and all units that haven't been accessed within max_age are evicted. Units that were accessed within grace are never evicted.
+
+    Parameters
+    ----------
+    units : list of tuple
+        The unit (e.g. a file path), its size in bytes, and its last access date.
+    max_size : int or None
+        The max total size in bytes.
+    max_age : str, Timedelta, or None
+        The max time since the last access.
+    grace : str, Timedelta, or None
+        The time since the last access within which units are kept.
+
+    Returns
+    -------
+    list
+        The units to evict.
+    """
+    total = sum(size for unit, size, access in units)
+    now = pd.Timestamp.now()
+    if max_age is not None:
+        min_access = now - pd.Timedelta(max_age)
+    if grace is not None:
+        grace_access = now - pd.Timedelta(grace)
+
+    evict = []
+    for unit, size, access in sorted(units, key=lambda x: pd.Timestamp(x[2]) if x[2] is not None else pd.Timestamp.min):
+        if (grace is not None) and (access is not None) and (pd.Timestamp(access) >= grace_access):
+            continue
+        too_old = (max_age is not None) and (access is not None) and (pd.Timestamp(access) < min_access)
+        too_big = (max_size is not None) and (total > max_size)
+        if too_old or too_big:
+            evict.append(unit)
+            total -= size
+
+    return evict
+
+
+def evict_files(conn, max_size=None, max_age=None, keep=set(), grace=evict_grace):
+    """
+    Function to evict the least recently used granule files of the netcdf cache of a product. The files in keep (e.g. the files of the current request) and the files accessed within grace are never evicted.
+
+    Parameters
+    ----------
+    conn : sqlite3.Connection
+        The granule index.
+    max_size : int or None
+        The max total size in bytes.
+    max_age : str, Timedelta, or None
+        The max time since the last access.
+    keep : set of str
+        The file paths that shouldn't be evicted.
+    grace : str, Timedelta, or None
+        The time since the last access within which files are kept, as other processes that share the cache could be reading them.
+
+    Returns
+    -------
+    dict
+        The number of evictions, the evicted bytes, and the size of the cache.
+    """
+    rows = conn.execute("SELECT path, size, access_date FROM granules WHERE status = 'ok'").fetchall()
+    sizes = dict((path, size or 0) for path, size, access in rows)
+    units = [(path, sizes[path], access) for path, size, access in rows if path not in keep]
+    keep_size = sum(sizes[p] for p in keep if p in sizes)
+
+    evict = select_evictions(units, max_size - keep_size if max_size is not None else None, max_age, grace)
+    for path in evict:
+        if os.path.isfile(path):
+            os.remove(path)
+    remove_index(conn, evict)
+
+    evicted_bytes = sum(sizes[p] for p in evict)
+
+    return {'evictions': len(evict), 'evicted_bytes': evicted_bytes, 'size': sum(sizes.values()) - evicted_bytes}
+
+
+def evict_stores(conn, store_dir, max_size=None, max_age=None, keep=set(), grace=evict_grace):
+    """
+    Function to evict the least recently used month stores of the zarr cache of a product. The last access date of a store is the last access date of its granules. The stores of the months in keep and the stores accessed within grace are never evicted.
+
+    Parameters
+    ----------
+    conn : sqlite3.Connection
+        The granule index.
+    store_dir : str
+        The store directory of the product.
+    max_size : int or None
+        The max total size in bytes.
+    max_age : str, Timedelta, or None
+        The max time since the last access.
+    keep : set of Timestamp
+        The months that shouldn't be evicted.
+    grace : str, Timedelta, or None
+        The time since the last access within which stores are kept, as other processes that share the cache could be reading them.
+
+    Returns
+    -------
+    dict
+        The number of evicted granules, the evicted bytes, and the size of the cache.
+    """
+    rows = conn.execute("SELECT path, from_date, access_date FROM granules WHERE status = 'ok'").fetchall()
+    month_dict = {}
+    for path, from_date, access in rows:
+        if from_date is None:
+            continue
+        t = pd.Timestamp(from_date)
+        month = pd.Timestamp(t.year, t.month, 1)
+        paths, last_access = month_dict.get(month, ([], None))
+        paths.append(path)
+        if (last_access is None) or ((access is not None) and (access > last_access)):
+            last_access = access
+        month_dict[month] = (paths, last_access)
+
+    sizes = {m: dir_size(store_path(store_dir, m)) for m in month_dict}
+    units = [(m, sizes[m], access) for m, (paths, access) in month_dict.items() if m not in keep]
+    keep_size = sum(sizes[m] for m in keep if m in sizes)
+
+    evict = select_evictions(units, max_size - keep_size if max_size is not None else None, max_age, grace)
+    evict_paths = []
+    for m in evict:
+        path = store_path(store_dir, m)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        evict_paths.extend(month_dict[m][0])
+    remove_index(conn, evict_paths)
+
+    evicted_bytes = sum(sizes[m] for m in evict)
+
+    return {'evictions': len(evict_paths), 'evicted_bytes': evicted_bytes, 'size': sum(sizes.values()) - evicted_bytes}
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+Grid descriptors of the products. The lat/lon grid of a product and version is fixed, so it's resolved once from a granule and stored in the cache to convert bounding boxes to index ranges.
+"""
+import os
+import pickle
+import numpy as np
+from pydap.client import open_url
+from pydap.model import GridType
+from nasadap.reader import bbox_index
+
+###############################################
+### Parameters
+
+grid_file_name = 'grid.pickle'
+tile_size = 5
+opendap_attrs = ['configuration', 'build_dmrpp', 'bes', 'libdap', 'invocation', 'dimensions', 'path', 'Maps']
+
+###############################################
+### Functions
+
+
+def fix_attributes(attributes):
+    """
+    Function to flatten the pydap attributes in the same way as the xarray pydap backend. The opendap specific attributes are removed.
+    """
+    attributes = dict(attributes)
+    for k in opendap_attrs:
+        attributes.pop(k, None)
+    for k in list(attributes):
+        if k.lower() == 'global' or k.lower().endswith('_global'):
+            attributes.update(attributes.pop(k))
+        elif isinstance(attributes[k], dict):
+            attributes.update({'{k}.{k_child}'.format(k=k, k_child=k_child): v_child for k_child, v_child in attributes.pop(k).items()})
+    return attributes
+
+
+def get_variable(dataset, name, index=Ellipsis):
+    """
+    Function to get the data of a pydap variable. Only the index hyperslab is requested from the server.
+    """
+    var = dataset[name]
+    if isinstance(var, GridType):
+        var = var.array
+    return np.asarray(var[index].data)
+
+
+def resolve_grid(url, session, dataset_name):
+    """
+    Function to resolve the grid of a product from one of its granules.
+
+    Parameters
+    ----------
+    url : str
+        The url of a granule.
+    session : requests.Session
+        The authenticated session.
+    dataset_name : str
+        One of the gridded dataset types of the product.
+
+    Returns
+    -------
+    dict
+    """
+    dataset = open_url(url, session=session)
+    dims = dataset[dataset_name].dimensions
+
+    grid = {'dims': dims}
+    for coord in ['lon', 'lat']:
+        values = get_variable(dataset, coord)
+        grid[coord] = values.astype(values.dtype.newbyteorder('='))
+        grid[coord + '_attrs'] = fix_attributes(dataset[coord].attributes)
+
+    return grid
+
+
+def read_grid(product_path):
+    """
+    Function to read the grid descriptor in the product cache directory. Returns None if it doesn't exist.
+    """
+    path = os.path.join(product_path, grid_file_name)
+    if os.path.isfile(path):
+        with open(path, 'rb') as handle:
+            grid = pickle.load(handle)
+    else:
+        grid = None
+
+    return grid
+
+
+def save_grid(grid, product_path):
+    """
+    Function to save the grid descriptor in the product cache directory.
+    """
+    if not os.path.exists(product_path):
+        os.makedirs(product_path)
+    path = os.path.join(product_path, grid_file_name)
+    temp_path = path + '.' + str(os.getpid())
+    with open(temp_path, 'wb') as handle:
+        pickle.dump(grid, handle, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, path)
+
+
+def grid_slice(grid, min_lat=None, max_lat=None, min_lon=None, max_lon=None):
+    """
+    Function to convert a bounding box to index ranges of the grid. The bounds are inclusive like xarray's sel with slices (see bbox_index).
+
+    Parameters
+    ----------
+    grid : dict
+        The grid descriptor.
+    min_lat : int, float, or None
+        The minimum lat in WGS84 decimal degrees.
+    max_lat : int, float, or None
+        The maximum lat in WGS84 decimal degrees.
+    min_lon : int, float, or None
+        The minimum lon in WGS84 decimal degrees.
+    max_lon : int, float, or None
+        The maximum lon in WGS84 decimal degrees.
+
+    Returns
+    -------
+    dict
+        The lon and lat coordinates within the bounding box, their slices, the index tuple for the gridded variables, and whether the variables are stored as lat by lon.
+    """
+    slices = {}
+    for coord, min1, max1 in [('lon', min_lon, max_lon), ('lat', min_lat, max_lat)]:
+        slices[coord] = slice(*bbox_index(grid[coord], min1, max1))
+
+    index = []
+    for dim in grid['dims']:
+        if 'lon' in dim:
+            index.append(slices['lon'])
+        elif 'lat' in dim:
+            index.append(slices['lat'])
+        else:
+            index.append(slice(0, 1))
+
+    dims = [d for d in grid['dims'] if ('lon' in d) or ('lat' in d)]
+    transpose = 'lat' in dims[0]
+
+    grid_dict = {'lon': grid['lon'][slices['lon']], 'lat': grid['lat'][slices['lat']], 'lon_attrs': grid['lon_attrs'], 'lat_attrs': grid['lat_attrs'], 'lon_slice': slices['lon'], 'lat_slice': slices['lat'], 'index': tuple(index), 'transpose': transpose}
+
+    return grid_dict
+
+
+def tile_cells(grid):
+    """
+    Function to get the number of grid cells of the tiles along the lon and lat.
+    """
+    lon_cells = int(round(tile_size / abs(float(grid['lon'][1] - grid['lon'][0]))))
+    lat_cells = int(round(tile_size / abs(float(grid['lat'][1] - grid['lat'][0]))))
+    return lon_cells, lat_cells
+
+
+def bbox_tiles(grid, min_lat=None, max_lat=None, min_lon=None, max_lon=None):
+    """
+    Function to get the tiles of the grid that intersect a bounding box. The tiles are fixed tile_size degree blocks of the grid starting at its first cell and are named by their lon and lat numbers (e.g. '69_8').
+
+    Parameters
+    ----------
+    grid : dict
+        The grid descriptor.
+    min_lat : int, float, or None
+        The minimum lat in WGS84 decimal degrees.
+    max_lat : int, float, or None
+        The maximum lat in WGS84 decimal degrees.
+    min_lon : int, float, or None
+        The minimum lon in WGS84 decimal degrees.
+    max_lon : int, float, or None
+        The maximum lon in WGS84 decimal degrees.
+
+    Returns
+    -------
+    set of str
+    """
+    grid_dict = grid_slice(grid, min_lat, max_lat, min_lon, max_lon)
+    lon_slice = grid_dict['lon_slice']
+    lat_slice = grid_dict['lat_slice']
+    if (lon_slice.stop <= lon_slice.start) or (lat_slice.stop <= lat_slice.start):
+        return set()
+
+    lon_cells, lat_cells = tile_cells(grid)
+    lon_tiles = range(lon_slice.start // lon_cells, (lon_slice.stop - 1) // lon_cells + 1)
+    lat_tiles = range(lat_slice.start // lat_cells, (lat_slice.stop - 1) // lat_cells + 1)
+
+    return set('{i}_{j}'.format(i=i, j=j) for i in lon_tiles for j in lat_tiles)
+
+
+def tiles_extent(grid, tiles):
+    """
+    Function to get the bounding box of the grid cells of tiles. The bounds are the coordinates of the outer cells, so grid_slice of the bounding box returns the cells of the tiles.
+
+    Parameters
+    ----------
+    grid : dict
+        The grid descriptor.
+    tiles : set of str
+        The tiles from bbox_tiles.
+
+    Returns
+    -------
+    tuple
+        min_lat, max_lat, min_lon, max_lon
+    """
+    lon_cells, lat_cells = tile_cells(grid)
+    numbers = np.array([t.split('_') for t in tiles], dtype=int)
+    lon_start = numbers[:, 0].min() * lon_cells
+    lon_stop = min((numbers[:, 0].max() + 1) * lon_cells, len(grid['lon']))
+    lat_start = numbers[:, 1].min() * lat_cells
+    lat_stop = min((numbers[:, 1].max() + 1) * lat_cells, len(grid['lat']))
+
+    return float(grid['lat'][lat_start]), float(grid['lat'][lat_stop - 1]), float(grid['lon'][lon_start]), float(grid['lon'][lon_stop - 1])
@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+"""
+SQLite index of the cached granule files. There's a row per granule file with its time range, extent, variables, size, source modified date and size, status, and last access date, a row per granule, variable, and cached tile of the grid, and the running totals of the cache stats.
+"""
+import os
+import pickle
+import sqlite3
+import pandas as pd
+import xarray as xr
+from nasadap.util import decode_granule_names
+
+###############################################
+### Parameters
+
+index_file_name = 'file_index.sqlite'
+old_index_name = 'file_index.pickle'
+index_timeout = 60
+query_size = 500
+
+create_table = """CREATE TABLE IF NOT EXISTS granules (
+    path TEXT PRIMARY KEY,
+    from_date TEXT,
+    to_date TEXT,
+    min_lat REAL,
+    max_lat REAL,
+    min_lon REAL,
+    max_lon REAL,
+    variables TEXT NOT NULL,
+    size INTEGER,
+    modified_date TEXT,
+    status TEXT NOT NULL,
+    access_date TEXT,
+    source_size INTEGER
+)"""
+create_time_index = 'CREATE INDEX IF NOT EXISTS granules_from_date ON granules (from_date)'
+create_tiles_table = """CREATE TABLE IF NOT EXISTS tiles (
+    path TEXT NOT NULL,
+    variable TEXT NOT NULL,
+    tile TEXT NOT NULL,
+    PRIMARY KEY (path, variable, tile)
+)"""
+create_stats_table = """CREATE TABLE IF NOT EXISTS stats (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+)"""
+
+columns = ['path', 'from_date', 'to_date', 'min_lat', 'max_lat', 'min_lon', 'max_lon', 'variables', 'size', 'modified_date', 'status', 'access_date', 'source_size']
+added_columns = {'access_date': 'TEXT', 'source_size': 'INTEGER'}
+
+###############################################
+### Functions
+
+
+def granule_dates(paths):
+    """
+    Function to decode the start and end times of granules from their file paths as ISO strings. None if the name can't be decoded.
+    """
+    names = [os.path.split(p)[1] for p in paths]
+    from_date, to_date = decode_granule_names(names)
+    from_str = [None if pd.isnull(d) else pd.Timestamp(d).isoformat() for d in from_date]
+    to_str = [None if pd.isnull(d) else pd.Timestamp(d).isoformat() for d in to_date]
+    return from_str, to_str
+
+
+def open_index(product_path, master_dataset_list):
+    """
+    Function to open the granule index of a product cache directory. If it doesn't exist, then it's created from the older pickled index (a set of file paths with all of the variables or a dict of the file paths and their variables) or by reading the existing files. Granules without an access date (e.g. from an older index) get the current time.
+
+    Parameters
+    ----------
+    product_path : str
+        The product cache directory.
+    master_dataset_list : list of str
+        All of the dataset types of the product.
+
+    Returns
+    -------
+    sqlite3.Connection
+    """
+    if not os.path.exists(product_path):
+        os.makedirs(product_path)
+    index_path = os.path.join(product_path, index_file_name)
+    new_index = not os.path.isfile(index_path)
+
+    conn = sqlite3.connect(index_path, timeout=index_timeout)
+    conn.execute('PRAGMA journal_mode=WAL')
+    with conn:
+        conn.execute(create_table)
+        conn.execute(create_time_index)
+        conn.execute(create_tiles_table)
+        conn.execute(create_stats_table)
+        table_columns = [c[1] for c in conn.execute('PRAGMA table_info(granules)')]
+        for c, t in added_columns.items():
+            if c not in table_columns:
+                conn.execute('ALTER TABLE granules ADD COLUMN {c} {t}'.format(c=c, t=t))
+
+    if new_index:
+        old_path = os.path.join(product_path, old_index_name)
+        if os.path.isfile(old_path):
+            print('Converting the pickled index of local files...')
+            with open(old_path, 'rb') as handle:
+                old_index = pickle.load(handle)
+            if isinstance(old_index, set):
+                old_index = {path: set(master_dataset_list) for path in old_index}
+            old_index = {path: v for path, v in old_index.items() if os.path.isfile(path)}
+        else:
+            print('Building index of existing local files...')
+            old_index = {}
+            for path, subdirs, files in os.walk(product_path):
+                for name in files:
+                    if name.endswith('.nc4'):
+                        file_path = os.path.join(path, name)
+                        with xr.open_dataset(file_path) as ds0:
+                            old_index[file_path] = set(ds0.data_vars)
+        records = [{'path': path, 'variables': v, 'size': os.path.getsize(path)} for path, v in old_index.items()]
+        update_index(conn, records)
+
+    with conn:
+        conn.execute('UPDATE granules SET access_date = ? WHERE access_date IS NULL', (pd.Timestamp.now().isoformat(),))
+
+    return conn
+
+
+def index_variables(conn, paths):
+    """
+    Function to get the variables of the cached granule files with the status 'ok'. The paths that aren't in the index are not returned.
+
+    Parameters
+    ----------
+    conn : sqlite3.Connection
+        The granule index.
+    paths : list of str
+        The file paths.
+
+    Returns
+    -------
+    dict
+        The file paths as keys and the sets of variables as values.
+    """
+    paths = list(paths)
+    output = {}
+    for i in range(0, len(paths), query_size):
+        chunk = paths[i:(i + query_size)]
+        sql = 'SELECT path, variables FROM granules WHERE status = ? AND path IN ({q})'.format(q=', '.join(['?'] * len(chunk)))
+        for path, variables in conn.execute(sql, ['ok'] + chunk):
+            output[path] = set(variables.split(','))
+    return output
+
+
+def index_sources(conn, paths):
+    """
+    Function to get the source modified dates and sizes of the cached granules.
+
+    Parameters
+    ----------
+    conn : sqlite3.Connection
+        The granule index.
+    paths : list of str
+        The file paths of the granules.
+
+    Returns
+    -------
+    dict
+        The file paths as keys and tuples of the modified date and size as values. Either is None if it wasn't recorded.
+    """
+    paths = list(paths)
+    output = {}
+    for i in range(0, len(paths), query_size):
+        chunk = paths[i:(i + query_size)]
+        sql = 'SELECT path, modified_date, source_size FROM granules WHERE status = ? AND path IN ({q})'.format(q=', '.join(['?'] * len(chunk)))
+        for path, modified, size in conn.execute(sql, ['ok'] + chunk):
+            output[path] = (modified, size)
+    return output
+
+
+def index_tiles(conn, paths):
+    """
+    Function to get the cached tiles of the variables of granule files. The variables that were cached before the tiles were indexed have no tiles and are not returned.
+
+    Parameters
+    ----------
+    conn : sqlite3.Connection
+        The granule index.
+    paths : list of str
+        The file paths.
+
+    Returns
+    -------
+    dict
+        The file paths as keys and dicts of the variables and their sets of tiles as values.
+    """
+    paths = list(paths)
+    output = {}
+    for i in range(0, len(paths), query_size):
+        chunk = paths[i:(i + query_size)]
+        sql = 'SELECT path, variable, tile FROM tiles WHERE path IN ({q})'.format(q=', '.join(['?'] * len(chunk)))
+        for path, variable, tile in conn.execute(sql, chunk):
+            output.setdefault(path, {}).setdefault(variable, set()).add(tile)
+    return output
+
+
+def update_index(conn, records):
+    """
+    Function to insert or update granule records in one transaction. The variables and tiles of existing records are merged with the new ones, the extent is the union of the extents, and the other fields that are missing or None in the new records are kept.
+
+    Parameters
+    ----------
+    conn : sqlite3.Connection
+        The granule index.
+    records : list of dict
+        The records with at least the path and variables. The other fields are from_date, to_date, min_lat, max_lat, min_lon, max_lon, size, modified_date, source_size, status (default 'ok'), and tiles (the cached tiles of the variables). The from_date and to_date are decoded from the file names if not given.
+    """
+    if not records:
+        return
+
+    paths = [r['path'] for r in records]
+    from_dates, to_dates = granule_dates(paths)
+
+    with conn:
+        conn.execute('BEGIN IMMEDIATE')
+        existing = {}
+        for i in range(0, len(paths), query_size):
+            chunk = paths[i:(i + query_size)]
+            sql = 'SELECT {c} FROM granules WHERE path IN ({q})'.format(c=', '.join(columns), q=', '.join(['?'] * len(chunk)))
+            for row in conn.execute(sql, chunk):
+                existing[row[0]] = dict(zip(columns, row))
+
+        rows = []
+        for r, from_date, to_date in zip(records, from_dates, to_dates):
+            row = existing.get(r['path'], {'from_date': from_date, 'to_date': to_date})
+            variables = set(r['variables'])
+            if row.get('variables') and (row.get('status') == 'ok'):
+                variables.update(row['variables'].split(','))
+            for c in columns[1:]:
+                if (c in ['min_lat', 'min_lon']) and (row.get(c) is not None) and (r.get(c) is not None):
+                    row[c] = min(row[c], r[c])
+                elif (c in ['max_lat', 'max_lon']) and (row.get(c) is not None) and (r.get(c) is not None):
+                    row[c] = max(row[c], r[c])
+                elif r.get(c) is not None:
+                    row[c] = r[c]
+            row['path'] = r['path']
+            row['variables'] = ','.join(sorted(variables))
+            row['status'] = r.get('status', 'ok')
+            rows.append([row.get(c) for c in columns])
+
+        conn.executemany('INSERT OR REPLACE INTO granules ({c}) VALUES ({q})'.format(c=', '.join(columns), q=', '.join(['?'] * len(columns))), rows)
+
+        tile_rows = [(r['path'], v, t) for r in records if r.get('tiles') for v in r['variables'] for t in r['tiles']]
+        conn.executemany('INSERT OR IGNORE INTO tiles (path, variable, tile) VALUES (?, ?, ?)', tile_rows)
+
+
+def query_index(conn, from_date=None, to_date=None, status='ok'):
+    """
+    Function to get the granule records that start within a time range.
+
+    Parameters
+    ----------
+    conn : sqlite3.Connection
+        The granule index.
+    from_date : str, Timestamp, or None
+        The start of the time range.
+    to_date : str, Timestamp, or None
+        The end of the time range (inclusive).
+    status : str or None
+        The status of the records. None for all of them.
+
+    Returns
+    -------
+    DataFrame
+    """
+    where = []
+    params = []
+    if from_date is not None:
+        where.append('from_date >= ?')
+        params.append(pd.Timestamp(from_date).isoformat())
+    if to_date is not None:
+        where.append('from_date <= ?')
+        params.append(pd.Timestamp(to_date).isoformat())
+    if status is not None:
+        where.append('status = ?')
+        params.append(status)
+    sql = 'SELECT {c} FROM granules'.format(c=', '.join(columns))
+    if where:
+        sql = sql + ' WHERE ' + ' AND '.join(where)
+    sql = sql + ' ORDER BY from_date, path'
+
+    df = pd.DataFrame(conn.execute(sql, params).fetchall(), columns=columns)
+    df['from_date'] = pd.to_datetime(df['from_date'])
+    df['to_date'] = pd.to_datetime(df['to_date'])
+    return df
+
+
+def touch_index(conn, paths):
+    """
+    Function to set the access date of granules to the current time.
+    """
+    now = pd.Timestamp.now().isoformat()
+    with conn:
+        conn.executemany('UPDATE granules SET access_date = ? WHERE path = ?', [(now, p) for p in paths])
+
+
+def remove_index(conn, paths):
+    """
+    Function to remove granules and their tiles from the index.
+    """
+    with conn:
+        conn.executemany('DELETE FROM granules WHERE path = ?', [(p,) for p in paths])
+        conn.executemany('DELETE FROM tiles WHERE path = ?', [(p,) for p in paths])
+
+
+def add_stats(conn, stats):
+    """
+    Function to add counts to the running totals of the cache stats.
+
+    Parameters
+    ----------
+    conn : sqlite3.Connection
+        The granule index.
+    stats : dict
+        The stat names as keys and the counts as values.
+
+    Returns
+    -------
+    dict
+        The running totals of all of the stats.
+    """
+    with conn:
+        conn.executemany('INSERT OR IGNORE INTO stats (name, value) VALUES (?, 0)', [(k,) for k in stats])
+        conn.executemany('UPDATE stats SET value = value + ? WHERE name = ?', [(int(v), k) for k, v in stats.items()])
+    return dict(conn.execute('SELECT name, value FROM stats').fetchall())
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Pipelined execution of staged work. Each stage runs in its own thread and the stages are connected by bounded queues, so the stages of consecutive items overlap and the total time approaches the time of the slowest stage rather than the sum of the stages.
+"""
+import threading
+from queue import Queue, Full, Empty
+
+###############################################
+### Parameters
+
+poll_interval = 0.1
+
+###############################################
+### Functions
+
+
+class StageError(object):
+    """
+    Wrapper of an exception raised in a stage. It's passed down the pipeline in place of the item and raised by run_pipeline.
+    """
+    def __init__(self, err):
+        self.err = err
+
+
+_done = object()
+
+
+def run_pipeline(items, stages, queue_size=1):
+    """
+    Generator to run items through a sequence of functions. Each function runs in its own thread, takes the output of the previous function, and at most queue_size outputs are waiting between two stages. The outputs of the last stage are yielded in the order of the items. An exception in a stage stops the pipeline and is raised.
+
+    Parameters
+    ----------
+    items : iterable
+        The inputs of the first stage.
+    stages : list of callable
+        The functions of the stages.
+    queue_size : int
+        The max number of outputs of a stage that are waiting for the next stage.
+
+    Returns
+    -------
+    Generator of the outputs of the last stage
+    """
+    stop = threading.Event()
+    queues = [Queue(queue_size) for s in stages]
+
+    def put(q, item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=poll_interval)
+                return True
+            except Full:
+                pass
+        return False
+
+    def get(q):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=poll_interval)
+            except Empty:
+                pass
+        return _done
+
+    def source(q):
+        while True:
+            item = get(q)
+            if item is _done:
+                return
+            yield item
+
+    def run_stage(func, inputs, q):
+        for item in inputs:
+            if stop.is_set():
+                return
+            if not isinstance(item, StageError):
+                try:
+                    item = func(item)
+                except Exception as err:
+                    item = StageError(err)
+            if not put(q, item):
+                return
+        put(q, _done)
+
+    threads = []
+    inputs = items
+    for func, q in zip(stages, queues):
+        thread = threading.Thread(target=run_stage, args=(func, inputs, q), daemon=True)
+        thread.start()
+        threads.append(thread)
+        inputs = source(q)
+
+    try:
+        for item in inputs:
+            if isinstance(item, StageError):
+                raise item.err
+            yield item
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
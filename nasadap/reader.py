@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+Batched reader of the cached netcdf granules. The cached granules all have the same simple layout (a single time and the lon and lat coordinates of the product grid), so they are read with netCDF4 straight into preallocated arrays rather than via open_mfdataset, which spends most of its time decoding the metadata of every file, aligning the coordinates, and building the dask graph.
+"""
+import threading
+import numpy as np
+import xarray as xr
+import netCDF4
+from multiprocessing.pool import ThreadPool
+from xarray.coding.times import decode_cf_datetime
+
+try:
+    from xarray.backends.locks import HDF5_LOCK as hdf5_lock
+except ImportError:
+    hdf5_lock = threading.Lock()
+
+## netCDF-C and HDF5 aren't thread-safe, so every netcdf open, read, and write of nasadap is made under netcdf_lock. xarray only takes its own (non-reentrant) HDF5 lock per operation, so netcdf_lock is a separate reentrant lock that is held around the whole xarray calls. The direct netCDF4 calls also take xarray's lock.
+netcdf_lock = threading.RLock()
+
+###############################################
+### Parameters
+
+read_threads = 8
+time_unit_codes = {'days': 'D', 'hours': 'h', 'minutes': 'm', 'seconds': 's', 'milliseconds': 'ms', 'microseconds': 'us', 'nanoseconds': 'ns'}
+
+###############################################
+### Functions
+
+
+def nc_attrs(obj):
+    """
+    Function to get the attributes of a netCDF4 dataset or variable as a dict.
+    """
+    return {k: obj.getncattr(k) for k in obj.ncattrs()}
+
+
+def bbox_index(values, min1, max1):
+    """
+    Function to get the index range of sorted coordinates within inclusive bounds like xarray's sel with slices. Also like xarray, the bounds are compared in the dtype of float coordinates, so a bound on a float32 cell centre (e.g. -49.95) includes that cell.
+    """
+    if values.dtype.kind == 'f':
+        min1 = None if min1 is None else values.dtype.type(min1)
+        max1 = None if max1 is None else values.dtype.type(max1)
+    start = 0 if min1 is None else int(np.searchsorted(values, min1, 'left'))
+    stop = len(values) if max1 is None else int(np.searchsorted(values, max1, 'right'))
+    return start, stop
+
+
+def decode_times(values, units):
+    """
+    Function to decode the time values of the granules in one pass. Each granule has its own reference date in the units, so the reference dates are parsed by numpy and the offsets are added per time unit. Units that can't be parsed this way are decoded by xarray one at a time.
+
+    Parameters
+    ----------
+    values : list of int or float
+        The encoded time values.
+    units : list of str
+        The CF time units of the values (e.g. 'days since 2019-03-28 00:29:59.999').
+
+    Returns
+    -------
+    ndarray of datetime64[ns]
+    """
+    try:
+        unit_list, refs = zip(*[u.split(' since ') for u in units])
+        times = np.array(refs, dtype='datetime64[ns]')
+        values = np.asarray(values)
+        unit_array = np.array(unit_list)
+        for unit in set(unit_list):
+            i = unit_array == unit
+            ns = np.timedelta64(1, time_unit_codes[unit]).astype('timedelta64[ns]').astype('int64')
+            times[i] = times[i] + np.round(values[i] * ns).astype('int64').astype('timedelta64[ns]')
+    except (ValueError, KeyError):
+        times = np.array([decode_cf_datetime(np.array([v]), u)[0] for v, u in zip(values, units)], dtype='datetime64[ns]')
+
+    return times
+
+
+def read_file(path):
+    """
+    Function to read the bytes of a file.
+    """
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def read_bbox(nc, dataset_types, min_lat, max_lat, min_lon, max_lon):
+    """
+    Function to read the raw bounding box of the variables of an open netCDF4 granule as (lon, lat) arrays. The variables that aren't in the granule are left out.
+
+    Returns
+    -------
+    tuple
+        The lon and lat of the bounding box and the dict of the arrays.
+    """
+    lon0 = nc['lon'][:]
+    lat0 = nc['lat'][:]
+    lon_start, lon_stop = bbox_index(lon0, min_lon, max_lon)
+    lat_start, lat_stop = bbox_index(lat0, min_lat, max_lat)
+
+    arrays = {}
+    if (lon_stop > lon_start) and (lat_stop > lat_start):
+        index = {'time': 0, 'lon': slice(lon_start, lon_stop), 'lat': slice(lat_start, lat_stop)}
+        for ar in dataset_types:
+            if ar in nc.variables:
+                var = nc[ar]
+                values = var[tuple(index[d] for d in var.dimensions)]
+                if [d for d in var.dimensions if d != 'time'] == ['lat', 'lon']:
+                    values = values.T
+                arrays[ar] = values
+
+    return lon0[lon_start:lon_stop], lat0[lat_start:lat_stop], arrays
+
+
+def read_granule(content, dataset_types, lon, lat, min_lat, max_lat, min_lon, max_lon, data, slot):
+    """
+    Function to read the bounding box of the variables of a cached granule into its time slot of the output arrays.
+
+    Returns
+    -------
+    tuple
+        The raw time value and its units.
+    """
+    with netcdf_lock, hdf5_lock:
+        with netCDF4.Dataset('granule.nc4', memory=content) as nc:
+            nc.set_auto_maskandscale(False)
+            lon0, lat0, arrays = read_bbox(nc, dataset_types, min_lat, max_lat, min_lon, max_lon)
+            time = nc['time']
+            time_value, units = time[0], time.getncattr('units')
+
+    if arrays:
+        i = int(np.abs(lon - lon0[0]).argmin())
+        j = int(np.abs(lat - lat0[0]).argmin())
+        for ar, values in arrays.items():
+            data[ar][slot, i:(i + values.shape[0]), j:(j + values.shape[1])] = values
+
+    return time_value, units
+
+
+def read_granules(paths, dataset_types, min_lat=None, max_lat=None, min_lon=None, max_lon=None, grid=None, threads=read_threads):
+    """
+    Function to read the bounding box of many cached netcdf granules into one dataset. The files are read by a thread pool and the variables are copied straight into preallocated (time, lon, lat) arrays. The fill values, scale factors, and offsets are decoded once for the whole arrays rather than per file.
+
+    Parameters
+    ----------
+    paths : list of str
+        The paths of the cached netcdf granules.
+    dataset_types : list of str
+        The dataset types.
+    min_lat : int, float, or None
+        The minimum lat to extract in WGS84 decimal degrees.
+    max_lat : int, float, or None
+        The maximum lat to extract in WGS84 decimal degrees.
+    min_lon : int, float, or None
+        The minimum lon to extract in WGS84 decimal degrees.
+    max_lon : int, float, or None
+        The maximum lon to extract in WGS84 decimal degrees.
+    grid : dict or None
+        The grid descriptor of the product. If None, then the coordinates of the first granule are used as the grid.
+    threads : int
+        The number of threads that read the files.
+
+    Returns
+    -------
+    xarray dataset
+        Coordinates are time, lon, lat
+    """
+    paths = sorted(paths)
+
+    ## The metadata of the first granule
+    with netcdf_lock, hdf5_lock:
+        with netCDF4.Dataset(paths[0]) as nc:
+            nc.set_auto_maskandscale(False)
+            attrs = nc_attrs(nc)
+            var_dict = {ar: (nc[ar].dtype, nc_attrs(nc[ar])) for ar in dataset_types}
+            if grid is None:
+                grid = {'lon': nc['lon'][:], 'lat': nc['lat'][:]}
+            coord_attrs = {c: {k: v for k, v in nc_attrs(nc[c]).items() if k != '_FillValue'} for c in ['lon', 'lat']}
+
+    lon_start, lon_stop = bbox_index(grid['lon'], min_lon, max_lon)
+    lat_start, lat_stop = bbox_index(grid['lat'], min_lat, max_lat)
+    lon = grid['lon'][lon_start:lon_stop]
+    lat = grid['lat'][lat_start:lat_stop]
+
+    data = {}
+    for ar, (dtype, var_attrs) in var_dict.items():
+        fill_value = var_attrs.get('_FillValue', var_attrs.get('missing_value', np.nan if dtype.kind == 'f' else 0))
+        data[ar] = np.full((len(paths), len(lon), len(lat)), fill_value, dtype)
+
+    ## Read the files
+    def read(slot):
+        content = read_file(paths[slot])
+        return read_granule(content, dataset_types, lon, lat, min_lat, max_lat, min_lon, max_lon, data, slot)
+
+    pool = ThreadPool(min(threads, len(paths)))
+    output = pool.map(read, range(len(paths)))
+    pool.close()
+
+    values, units = zip(*output)
+    times = decode_times(values, units)
+
+    ds = xr.Dataset({ar: (('time', 'lon', 'lat'), data[ar], var_dict[ar][1]) for ar in dataset_types}, coords={'time': times, 'lon': lon, 'lat': lat}, attrs=attrs)
+    ds = xr.decode_cf(ds, decode_times=False)
+    ds['lon'].attrs = grid.get('lon_attrs', coord_attrs['lon'])
+    ds['lat'].attrs = grid.get('lat_attrs', coord_attrs['lat'])
+
+    return ds
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming temporal resampling of the granules into a rollup pyramid. The granules are folded into the bins of the finest level (e.g. hours) as they are streamed, and each closed bin is folded into the next level (e.g. days and then months), so the memory use only depends on the grid and not on the date range.
+"""
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+###############################################
+### Parameters
+
+## The levels of the pyramid from fine to coarse and their names
+rollup_levels = {'h': 'hourly', 'D': 'daily', 'M': 'monthly', 'Y': 'yearly'}
+
+## The time chunk of the files of each level
+rollup_chunks = {'h': 24, 'D': 31, 'M': 12, 'Y': 1}
+
+###############################################
+### Functions
+
+
+def check_levels(levels):
+    """
+    Function to check that the levels are a subset of rollup_levels in order from fine to coarse.
+    """
+    order = list(rollup_levels)
+    if (not levels) or any(l not in rollup_levels for l in levels):
+        raise ValueError('levels must be one or more of: ' + ', '.join(order))
+    if [order.index(l) for l in levels] != sorted(order.index(l) for l in levels):
+        raise ValueError('levels must be in order from fine to coarse: ' + ', '.join(order))
+
+
+def rate_scale(attrs, step):
+    """
+    Function to get the multiplier that converts the sum of the values of a variable to a total. Rates per hour (e.g. mm/hr) are multiplied by the length of the time step in hours and the other variables are summed as is. Returns the scale and the units of the sums.
+    """
+    units = attrs.get('units')
+    if isinstance(units, str) and units.endswith('/hr'):
+        return pd.Timedelta(step) / pd.Timedelta('1h'), units[:-3]
+    return 1, units
+
+
+class Rollup(object):
+    """
+    Accumulator of the bins of a rollup pyramid. The time steps must be added in time order. A bin is closed when the stream moves past its end, and the closed bins of all levels are taken with pop.
+
+    Parameters
+    ----------
+    levels : list of str
+        The levels of rollup_levels from fine to coarse.
+    step : str
+        The pandas frequency of the time steps (e.g. '30min'). The time of a time step is its end time, which is within its bin of the finest level.
+    """
+    def __init__(self, levels, step):
+        check_levels(levels)
+        self.levels = levels
+        self.step = pd.Timedelta(step)
+        self.scales = None
+        self.coords = None
+        self.attrs = {}
+        self.last_time = None
+        self.open = [None] * len(levels)
+        self.closed = [[] for l in levels]
+
+    def add(self, ds):
+        """
+        Method to fold the time steps of a dataset with dims time, lon, and lat into the pyramid.
+        """
+        if self.scales is None:
+            self.scales = {}
+            for ar in ds.data_vars:
+                units = ds[ar].attrs.get('units')
+                self.scales[ar], sum_units = rate_scale(ds[ar].attrs, self.step)
+                self.attrs[ar] = ({'units': units} if units else {}, {'units': sum_units} if sum_units else {})
+            self.coords = {'lon': ds['lon'], 'lat': ds['lat']}
+
+        times = ds.time.to_index()
+        self.last_time = times[-1]
+        labels = times.to_period(self.levels[0])
+        breaks = np.flatnonzero(labels[1:] != labels[:-1]) + 1
+        values = {ar: ds[ar].transpose('time', 'lon', 'lat').values for ar in self.scales}
+        for index in np.split(np.arange(len(times)), breaks):
+            part = {ar: v[index] for ar, v in values.items()}
+            stats = {'sum': {ar: np.nansum(v, 0) * self.scales[ar] for ar, v in part.items()},
+                     'max': {ar: np.fmax.reduce(v, 0) for ar, v in part.items()},
+                     'count': {ar: (~np.isnan(v)).sum(0) for ar, v in part.items()},
+                     'steps': len(index)}
+            next_label = (times[index[-1]] + self.step).to_period(self.levels[0])
+            self._fold(0, labels[index[0]], stats, next_label)
+
+    def _merge(self, label, b, stats):
+        """
+        Method to combine the stats of two bins into a new bin.
+        """
+        if b is None:
+            return {'label': label, 'sum': dict(stats['sum']), 'max': dict(stats['max']), 'count': dict(stats['count']), 'steps': stats['steps']}
+        return {'label': label,
+                'sum': {ar: b['sum'][ar] + stats['sum'][ar] for ar in self.scales},
+                'max': {ar: np.fmax(b['max'][ar], stats['max'][ar]) for ar in self.scales},
+                'count': {ar: b['count'][ar] + stats['count'][ar] for ar in self.scales},
+                'steps': b['steps'] + stats['steps']}
+
+    def _fold(self, i, label, stats, next_label):
+        b = self.open[i]
+        if (b is not None) and (b['label'] != label):
+            self._close(i)
+            b = None
+        self.open[i] = self._merge(label, b, stats)
+        if next_label != label:
+            self._close(i)
+
+    def _close(self, i):
+        b = self.open[i]
+        self.open[i] = None
+        self.closed[i].append(b)
+        if i + 1 < len(self.levels):
+            parent = self.levels[i + 1]
+            self._fold(i + 1, b['label'].asfreq(parent), {k: b[k] for k in ('sum', 'max', 'count', 'steps')}, (b['label'] + 1).asfreq(parent))
+
+    def pop(self, partial=False):
+        """
+        Method to take the closed bins of each level as datasets. If partial is True, then the open bins (including the open bins of the finer levels) are included with complete set to 0.
+
+        Returns
+        -------
+        dict of level to xarray dataset
+        """
+        output = {}
+        child = None
+        for i, level in enumerate(self.levels):
+            bins = [dict(b, complete=1) for b in self.closed[i]]
+            self.closed[i] = []
+            if partial:
+                b = self.open[i]
+                if child is not None:
+                    label = child['label'].asfreq(level)
+                    if (b is None) or (b['label'] == label):
+                        b = self._merge(label, b, child)
+                if b is not None:
+                    bins.append(dict(b, complete=0))
+                child = b
+            if bins:
+                output[level] = self.to_dataset(bins)
+        return output
+
+    def to_dataset(self, bins):
+        """
+        Method to convert bins to a dataset. The time is the start of each bin. Each variable has the sum, mean, max, and the count of the time steps with data of each cell, and the bins have the number of time steps and whether they're complete.
+        """
+        times = pd.DatetimeIndex([b['label'].start_time for b in bins])
+        dims = ('time', 'lon', 'lat')
+        data_vars = {}
+        for ar in self.scales:
+            count = np.stack([b['count'][ar] for b in bins]).astype('int32')
+            total = np.where(count > 0, np.stack([b['sum'][ar] for b in bins]), np.nan).astype('float32')
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = (total / (count * self.scales[ar])).astype('float32')
+            attrs, sum_attrs = self.attrs[ar]
+            data_vars[ar + '_sum'] = (dims, total, dict(sum_attrs, cell_methods='time: sum'))
+            data_vars[ar + '_mean'] = (dims, mean, dict(attrs, cell_methods='time: mean'))
+            data_vars[ar + '_max'] = (dims, np.stack([b['max'][ar] for b in bins]).astype('float32'), dict(attrs, cell_methods='time: maximum'))
+            data_vars[ar + '_count'] = (dims, count, {'long_name': 'number of time steps with data'})
+        data_vars['steps'] = ('time', np.array([b['steps'] for b in bins], 'int32'), {'long_name': 'number of time steps'})
+        data_vars['complete'] = ('time', np.array([b['complete'] for b in bins], 'int8'), {'long_name': 'whether the bin is closed'})
+
+        return xr.Dataset(data_vars, coords=dict(self.coords, time=times))
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Adaptive concurrency control of the granule downloads.
+"""
+import random
+import threading
+from time import perf_counter, sleep
+
+###############################################
+### Parameters
+
+retries = 4
+backoff = 1
+throttle_codes = [429, 502, 503, 504]
+latency_floor = 0.5
+
+###############################################
+### Functions
+
+
+def error_status(err):
+    """
+    Function to get the http status code of an error raised while opening a url. Returns None if there isn't one.
+    """
+    while err is not None:
+        code = getattr(err, 'code', None)
+        if isinstance(code, int):
+            return code
+        response = getattr(err, 'response', None)
+        code = getattr(response, 'status_code', None)
+        if isinstance(code, int):
+            return code
+        err = err.__cause__
+    return None
+
+
+def backoff_wait(attempt, backoff=backoff):
+    """
+    Function to sleep before the next attempt. The wait is an exponential backoff with jitter.
+    """
+    sleep(backoff * 2**(attempt - 1) * random.uniform(0.5, 1.5))
+
+
+class AdaptiveLimiter(object):
+    """
+    Class to limit the number of simultaneous downloads with additive increase/multiplicative decrease (AIMD). The limit is increased by one for every limit number of successful downloads. It's halved when a download fails, is throttled by the server, or when the mean download latency rises above latency_factor times the lowest latency seen (latencies below the latency_floor are not considered congestion). Only the downloads that started after the last decrease can decrease the limit again, so a burst of errors from the same window only counts once.
+
+    Parameters
+    ----------
+    max_limit : int
+        The max number of simultaneous downloads.
+    start_limit : int or None
+        The initial number of simultaneous downloads. If None, then a quarter of the max_limit.
+    min_limit : int
+        The min number of simultaneous downloads.
+    latency_factor : int or float
+        The ratio of the mean latency to the lowest latency that's considered congestion.
+    latency_floor : int or float
+        The lowest latency in seconds used for the ratio.
+
+    Returns
+    -------
+    AdaptiveLimiter object
+    """
+    def __init__(self, max_limit, start_limit=None, min_limit=1, latency_factor=3, latency_floor=latency_floor):
+        if start_limit is None:
+            start_limit = max_limit // 4
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(min(max(start_limit, min_limit), max_limit))
+        self.latency_factor = latency_factor
+        self.latency_floor = latency_floor
+        self.in_flight = 0
+        self.completed = 0
+        self.not_found = 0
+        self.errors = 0
+        self.throttled = 0
+        self.decreases = 0
+        self.mean_latency = None
+        self.min_latency = None
+        self._start = perf_counter()
+        self._last_decrease = self._start
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """
+        Wait for a free download slot. Returns the start time to be passed to release.
+        """
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+        return perf_counter()
+
+    def release(self, start, status='ok'):
+        """
+        Free a download slot and update the limit.
+
+        Parameters
+        ----------
+        start : float
+            The output of acquire.
+        status : str
+            The outcome of the download. One of 'ok', 'not_found', 'throttled', or 'error'.
+        """
+        now = perf_counter()
+        latency = now - start
+        with self._cond:
+            self.in_flight -= 1
+            if status == 'ok':
+                self.completed += 1
+                if self.mean_latency is None:
+                    self.mean_latency = latency
+                    self.min_latency = latency
+                else:
+                    self.mean_latency = 0.8 * self.mean_latency + 0.2 * latency
+                    self.min_latency = min(self.min_latency, latency)
+                if self.mean_latency > self.latency_factor * max(self.min_latency, self.latency_floor):
+                    self._decrease(start, now, 'latency')
+                else:
+                    self.limit = min(self.limit + 1 / int(self.limit), self.max_limit)
+            elif status == 'not_found':
+                self.not_found += 1
+            else:
+                if status == 'throttled':
+                    self.throttled += 1
+                else:
+                    self.errors += 1
+                self._decrease(start, now, status)
+            self._cond.notify_all()
+
+    def _decrease(self, start, now, reason):
+        if (start >= self._last_decrease) and (self.limit > self.min_limit):
+            self.limit = max(self.limit / 2, self.min_limit)
+            self._last_decrease = now
+            self.decreases += 1
+            print('Download limit decreased to {limit} ({reason})'.format(limit=int(self.limit), reason=reason))
+
+    def stats(self):
+        """
+        The current limit and download stats.
+
+        Returns
+        -------
+        dict
+        """
+        with self._cond:
+            elapsed = perf_counter() - self._start
+            stats = {'limit': int(self.limit), 'max_limit': self.max_limit, 'in_flight': self.in_flight, 'completed': self.completed, 'not_found': self.not_found, 'errors': self.errors, 'throttled': self.throttled, 'decreases': self.decreases, 'mean_latency': self.mean_latency, 'min_latency': self.min_latency, 'throughput': self.completed / elapsed}
+        return stats
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+Consolidated zarr cache store. The granules of a product are written into one chunked and compressed store per month rather than one netcdf file per granule, so that months of data can be read with a single open call.
+"""
+import os
+import shutil
+import threading
+import numpy as np
+import pandas as pd
+import xarray as xr
+from multiprocessing.pool import ThreadPool
+from nasadap.grid import tile_cells
+
+try:
+    import zarr
+    import dask.array as da
+except ImportError:
+    zarr = None
+
+###############################################
+### Parameters
+
+cache_formats = ['netcdf', 'zarr']
+store_dir_name = 'zarr'
+store_file_name = '{year}-{month:02}.zarr'
+store_threads = 4
+time_var = 'granule_time'
+time_units = 'milliseconds since 1970-01-01'
+
+store_lock = threading.Lock()
+
+###############################################
+### Functions
+
+
+def store_path(store_dir, month):
+    """
+    Function to get the path of the store of a month.
+    """
+    return os.path.join(store_dir, store_file_name.format(year=month.year, month=month.month))
+
+
+def granule_slots(times, freq):
+    """
+    Function to get the months and the time slots within the months of granules from their start or end times.
+
+    Parameters
+    ----------
+    times : list of datetime
+        The start or end times of the granules.
+    freq : str or Timedelta
+        The time frequency of the product.
+
+    Returns
+    -------
+    list of Timestamp, list of int
+    """
+    freq = pd.Timedelta(freq)
+    starts = pd.DatetimeIndex(times).floor(freq)
+    months = [pd.Timestamp(t.year, t.month, 1) for t in starts]
+    slots = [int((t - m) / freq) for t, m in zip(starts, months)]
+    return months, slots
+
+
+def store_template(month, freq, grid, var_dict, attrs={}):
+    """
+    Function to create the lazy template dataset of a month store with all of the time slots of the month and the full product grid. The time chunks are one day of granules and the lon/lat chunks are the tiles of the grid. The end times of the granules are stored in the granule_time variable, and the slots that haven't been written are NaT.
+
+    Parameters
+    ----------
+    month : Timestamp
+        The start of the month.
+    freq : str or Timedelta
+        The time frequency of the product.
+    grid : dict
+        The grid descriptor.
+    var_dict : dict
+        The variable names as keys and tuples of the dtype and attributes as values. The _FillValue attribute is used as the fill value of the variable.
+    attrs : dict
+        The global attributes.
+
+    Returns
+    -------
+    xarray dataset
+    """
+    freq = pd.Timedelta(freq)
+    day_slots = int(pd.Timedelta(days=1) / freq)
+    n_slots = month.days_in_month * day_slots
+    shape = (n_slots, len(grid['lon']), len(grid['lat']))
+    chunks = (day_slots,) + tile_cells(grid)
+
+    ds = xr.Dataset(coords={'time': pd.date_range(month, periods=n_slots, freq=freq), 'lon': grid['lon'], 'lat': grid['lat']}, attrs=attrs)
+    ds['lon'].attrs = grid['lon_attrs']
+    ds['lat'].attrs = grid['lat_attrs']
+
+    ds[time_var] = (('time',), da.zeros(n_slots, dtype='datetime64[ns]', chunks=day_slots))
+    ds[time_var].encoding = {'units': time_units, 'dtype': 'int64', '_FillValue': 0, 'chunks': (day_slots,)}
+
+    for ar, (dtype, var_attrs) in var_dict.items():
+        var_attrs = var_attrs.copy()
+        fill_value = var_attrs.pop('_FillValue', None)
+        ds[ar] = (('time', 'lon', 'lat'), da.zeros(shape, dtype=np.dtype(dtype).newbyteorder('='), chunks=chunks), var_attrs)
+        encoding = {'chunks': chunks}
+        if fill_value is not None:
+            encoding['_FillValue'] = fill_value
+            ## zarr 3 keeps the fill value of unwritten chunks separate from the _FillValue attribute
+            if int(zarr.__version__.split('.')[0]) >= 3:
+                encoding['fill_value'] = fill_value
+        ds[ar].encoding = encoding
+
+    return ds
+
+
+def ensure_store(path, month, freq, grid, var_dict, attrs={}):
+    """
+    Function to create the store of a month or add the missing variables to it. New stores are created under a temporary name and renamed, so processes that create the same store at the same time don't clobber each other.
+    """
+    with store_lock:
+        if os.path.isdir(path):
+            with xr.open_zarr(path) as ds0:
+                new_vars = [ar for ar in var_dict if ar not in ds0.data_vars]
+            if new_vars:
+                ds = store_template(month, freq, grid, {ar: var_dict[ar] for ar in new_vars})
+                ds[new_vars].to_zarr(path, mode='a', compute=False, consolidated=True)
+        else:
+            temp_path = '{path}.{pid}.tmp'.format(path=path, pid=os.getpid())
+            store_template(month, freq, grid, var_dict, attrs).to_zarr(temp_path, mode='w', compute=False, consolidated=True)
+            try:
+                os.rename(temp_path, path)
+            except OSError:
+                shutil.rmtree(temp_path)
+                ensure_store(path, month, freq, grid, var_dict)
+
+
+def write_day(path, granules, grid):
+    """
+    Function to write the granules of one time chunk (day) of a month store. The granules are written as one region per run of consecutive time slots with the same variables and extent.
+    """
+    granules = sorted(granules, key=lambda x: x[0])
+    runs = []
+    for slot, ds in granules:
+        key = (tuple(ds.data_vars), float(ds.lon.values[0]), float(ds.lat.values[0]), len(ds.lon), len(ds.lat))
+        if runs and (runs[-1][0] == key) and (runs[-1][1] + len(runs[-1][2]) == slot):
+            runs[-1][2].append(ds)
+        else:
+            runs.append((key, slot, [ds]))
+
+    for key, slot, ds_list in runs:
+        ds = xr.concat(ds_list, dim='time')
+        lon_start = int(np.searchsorted(grid['lon'], ds.lon.values[0]))
+        lat_start = int(np.searchsorted(grid['lat'], ds.lat.values[0]))
+        region = {'time': slice(slot, slot + len(ds_list)), 'lon': slice(lon_start, lon_start + len(ds.lon)), 'lat': slice(lat_start, lat_start + len(ds.lat))}
+
+        ds1 = xr.Dataset({time_var: (('time',), ds.time.values)})
+        for ar in ds.data_vars:
+            ds1[ar] = (('time', 'lon', 'lat'), ds[ar].transpose('time', 'lon', 'lat').values, {k: v for k, v in ds[ar].attrs.items() if k != '_FillValue'})
+        ds1.to_zarr(path, region=region, mode='r+', consolidated=False)
+
+    return True
+
+
+def write_store(store_dir, ds_list, freq, grid):
+    """
+    Function to write downloaded granules into the month stores of a product. Each time chunk (day) is written by a single thread, so the days can be written at the same time without the threads overwriting each other's chunks.
+
+    Parameters
+    ----------
+    store_dir : str
+        The store directory of the product.
+    ds_list : list of xarray datasets
+        The granules with a single time and the lon and lat coordinates of a bounding box of the grid.
+    freq : str or Timedelta
+        The time frequency of the product.
+    grid : dict
+        The grid descriptor.
+    """
+    if not ds_list:
+        return
+
+    if not os.path.exists(store_dir):
+        os.makedirs(store_dir)
+
+    freq = pd.Timedelta(freq)
+    day_slots = int(pd.Timedelta(days=1) / freq)
+    months, slots = granule_slots([ds.time.values[0] for ds in ds_list], freq)
+
+    month_dict = {}
+    day_dict = {}
+    for ds, month, slot in zip(ds_list, months, slots):
+        if month not in month_dict:
+            month_dict[month] = ({}, ds.attrs)
+        for ar in ds.data_vars:
+            month_dict[month][0][ar] = (ds[ar].dtype, ds[ar].attrs)
+        day_dict.setdefault((month, slot // day_slots), []).append((slot, ds))
+
+    for month, (var_dict, attrs) in month_dict.items():
+        ensure_store(store_path(store_dir, month), month, freq, grid, var_dict, attrs)
+
+    iter1 = [(store_path(store_dir, month), granules, grid) for (month, day), granules in day_dict.items()]
+    pool = ThreadPool(min(store_threads, len(iter1)))
+    pool.starmap(write_day, iter1)
+    pool.close()
+
+
+def read_store(store_dir, times, dataset_types, freq, min_lat=None, max_lat=None, min_lon=None, max_lon=None):
+    """
+    Function to read granules from the month stores of a product with a single open call. The granules that haven't been written are removed.
+
+    Parameters
+    ----------
+    store_dir : str
+        The store directory of the product.
+    times : list of datetime
+        The start or end times of the granules.
+    dataset_types : list of str
+        The dataset types.
+    freq : str or Timedelta
+        The time frequency of the product.
+    min_lat : int, float, or None
+        The minimum lat to extract in WGS84 decimal degrees.
+    max_lat : int, float, or None
+        The maximum lat to extract in WGS84 decimal degrees.
+    min_lon : int, float, or None
+        The minimum lon to extract in WGS84 decimal degrees.
+    max_lon : int, float, or None
+        The maximum lon to extract in WGS84 decimal degrees.
+
+    Returns
+    -------
+    xarray dataset
+        Coordinates are time, lon, lat
+    """
+    starts = pd.DatetimeIndex(times).dropna().floor(freq).unique().sort_values()
+    months = granule_slots(starts, freq)[0]
+    paths = [store_path(store_dir, m) for m in sorted(set(months))]
+    paths = [p for p in paths if os.path.isdir(p)]
+
+    ds = xr.open_mfdataset(paths, engine='zarr', combine='nested', concat_dim='time')
+    starts = starts[starts.isin(ds.time.to_index())]
+    ds1 = ds[dataset_types + [time_var]].sel(time=starts, lat=slice(min_lat, max_lat), lon=slice(min_lon, max_lon))
+
+    end_times = ds1[time_var].values
+    filled = ~np.isnat(end_times)
+    ds1 = ds1.isel(time=np.flatnonzero(filled)).drop_vars(time_var)
+    ds1 = ds1.assign_coords(time=end_times[filled])
+
+    return ds1
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the incremental aggregation.
+"""
+import os
+import numpy as np
+import pandas as pd
+import xarray as xr
+import netCDF4
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from nasadap import agg, catalog
+from nasadap.agg import append_netcdf, read_manifest, save_manifest, time_combine, rollup_combine
+
+###############################
+### Parameters
+
+
+class FakeNasa(object):
+    """
+    A Nasa session on a shared fake cache. The days of get_data that aren't cached yet are recorded as downloads.
+    """
+    cache = set()
+    downloads = []
+
+    def __init__(self, username, password, mission, cache_dir=None, **kwargs):
+        self.cache_dir = cache_dir
+
+    def get_data(self, product, version, datasets, from_date, to_date, **kwargs):
+        days = pd.date_range(from_date, to_date, freq='D')
+        self.downloads.extend(str(day.date()) for day in days if str(day.date()) not in self.cache)
+        self.cache.update(str(day.date()) for day in days)
+        times = pd.date_range(from_date, periods=48 * len(days), freq='30min') + pd.Timedelta('29min 59.999s')
+        data = np.ones((len(times), 2, 2), 'f4')
+        return xr.Dataset({'precipitationCal': (('time', 'lon', 'lat'), data, {'units': 'mm/hr'})}, coords={'time': times, 'lon': [170.05, 170.15], 'lat': [-45.05, -44.95]})
+
+    def iter_data(self, product, version, datasets, from_date, to_date, **kwargs):
+        ## The granules start on the from_date of the fake catalog
+        for day in pd.date_range(max(from_date, '2019-01-01'), to_date, freq='D'):
+            yield self.get_data(product, version, datasets, day, day)
+
+    def close(self):
+        pass
+
+
+def fake_catalog(mission, product, version, cache_dir, min_max=False):
+    return pd.DataFrame({'from_date': [pd.Timestamp('2019-01-01', tz='utc')], 'to_date': [pd.Timestamp('2019-02-10', tz='utc')]})
+
+###############################
+### Tests
+
+
+def test_append_netcdf(tmp_path):
+    times = pd.date_range('2019-03-28 00:29:59.999', periods=6, freq='30min')
+    data = np.arange(6 * 4 * 3, dtype='f4').reshape(6, 4, 3)
+    data[4, 0, 0] = np.nan
+    ds = xr.Dataset({'precipitationCal': (('time', 'lon', 'lat'), data)}, coords={'time': times, 'lon': np.arange(4), 'lat': np.arange(3)})
+
+    path = str(tmp_path / 'agg.nc4')
+    ds.isel(time=slice(0, 2)).to_netcdf(path, unlimited_dims=['time'], encoding={'time': {'units': 'milliseconds since 1970-01-01', 'dtype': 'int64'}})
+
+    assert append_netcdf(path, ds.isel(time=slice(1, 4))) == 2
+    assert append_netcdf(path, ds) == 2
+    assert append_netcdf(path, ds) == 0
+
+    with netCDF4.Dataset(path) as nc:
+        assert nc.dimensions['time'].isunlimited()
+    with xr.open_dataset(path) as ds1:
+        assert ds1.load().equals(ds)
+
+    manifest_path = os.path.join(str(tmp_path), 'manifest.json')
+    assert read_manifest(manifest_path) is None
+    save_manifest({'last_time': times[-1].isoformat(), 'files': {}}, manifest_path)
+    assert pd.Timestamp(read_manifest(manifest_path)['last_time']) == times[-1]
+
+
+def test_time_combine_workers(tmp_path, monkeypatch):
+    monkeypatch.setattr(agg, 'Nasa', FakeNasa)
+    monkeypatch.setattr(agg, 'get_catalog', fake_catalog)
+    monkeypatch.setattr(agg, 'ProcessPoolExecutor', ThreadPoolExecutor)
+    ## The workers run in threads here, so the background_builds they turn off is restored
+    monkeypatch.setattr(catalog, 'background_builds', True)
+    built = []
+    monkeypatch.setattr(agg, 'update_catalog', lambda *args: built.append(len(FakeNasa.downloads)))
+    monkeypatch.setattr(FakeNasa, 'cache', set())
+    monkeypatch.setattr(FakeNasa, 'downloads', [])
+    args = ('gpm', '3IMERGHH', 6, 'precipitationCal', str(tmp_path), 'user', 'pass', str(tmp_path), 12, 'W', -46, -44, 170, 171, 8)
+
+    with pytest.raises(ValueError):
+        time_combine(*args, workers=2, prefetch=1)
+
+    ## The catalog store is built first. The last day of each week is also needed by the next week after the time zone shift, so it's downloaded before the workers start.
+    time_combine(*args, workers=3)
+    assert built == [0]
+    assert FakeNasa.downloads[:5] == ['2019-01-06', '2019-01-13', '2019-01-20', '2019-01-27', '2019-02-03']
+    assert len(FakeNasa.downloads) == len(set(FakeNasa.downloads))
+    assert sorted(FakeNasa.downloads) == [str(day.date()) for day in pd.date_range('2018-12-31', '2019-02-10')]
+    assert len(os.listdir(str(tmp_path / 'gpm_3IMERGHH'))) == 6
+
+
+def test_rollup_resume(tmp_path, monkeypatch):
+    to_dates = ['2019-01-10']
+    monkeypatch.setattr(agg, 'Nasa', FakeNasa)
+    monkeypatch.setattr(agg, 'get_catalog', lambda *args, **kwargs: pd.DataFrame({'from_date': [pd.Timestamp('2019-01-01', tz='utc')], 'to_date': [pd.Timestamp(to_dates[-1], tz='utc')]}))
+    args = ('gpm', '3IMERGHH', 6, 'precipitationCal')
+    login = ('user', 'pass', str(tmp_path), 12, -46, -44, 170, 171, 8)
+
+    ## The second update resumes from the manifest of the first with the default levels
+    rollup_combine(*args, str(tmp_path / 'a'), *login)
+    to_dates.append('2019-02-05')
+    rollup_combine(*args, str(tmp_path / 'a'), *login)
+    rollup_combine(*args, str(tmp_path / 'b'), *login)
+    with pytest.raises(ValueError):
+        rollup_combine(*args, str(tmp_path / 'a'), *login, levels=('h', 'D'))
+
+    manifest = read_manifest(str(tmp_path / 'a' / 'gpm_3IMERGHH' / 'rollup' / 'gpm_3IMERGHH_v06_manifest.json'))
+    assert manifest['levels'] == ['h', 'D', 'M']
+    for level in ['hourly', 'daily', 'monthly']:
+        name = 'gpm_3IMERGHH_v06_{level}_2019.nc4'.format(level=level)
+        with xr.open_dataset(str(tmp_path / 'a' / 'gpm_3IMERGHH' / 'rollup' / name)) as ds1, xr.open_dataset(str(tmp_path / 'b' / 'gpm_3IMERGHH' / 'rollup' / name)) as ds2:
+            assert ds1.drop_attrs().equals(ds2.drop_attrs())
+    with xr.open_dataset(str(tmp_path / 'a' / 'gpm_3IMERGHH' / 'rollup' / 'gpm_3IMERGHH_v06_daily_2019.nc4')) as ds:
+        assert (ds['precipitationCal_sum'].sel(time='2019-01-20') == 24).all()
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+Offline tests of the catalog parsing.
+"""
+import os
+import pytest
+import pandas as pd
+from nasadap import catalog, util
+from nasadap.catalog import get_catalog, update_catalog, read_catalog, catalog_path, partial_path
+from nasadap.core import template_urls, irregular_days, cache_path
+from nasadap.util import mission_product_dict, parse_catalog_xml, parse_refs_xml, parse_dates_xml, process_date_list, decode_granule_names
+
+###############################
+### Parameters
+
+day_xml = b'''<?xml version="1.0" encoding="UTF-8"?>
+<thredds:catalog xmlns:thredds="http://www.unidata.ucar.edu/namespaces/thredds/InvCatalog/v1.0" xmlns:xlink="http://www.w3.org/1999/xlink">
+<thredds:service name="dap" serviceType="OPeNDAP" base="/opendap/hyrax"/>
+<thredds:service name="file" serviceType="HTTPServer" base="/opendap/hyrax"/>
+<thredds:dataset name="/GPM_L3/GPM_3IMERGHHE.06/2019/087" ID="/opendap/hyrax/GPM_L3/GPM_3IMERGHHE.06/2019/087/">
+<thredds:dataset name="3B-HHR-E.MS.MRG.3IMERG.20190328-S000000-E002959.0000.V06B.HDF5" ID="/opendap/hyrax/GPM_L3/GPM_3IMERGHHE.06/2019/087/3B-HHR-E.MS.MRG.3IMERG.20190328-S000000-E002959.0000.V06B.HDF5">
+<thredds:dataSize units="bytes">8062743</thredds:dataSize>
+<thredds:date type="modified">2019-03-28T04:14:36</thredds:date>
+</thredds:dataset>
+<thredds:dataset name="3B-HHR-E.MS.MRG.3IMERG.20190328-S233000-E235959.1410.V06B.HDF5" ID="/opendap/hyrax/GPM_L3/GPM_3IMERGHHE.06/2019/087/3B-HHR-E.MS.MRG.3IMERG.20190328-S233000-E235959.1410.V06B.HDF5">
+<thredds:dataSize units="bytes">8113211</thredds:dataSize>
+<thredds:date type="modified">2019-03-29T03:49:01</thredds:date>
+</thredds:dataset>
+<thredds:dataset name="3B-HHR-E.MS.MRG.3IMERG.20190328.xml" ID="/opendap/hyrax/GPM_L3/GPM_3IMERGHHE.06/2019/087/3B-HHR-E.MS.MRG.3IMERG.20190328.xml">
+<thredds:dataSize units="bytes">1024</thredds:dataSize>
+<thredds:date type="modified">2019-03-29T03:49:01</thredds:date>
+</thredds:dataset>
+</thredds:dataset>
+</thredds:catalog>
+'''
+
+year_xml = b'''<?xml version="1.0" encoding="UTF-8"?>
+<thredds:catalog xmlns:thredds="http://www.unidata.ucar.edu/namespaces/thredds/InvCatalog/v1.0" xmlns:xlink="http://www.w3.org/1999/xlink">
+<thredds:service name="dap" serviceType="OPeNDAP" base="/opendap/hyrax"/>
+<thredds:dataset name="/GPM_L3/GPM_3IMERGHHE.06/2019" ID="/opendap/hyrax/GPM_L3/GPM_3IMERGHHE.06/2019/">
+<thredds:catalogRef name="086" xlink:href="086/catalog.xml" xlink:title="086" xlink:type="simple" ID="/opendap/hyrax/GPM_L3/GPM_3IMERGHHE.06/2019/086/"/>
+<thredds:catalogRef name="087" xlink:href="087/catalog.xml" xlink:title="087" xlink:type="simple" ID="/opendap/hyrax/GPM_L3/GPM_3IMERGHHE.06/2019/087/">
+<thredds:date type="modified">2019-03-29T03:49:01</thredds:date>
+</thredds:catalogRef>
+</thredds:dataset>
+</thredds:catalog>
+'''
+
+base_url = mission_product_dict['gpm']['base_url']
+years_url = base_url + '/opendap/hyrax/GPM_L3/GPM_3IMERGHHE.06'
+catalog_xml = '''<?xml version="1.0" encoding="UTF-8"?>
+<thredds:catalog xmlns:thredds="http://www.unidata.ucar.edu/namespaces/thredds/InvCatalog/v1.0" xmlns:xlink="http://www.w3.org/1999/xlink">
+<thredds:dataset name="{name}" ID="{ID}">
+{refs}
+</thredds:dataset>
+</thredds:catalog>
+'''
+ref_xml = '<thredds:catalogRef name="{name}" xlink:href="{name}/catalog.xml" xlink:title="{name}" xlink:type="simple" ID="{ID}/"><thredds:date type="modified">{modified}</thredds:date></thredds:catalogRef>'
+granule_xml = '<thredds:dataset name="{name}" ID="{ID}"><thredds:dataSize units="bytes">{size}</thredds:dataSize><thredds:date type="modified">{modified}</thredds:date></thredds:dataset>'
+
+
+class FakeServer(object):
+    """
+    The year and day catalogs of a product. days is a dict of date to the number of granules and the modified date of the day. The requested urls are recorded.
+    """
+    def __init__(self, days):
+        self.days = days
+        self.requests = []
+
+    def year_ids(self, year):
+        return '/opendap/hyrax/GPM_L3/GPM_3IMERGHHE.06/{year}'.format(year=year)
+
+    def day_ids(self, date):
+        return '{year}/{day:03}'.format(year=self.year_ids(date.year), day=date.dayofyear)
+
+    def paths(self, url):
+        return [p for p in url[len(years_url):].split('/') if p and (p != 'catalog.xml')]
+
+    def parse_catalog_refs(self, url):
+        self.requests.append(url)
+        years = sorted(set(d.year for d in self.days))
+        return [[str(y), self.year_ids(y) + '/', max(m for d, (n, m) in self.days.items() if d.year == y)] for y in years]
+
+    def fetch_catalogs(self, urls):
+        self.requests.extend(urls)
+        contents = []
+        for url in urls:
+            path = self.paths(url)
+            year = int(path[0])
+            if len(path) == 1:
+                refs = [ref_xml.format(name='{day:03}'.format(day=d.dayofyear), ID=self.day_ids(d), modified=m) for d, (n, m) in sorted(self.days.items()) if d.year == year]
+                contents.append(catalog_xml.format(name=year, ID=self.year_ids(year), refs='\n'.join(refs)).encode())
+            else:
+                date = pd.Timestamp(str(year)) + pd.Timedelta(days=int(path[1]) - 1)
+                n, modified = self.days[date]
+                granules = []
+                for i in range(n):
+                    start = date + pd.Timedelta(minutes=30 * i)
+                    name = '3B-HHR-E.MS.MRG.3IMERG.{date}-S{start}-E{end}.{minutes:04}.V06B.HDF5'.format(date=date.strftime('%Y%m%d'), start=start.strftime('%H%M%S'), end=(start + pd.Timedelta(seconds=1799)).strftime('%H%M%S'), minutes=30 * i)
+                    granules.append(granule_xml.format(name=name, ID=self.day_ids(date) + '/' + name, size=1000 + i, modified=modified))
+                contents.append(catalog_xml.format(name=date, ID=self.day_ids(date), refs='\n'.join(granules)).encode())
+        return contents
+
+
+def fake_server(monkeypatch, days):
+    server = FakeServer(days)
+    monkeypatch.setattr(catalog, 'parse_catalog_refs', server.parse_catalog_refs)
+    monkeypatch.setattr(catalog, 'fetch_catalogs', server.fetch_catalogs)
+    return server
+
+###############################
+### Tests
+
+
+def test_parse_catalog_xml():
+    cat1 = parse_catalog_xml(day_xml)
+
+    assert len(cat1['name']) == 2
+    assert cat1['size'] == [8062743, 8113211]
+    assert cat1['modified'][1] == '2019-03-29T03:49:01'
+    assert cat1['ID'][0].endswith('S000000-E002959.0000.V06B.HDF5')
+
+
+def test_parse_refs_xml():
+    refs1 = parse_refs_xml(year_xml)
+
+    assert [r[0] for r in refs1] == ['086', '087']
+    assert refs1[0][2] is None
+    assert refs1[1][2] == '2019-03-29T03:49:01'
+
+
+def test_process_date_list():
+    date_df = process_date_list([parse_dates_xml(pd.Timestamp('2019-03-28'), day_xml)], 'gpm', '3IMERGHHE', 6)
+
+    assert len(date_df) == 2
+    assert date_df['from_date'].iloc[1] == pd.Timestamp('2019-03-28 23:30:00', tz='utc')
+    assert date_df['to_date'].iloc[1] == pd.Timestamp('2019-03-28 23:59:59', tz='utc')
+    assert date_df['modified_date'].iloc[0] == pd.Timestamp('2019-03-28 04:14:36', tz='utc')
+
+
+def test_decode_granule_names():
+    names = ['3B-HHR.MS.MRG.3IMERG.20191231-S233000-E235959.1410.V06B.HDF5', '3B-HHR-L.MS.MRG.3IMERG.20000601-S000000-E002959.0000.V06B.HDF5', 'catalog.xml']
+    from_date, to_date = decode_granule_names(names)
+
+    assert from_date[0] == pd.Timestamp('2019-12-31 23:30:00')
+    assert to_date[1] == pd.Timestamp('2000-06-01 00:29:59')
+    assert pd.isnull(from_date[2]) and pd.isnull(to_date[2])
+
+
+def test_get_catalog_min_max(tmp_path, monkeypatch):
+    days = {pd.Timestamp('2019-12-30'): (2, '2020-01-01T00:00:00'), pd.Timestamp('2020-01-01'): (3, '2020-01-02T00:00:00')}
+    server = fake_server(monkeypatch, days)
+    bounds = pd.DataFrame({'from_date': [pd.Timestamp('2019-12-30', tz='utc')]})
+    monkeypatch.setattr(catalog, 'get_catalog_bounds', lambda *args: bounds)
+    cache_dir = str(tmp_path)
+
+    ## Without a store the bounds are requested and the store is built in the background
+    assert get_catalog('gpm', '3IMERGHHE', 6, cache_dir, min_max=True) is bounds
+    catalog._builds[catalog_path(cache_dir, 'gpm', '3IMERGHHE', 6)].join()
+    assert len(read_catalog(catalog_path(cache_dir, 'gpm', '3IMERGHHE', 6))['granules']) == 5
+
+    ## Then the store is used
+    server.requests = []
+    min_max = get_catalog('gpm', '3IMERGHHE', 6, cache_dir, from_date='2019-12-31', min_max=True)
+    assert server.requests == []
+    assert list(min_max['from_date']) == list(pd.to_datetime(['2020-01-01 00:00', '2020-01-01 01:00'], utc=True))
+
+    with pytest.raises(ValueError):
+        get_catalog('gpm', '3IMERGHHE', 6, cache_dir, '2019-12-31', '2019-12-31', min_max=True)
+
+
+def test_update_catalog(tmp_path, monkeypatch):
+    days = {pd.Timestamp('2019-12-30'): (2, '2020-01-01T00:00:00'), pd.Timestamp('2019-12-31'): (2, '2020-01-01T00:00:00'), pd.Timestamp('2020-01-01'): (2, '2020-01-02T00:00:00')}
+    server = fake_server(monkeypatch, days)
+    cache_dir = str(tmp_path)
+
+    date_df = update_catalog('gpm', '3IMERGHHE', 6, cache_dir)
+    assert len(date_df) == 6
+    assert len(server.requests) == 6
+
+    ## A refresh within max_age doesn't contact the server
+    server.requests = []
+    assert update_catalog('gpm', '3IMERGHHE', 6, cache_dir).equals(date_df)
+    assert server.requests == []
+
+    ## A changed day, a new day, and fewer granules in the last day
+    days[pd.Timestamp('2019-12-30')] = (3, '2020-01-03T00:00:00')
+    days[pd.Timestamp('2020-01-01')] = (1, '2020-01-02T00:00:00')
+    days[pd.Timestamp('2020-01-02')] = (2, '2020-01-03T00:00:00')
+    date_df = update_catalog('gpm', '3IMERGHHE', 6, cache_dir, 0)
+
+    crawled = sorted('/'.join(server.paths(u)) for u in server.requests if u != years_url)
+    assert crawled == ['2019', '2019/364', '2020', '2020/001', '2020/002']
+    counts = date_df.groupby(date_df['from_date'].dt.floor('D')).size()
+    assert list(counts) == [3, 2, 1, 2]
+    assert not date_df['file_name'].duplicated().any()
+    assert date_df['from_date'].is_monotonic_increasing
+    assert read_catalog(catalog_path(cache_dir, 'gpm', '3IMERGHHE', 6))['days'][pd.Timestamp('2019-12-30')] == '2020-01-03T00:00:00'
+
+
+def test_resume_catalog(tmp_path, monkeypatch):
+    days = {pd.Timestamp('2018-12-30'): (2, '2019-01-01T00:00:00'), pd.Timestamp('2018-12-31'): (2, '2019-01-01T00:00:00'), pd.Timestamp('2019-01-01'): (2, '2019-01-02T00:00:00'), pd.Timestamp('2019-01-02'): (2, '2019-01-03T00:00:00')}
+    server = fake_server(monkeypatch, days)
+    cache_dir = str(tmp_path)
+    path = catalog_path(cache_dir, 'gpm', '3IMERGHHE', 6)
+
+    ## A build that stops in its second year keeps the first year in the partial store
+    def fail_2019(urls):
+        if any(server.paths(u)[:1] == ['2019'] and len(server.paths(u)) == 2 for u in urls):
+            raise IOError('The server went away')
+        return server.fetch_catalogs(urls)
+
+    monkeypatch.setattr(catalog, 'fetch_catalogs', fail_2019)
+    with pytest.raises(IOError):
+        update_catalog('gpm', '3IMERGHHE', 6, cache_dir)
+    assert read_catalog(path) is None
+    assert len(read_catalog(partial_path(path))['granules']) == 4
+
+    ## The next build only crawls the days of the second year and the last day of the first
+    monkeypatch.setattr(catalog, 'fetch_catalogs', server.fetch_catalogs)
+    server.requests = []
+    date_df = update_catalog('gpm', '3IMERGHHE', 6, cache_dir)
+    crawled = sorted('/'.join(server.paths(u)) for u in server.requests if len(server.paths(u)) == 2)
+    assert crawled == ['2018/365', '2019/001', '2019/002']
+    assert len(date_df) == 8
+    assert date_df['from_date'].is_monotonic_increasing
+    assert not os.path.isfile(partial_path(path))
+
+    ## Without background builds, the min_max path only requests the bounds
+    cache_dir2 = str(tmp_path / 'other')
+    bounds = pd.DataFrame({'from_date': [pd.Timestamp('2018-12-30', tz='utc')]})
+    monkeypatch.setattr(catalog, 'get_catalog_bounds', lambda *args: bounds)
+    monkeypatch.setattr(catalog, 'background_builds', False)
+    assert get_catalog('gpm', '3IMERGHHE', 6, cache_dir2, min_max=True) is bounds
+    assert catalog_path(cache_dir2, 'gpm', '3IMERGHHE', 6) not in catalog._builds
+
+
+def test_bound_days(monkeypatch):
+    days = {pd.Timestamp('2018-06-01'): (1, '2020-01-01T00:00:00'), pd.Timestamp('2019-12-30'): (1, '2020-01-01T00:00:00'), pd.Timestamp('2020-01-01'): (1, '2020-01-02T00:00:00')}
+    server = FakeServer(days)
+    batches = []
+    monkeypatch.setattr(util, 'fetch_catalogs', lambda urls: batches.append(['/'.join(server.paths(u)) for u in urls]) or server.fetch_catalogs(urls))
+
+    ## The outer years are requested together
+    first, last = util.bound_days(years_url, base_url, [2018, 2019, 2020])
+    assert (first[0], last[0]) == (pd.Timestamp('2018-06-01'), pd.Timestamp('2020-01-01'))
+    assert batches == [['2018', '2020']]
+
+    ## The inner years are requested while the outer years have no days in the period
+    batches.clear()
+    first, last = util.bound_days(years_url, base_url, [2018, 2019, 2020], '2018-07-01', '2019-12-31')
+    assert first[0] == last[0] == pd.Timestamp('2019-12-30')
+    assert batches == [['2018', '2019']]
+
+    with pytest.raises(ValueError):
+        util.bound_days(years_url, base_url, [2018, 2019, 2020], '2018-07-01', '2019-06-30')
+
+
+def test_template_urls(tmp_path, monkeypatch):
+    modified = '2019-04-01T00:00:00'
+    days = {pd.Timestamp('2019-03-27'): (48, modified), pd.Timestamp('2019-03-28'): (48, modified), pd.Timestamp('2019-03-29'): (47, modified), pd.Timestamp('2019-03-30'): (48, modified)}
+    fake_server(monkeypatch, days)
+    cache_dir = str(tmp_path)
+    date_df = update_catalog('gpm', '3IMERGHHE', 6, cache_dir)
+    file_path = mission_product_dict['gpm']['products']['3IMERGHHE']
+
+    ## The generated urls are the catalog granules (the catalog ids have /opendap/hyrax rather than /opendap, but they have the same cache paths)
+    url_dates = template_urls(file_path, 'gpm', '3IMERGHHE', 6, 'GPM_L3', base_url, pd.Timestamp('2019-03-27'), pd.Timestamp('2019-03-30 23:30'))
+    gen_paths = set(cache_path(u, cache_dir) for u in url_dates)
+    cat_paths = set(cache_path(base_url + u, cache_dir) for u in date_df['file_url'])
+    assert len(url_dates) == 4 * 48
+    assert cat_paths < gen_paths
+    missing = gen_paths - cat_paths
+    assert len(missing) == 1 and missing.pop().endswith('3B-HHR-E.MS.MRG.3IMERG.20190329-S233000-E235959.1410.V06B.nc4')
+    assert set(url_dates.values()) == set(days)
+
+    ## A reprocessed granule and a missing granule make their days irregular, which then use the catalog urls. The last day of the catalog isn't compared.
+    date_df = date_df.copy()
+    i = date_df.index[(date_df['from_date'] == pd.Timestamp('2019-03-28 12:00', tz='utc'))][0]
+    date_df.loc[i, 'file_name'] = date_df.loc[i, 'file_name'].replace('V06B', 'V06C')
+    date_df.loc[i, 'file_url'] = date_df.loc[i, 'file_url'].replace('V06B', 'V06C')
+    irr_dict = irregular_days(url_dates, date_df, base_url)
+
+    assert sorted(irr_dict) == [pd.Timestamp('2019-03-28'), pd.Timestamp('2019-03-29')]
+    assert len(irr_dict[pd.Timestamp('2019-03-28')]) == 48
+    assert base_url + date_df.loc[i, 'file_url'] in irr_dict[pd.Timestamp('2019-03-28')]
+    assert sorted(irr_dict[pd.Timestamp('2019-03-29')]) == sorted(base_url + u for u, d in zip(date_df['file_url'], date_df['from_date']) if d.floor('D') == pd.Timestamp('2019-03-29', tz='utc'))
+    assert irregular_days({u: d for u, d in url_dates.items() if d < pd.Timestamp('2019-03-28')}, date_df, base_url) == {}
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the session pool against a local keep-alive http server.
+"""
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from multiprocessing.pool import ThreadPool
+import pytest
+import requests
+from nasadap.connections import SessionPool
+
+###############################
+### Parameters
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = b'ok'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('localhost', 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://localhost:{port}/'.format(port=httpd.server_address[1])
+    httpd.shutdown()
+    httpd.server_close()
+
+###############################
+### Tests
+
+
+def test_session_pool(server):
+    session = requests.Session()
+    session.cookies.set('urs_session', 'abc')
+    pool = SessionPool(session, 4)
+
+    def get(i):
+        s = pool.get()
+        try:
+            assert s.cookies.get('urs_session') == 'abc'
+            return s.get(server).status_code
+        finally:
+            pool.put(s)
+
+    with ThreadPool(4) as tp:
+        statuses = tp.map(get, range(40))
+
+    stats = pool.stats()
+    pool.close()
+
+    assert statuses == [200] * 40
+    assert stats['sessions'] <= 4
+    assert stats['session_hits'] + stats['session_misses'] == 40
+    assert stats['requests'] == 40
+    assert stats['connection_misses'] == stats['sessions']
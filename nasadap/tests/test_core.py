@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the Nasa class with a fake NASA server. The catalog and the opendap reads of the granules are replaced, so no login is needed.
+"""
+import os
+import types
+import numpy as np
+import pandas as pd
+import requests
+import pytest
+from nasadap import core
+from nasadap.core import Nasa, template_urls
+from nasadap.util import mission_product_dict
+from nasadap.grid import save_grid, read_grid
+from nasadap.connections import SessionPool
+from nasadap.encoding import get_profile
+
+###############################
+### Parameters
+
+lon = np.arange(165.05, 175, 0.1).astype('f4')
+lat = np.arange(-49.95, -40, 0.1).astype('f4')
+grid = {'dims': ('time', 'lon', 'lat'), 'lon': lon, 'lat': lat, 'lon_attrs': {'units': 'degrees_east'}, 'lat_attrs': {'units': 'degrees_north'}}
+bbox = dict(min_lat=-48, max_lat=-46, min_lon=168, max_lon=171)
+
+
+def fake_catalog(mission, product, version, cache_dir, min_max=False):
+    return pd.DataFrame({'from_date': [pd.Timestamp('2019-03-01', tz='utc')], 'to_date': [pd.Timestamp('2019-04-01', tz='utc')]})
+
+
+def fake_granule(url, session, dataset_list, grid_dict):
+    """
+    The value of a granule is its number of minutes since the start of the day.
+    """
+    name = url.rsplit('/', 1)[1].split('.')
+    stop = pd.Timestamp(name[4][:8] + name[4].split('-E')[1])
+    attrs = {'FileHeader': 'StopGranuleDateTime={stop}Z;\n'.format(stop=stop.isoformat() + '.999')}
+    shape = (1, len(grid_dict['lon']), len(grid_dict['lat']))
+    data = {ar: np.full(shape, float(name[5]), 'f4') for ar in dataset_list}
+    var_attrs = {ar: {'units': 'mm/hr', '_FillValue': np.float32(-9999.9)} for ar in dataset_list}
+    return attrs, data, var_attrs
+
+
+def not_found():
+    err = IOError('404 Not Found')
+    err.code = 404
+    return err
+
+
+def reprocessed_granule(url, session, dataset_list, grid_dict):
+    """
+    The generated (V06B) urls don't exist, as the granules have been reprocessed (V06C).
+    """
+    if url.endswith('V06B.HDF5'):
+        raise not_found()
+    return fake_granule(url, session, dataset_list, grid_dict)
+
+
+def reprocessed_grid(url, session, dataset_name):
+    if url.endswith('V06B.HDF5'):
+        raise not_found()
+    return grid
+
+
+def reprocessed_crawl(urls):
+    """
+    The day catalogs list the reprocessed granules.
+    """
+    base_url = mission_product_dict['gpm']['base_url']
+    results = []
+    for url in urls:
+        year, day = url.split('/')[-3:-1]
+        date = pd.Timestamp(year) + pd.Timedelta(days=int(day) - 1)
+        urls1 = template_urls(mission_product_dict['gpm']['products']['3IMERGHH'], 'gpm', '3IMERGHH', 6, 'GPM_L3', base_url, date, date + pd.Timedelta('23.5h'))
+        urls2 = [u.replace('V06B', 'V06C') for u in urls1]
+        refs = ''.join('<thredds:dataset name="{name}" ID="{ID}"><thredds:dataSize units="bytes">1000</thredds:dataSize></thredds:dataset>'.format(name=u.rsplit('/', 1)[1], ID=u[len(base_url):]) for u in urls2)
+        content = '<thredds:catalog xmlns:thredds="http://www.unidata.ucar.edu/namespaces/thredds/InvCatalog/v1.0"><thredds:dataset name="day" ID="day">{refs}</thredds:dataset></thredds:catalog>'.format(refs=refs)
+        results.append(types.SimpleNamespace(url=url, status=200, content=content.encode(), attempts=1))
+    return results
+
+
+def fake_nasa(cache_dir, grid=grid):
+    ge = object.__new__(Nasa)
+    ge.mission_dict = mission_product_dict['gpm']
+    ge.mission = 'gpm'
+    ge.cache_dir = cache_dir
+    ge.cache_format = 'netcdf'
+    ge.cache_size = None
+    ge.cache_age = None
+    ge.cache_encoding = get_profile('none')
+    ge.session = requests.Session()
+    ge.session_pool = SessionPool(ge.session, 4)
+    if grid is not None:
+        save_grid(grid, '{cache_dir}/GPM_L3/GPM_3IMERGHH.06'.format(cache_dir=cache_dir))
+    return ge
+
+###############################
+### Tests
+
+
+def test_iter_data(tmp_path, monkeypatch):
+    monkeypatch.setattr(core, 'get_catalog', fake_catalog)
+    monkeypatch.setattr(core, 'dap_granule', fake_granule)
+    ge = fake_nasa(str(tmp_path))
+
+    ## The first day is downloaded, then it's read from the cache while the second day is downloaded
+    days1 = list(ge.iter_data('3IMERGHH', 6, 'precipitationCal', '2019-03-28', '2019-03-28', dl_sim_count=4, **bbox))
+    days2 = list(ge.iter_data('3IMERGHH', 6, 'precipitationCal', '2019-03-28', '2019-03-29', dl_sim_count=4, buffer_size=16, **bbox))
+    ge.close()
+
+    assert len(days1) == 1
+    assert len(days2) == 2
+    assert ge.cache_stats['hits'] == 48
+    assert ge.cache_stats['misses'] == 48
+    for ds in days1 + days2:
+        times = ds.time.to_index()
+        assert len(times) == 48
+        assert (times.floor('D') == times[0].floor('D')).all()
+        minutes = (times.floor('30min') - times[0].floor('D')) / pd.Timedelta('1min')
+        values = ds['precipitationCal'].values
+        assert values.shape == (48, 30, 20)
+        assert (values == minutes.values[:, None, None]).all()
+    assert days1[0].equals(days2[0])
+
+
+def test_get_data_preallocate(tmp_path, monkeypatch):
+    monkeypatch.setattr(core, 'get_catalog', fake_catalog)
+    monkeypatch.setattr(core, 'dap_granule', fake_granule)
+    ge = fake_nasa(str(tmp_path))
+
+    ## The cached granules of the first day are read into the cube while the second day is downloaded into it
+    ds1 = ge.get_data('3IMERGHH', 6, 'precipitationCal', '2019-03-28', '2019-03-28', dl_sim_count=4, **bbox)
+    ds2 = ge.get_data('3IMERGHH', 6, 'precipitationCal', '2019-03-28', '2019-03-29', dl_sim_count=4, preallocate=True, **bbox)
+    ge.close()
+
+    assert ge.cache_stats['hits'] == 48
+    assert len(ds2.time) == 96
+    assert ds2['precipitationCal'].attrs == {'units': 'mm/hr'}
+    assert ds1['precipitationCal'].equals(ds2['precipitationCal'].isel(time=slice(0, 48)))
+    minutes = (ds2.time.to_index().floor('30min') - pd.Timestamp('2019-03-28')) / pd.Timedelta('1min') % 1440
+    assert (ds2['precipitationCal'].values == minutes.values[:, None, None]).all()
+
+
+def test_product_grid_not_found(tmp_path, monkeypatch):
+    monkeypatch.setattr(core, 'get_catalog', fake_catalog)
+    monkeypatch.setattr(core, 'dap_granule', reprocessed_granule)
+    monkeypatch.setattr(core, 'resolve_grid', reprocessed_grid)
+    product_path = os.path.join(str(tmp_path), 'GPM_L3', 'GPM_3IMERGHH.06')
+
+    ## If none of the granules exist, then the grid isn't saved and the error names the product
+    monkeypatch.setattr(core, 'crawl', lambda urls: [])
+    ge = fake_nasa(str(tmp_path), None)
+    with pytest.raises(ValueError, match='3IMERGHH'):
+        ge.get_data('3IMERGHH', 6, 'precipitationCal', '2019-03-28', '2019-03-28', dl_sim_count=4, **bbox)
+    ge.close()
+    assert read_grid(product_path) is None
+
+    ## If all of the generated urls on an empty cache don't exist, then the grid is resolved from the catalog urls
+    monkeypatch.setattr(core, 'crawl', reprocessed_crawl)
+    ge = fake_nasa(str(tmp_path), None)
+    ds = ge.get_data('3IMERGHH', 6, 'precipitationCal', '2019-03-28', '2019-03-28', dl_sim_count=4, **bbox)
+    ge.close()
+    assert np.array_equal(read_grid(product_path)['lon'], grid['lon'])
+    assert ds['precipitationCal'].shape == (48, 30, 20)
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the catalog crawler with a local http server.
+"""
+import time
+import asyncio
+import threading
+import pytest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from nasadap import crawler
+from nasadap.crawler import crawl, fetch_catalogs
+
+###############################
+### Parameters
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    /fail/{n}/{key} fails with a 503 the first n times, /missing is a 404, and the rest are 200.
+    """
+    counts = {}
+
+    def do_GET(self):
+        self.counts[self.path] = self.counts.get(self.path, 0) + 1
+        parts = self.path.split('/')
+        if parts[1] == 'missing':
+            status = 404
+        elif (parts[1] == 'fail') and (self.counts[self.path] <= int(parts[2])):
+            status = 503
+        else:
+            status = 200
+        content = self.path.encode()
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope='module')
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:{port}'.format(port=httpd.server_address[1])
+    httpd.shutdown()
+    crawler.close_sessions()
+
+###############################
+### Tests
+
+
+def test_retries(server, monkeypatch):
+    monkeypatch.setattr(crawler.random, 'uniform', lambda a, b: 1)
+
+    ## Two failures are retried after 0.1 and 0.2 seconds
+    start = time.monotonic()
+    ok, missing, failed = crawl([server + '/fail/2/a', server + '/missing', server + '/fail/9/b'], retries=3, backoff=0.1)
+    assert time.monotonic() - start >= 0.3
+
+    assert (ok.status, ok.content, ok.attempts) == (200, b'/fail/2/a', 3)
+    assert (missing.status, missing.content, missing.attempts) == (404, None, 1)
+    assert (failed.status, failed.attempts) == (503, 3)
+    assert Handler.counts['/missing'] == 1
+    assert Handler.counts['/fail/9/b'] == 3
+
+    with pytest.raises(IOError):
+        fetch_catalogs([server + '/a', server + '/missing'])
+
+
+def test_sessions(server):
+    assert fetch_catalogs([server + '/a', server + '/b']) == [b'/a/catalog.xml', b'/b/catalog.xml']
+    session = crawler._sessions[server[7:]]
+    fetch_catalogs([server + '/c'])
+    assert crawler._sessions[server[7:]] is session
+
+    ## Crawls also work from a thread with a running event loop (e.g. Jupyter)
+    async def nested():
+        return crawl([server + '/d'])
+
+    assert asyncio.run(nested())[0].content == b'/d'
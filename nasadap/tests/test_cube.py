@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the preallocated output cube.
+"""
+import numpy as np
+import pandas as pd
+import xarray as xr
+from nasadap.cube import Cube
+
+###############################
+### Parameters
+
+lon = np.arange(165.5, 170, dtype='f4')
+lat = np.arange(-48.5, -45, dtype='f4')
+
+
+def granule(time, value, lon=lon, lat=lat):
+    data = np.full((1, len(lon), len(lat)), value, 'f4')
+    return xr.Dataset({'precipitationCal': (('time', 'lon', 'lat'), data, {'units': 'mm/hr'})}, coords={'time': pd.to_datetime([time]), 'lon': lon, 'lat': lat}, attrs={'FileHeader': time})
+
+###############################
+### Tests
+
+
+def test_cube():
+    cube = Cube(3, lon, lat, {'units': 'degrees_east'}, {'units': 'degrees_north'})
+    cube.write(2, granule('2019-03-28 01:29:59', 2))
+    cube.write(0, granule('2019-03-28 00:29:59', 0, lat=lat[1:]))
+    ds = cube.to_dataset()
+
+    assert list(ds.time.to_index()) == list(pd.to_datetime(['2019-03-28 00:29:59', '2019-03-28 01:29:59']))
+    assert ds.attrs['FileHeader'] == '2019-03-28 00:29:59'
+    assert ds['precipitationCal'].attrs['units'] == 'mm/hr'
+    assert ds['lon'].attrs['units'] == 'degrees_east'
+    assert np.isnan(ds['precipitationCal'][0, :, 0]).all()
+    assert (ds['precipitationCal'][0, :, 1:] == 0).all()
+    assert (ds['precipitationCal'][1] == 2).all()
+
+
+def test_write_arrays():
+    cube = Cube(2, lon, lat, {}, {})
+    raw = np.full((len(lon), len(lat) - 1), 20, 'i2')
+    raw[0, 0] = -9999
+    var_attrs = {'precipitationCal': {'units': 'mm/hr', 'scale_factor': np.float32(0.1), '_FillValue': np.int16(-9999)}}
+    cube.write_arrays(1, np.datetime64('2019-03-28T00:59:59'), lon, lat[1:], {'precipitationCal': raw}, {'FileHeader': 'b'}, var_attrs)
+    cube.write_arrays(0, np.datetime64('2019-03-28T00:29:59'), lon, lat, {'precipitationCal': np.ones((len(lon), len(lat)), 'i2')}, {'FileHeader': 'a'}, var_attrs)
+    ds = cube.to_dataset()
+
+    assert ds['precipitationCal'].dtype == 'f4'
+    assert ds['precipitationCal'].attrs == {'units': 'mm/hr'}
+    assert ds.attrs['FileHeader'] == 'a'
+    assert np.allclose(ds['precipitationCal'][0], 0.1)
+    assert np.isnan(ds['precipitationCal'][1, :, 0]).all()
+    assert np.isnan(ds['precipitationCal'][1, 0, 1])
+    assert np.allclose(ds['precipitationCal'][1, 1:, 1:], 2)
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the encoding profiles.
+"""
+import numpy as np
+import pandas as pd
+import xarray as xr
+import pytest
+from nasadap.encoding import get_profile, bit_round, quantize, netcdf_encoding
+
+###############################
+### Tests
+
+
+def test_bit_round():
+    fill_value = np.float32(-9999.9)
+    values = np.array([1.0, 1.00390625, 1.01171875, 3.14159, -2.71828, 0, np.nan, fill_value, 250.3], '>f4')
+    rounded = bit_round(values, 7, fill_value)
+
+    assert rounded[0] == 1
+    assert rounded[1] == 1
+    assert rounded[2] == 1.015625
+    assert (np.abs(rounded[:6] - values[:6]) <= np.abs(values[:6]) * 2**-8).all()
+    assert np.isnan(rounded[6]) and (rounded[7] == fill_value)
+    assert np.array_equal(bit_round(rounded, 7, fill_value), rounded, equal_nan=True)
+
+
+def test_profiles(tmp_path):
+    with pytest.raises(ValueError):
+        get_profile('small')
+    profile = get_profile({'compression': 'zlib', 'keepbits': {'precipitationCal': 5}})
+
+    data = np.random.default_rng(0).gamma(0.5, 2, (1, 100, 100)).astype('f4')
+    ds = xr.Dataset({'precipitationCal': (('time', 'lon', 'lat'), data), 'IRkalmanFilterWeight': (('time', 'lon', 'lat'), (data * 10).astype('i2'))}, coords={'time': pd.to_datetime(['2019-03-28 00:29:59.999']), 'lon': np.arange(100), 'lat': np.arange(100)})
+    ds1 = quantize(ds, profile)
+    assert (ds1['IRkalmanFilterWeight'] == ds['IRkalmanFilterWeight']).all()
+    assert float(np.abs(ds1['precipitationCal'] / ds['precipitationCal'] - 1).max()) <= 2**-6
+
+    encoding = netcdf_encoding(ds1, profile)
+    assert encoding['precipitationCal'] == {'zlib': True, 'complevel': 4, 'shuffle': True}
+    assert encoding['IRkalmanFilterWeight'] == encoding['precipitationCal']
+    assert netcdf_encoding(ds1.isel(lon=slice(0, 10)), profile)['precipitationCal'] == {}
+
+    path = str(tmp_path / 'granule.nc4')
+    ds1.to_netcdf(path, encoding=encoding)
+    with xr.open_dataset(path) as ds2:
+        assert ds2['precipitationCal'].encoding['zlib']
+        assert ds2.equals(ds1)
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the cache eviction.
+"""
+import os
+import pandas as pd
+from nasadap.index import open_index, update_index, index_variables, touch_index, add_stats
+from nasadap.eviction import select_evictions, evict_files
+
+###############################
+### Parameters
+
+master_dataset_list = ['precipitationCal']
+names = ['3B-HHR-E.MS.MRG.3IMERG.20190328-S000000-E002959.0000.V06B.nc4', '3B-HHR-E.MS.MRG.3IMERG.20190328-S003000-E005959.0030.V06B.nc4', '3B-HHR-E.MS.MRG.3IMERG.20190328-S010000-E012959.0060.V06B.nc4']
+
+###############################
+### Tests
+
+
+def test_select_evictions():
+    now = pd.Timestamp.now()
+    units = [('a', 10, str(now - pd.Timedelta('1D'))), ('b', 10, str(now - pd.Timedelta('3D'))), ('c', 10, str(now)), ('d', 10, None)]
+
+    assert select_evictions(units) == []
+    assert select_evictions(units, 25) == ['d', 'b']
+    assert select_evictions(units, max_age='2D') == ['b']
+    assert select_evictions(units, 35, '2D') == ['d', 'b']
+    assert select_evictions(units, 15, grace='2D') == ['d', 'b']
+    assert select_evictions(units, max_age='2D', grace='5D') == []
+
+
+def test_evict_files(tmp_path):
+    product_path = str(tmp_path)
+    paths = [os.path.join(product_path, n) for n in names]
+    conn = open_index(product_path, master_dataset_list)
+    for p in paths:
+        with open(p, 'wb') as f:
+            f.write(b'0' * 10)
+    update_index(conn, [{'path': p, 'variables': master_dataset_list, 'size': 10} for p in paths])
+    touch_index(conn, [paths[1]])
+    conn.execute('UPDATE granules SET access_date = ? WHERE path = ?', (pd.Timestamp('2019-01-01').isoformat(), paths[2]))
+
+    ## A file accessed within the grace period could be read by another process, so it's kept even over the budget
+    res = evict_files(conn, 15, keep={paths[0]})
+    assert res == {'evictions': 1, 'evicted_bytes': 10, 'size': 20}
+    assert [os.path.isfile(p) for p in paths] == [True, True, False]
+
+    res = evict_files(conn, 15, keep={paths[0]}, grace=None)
+    assert res == {'evictions': 1, 'evicted_bytes': 10, 'size': 10}
+    assert [os.path.isfile(p) for p in paths] == [True, False, False]
+    assert list(index_variables(conn, paths)) == [paths[0]]
+
+    add_stats(conn, {'hits': 1, 'evictions': 2})
+    assert add_stats(conn, {'hits': 2}) == {'hits': 3, 'evictions': 2}
+    conn.close()
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the grid tiles.
+"""
+import numpy as np
+import xarray as xr
+from nasadap.grid import grid_slice, bbox_tiles, tiles_extent
+
+###############################
+### Parameters
+
+grid = {'dims': ['time', 'lon', 'lat'], 'lon': (np.arange(3600) * 0.1 - 179.95).astype('f4'), 'lat': (np.arange(1800) * 0.1 - 89.95).astype('f4'), 'lon_attrs': {}, 'lat_attrs': {}}
+
+###############################
+### Tests
+
+
+def test_tiles():
+    tiles = bbox_tiles(grid, -49, -41, 165, 172)
+    assert tiles == {'69_8', '69_9', '70_8', '70_9'}
+
+    extent = tiles_extent(grid, tiles)
+    grid_dict = grid_slice(grid, *extent)
+    assert grid_dict['lon_slice'] == slice(3450, 3550)
+    assert grid_dict['lat_slice'] == slice(400, 500)
+    assert bbox_tiles(grid, *extent) == tiles
+
+    assert bbox_tiles(grid, 91, 95, 0, 1) == set()
+
+
+def test_bbox_edges():
+    da = xr.DataArray(np.zeros((len(grid['lon']), len(grid['lat'])), 'f4'), coords={'lon': grid['lon'], 'lat': grid['lat']}, dims=('lon', 'lat'))
+
+    ## Bounds on cell centres, on cell edges, at the antimeridian, and at the poles have the same cells as xarray's sel
+    bboxes = [(-49.95, -40.05, 165.05, 169.95), (-50, -40, 165, 170), (-45, -45, 170, 170), (-45.05, -45.05, 170.05, 170.05), (-10, 10, 179.9, 180), (-10, 10, -180, -179.9), (89.9, 90, -180, 180), (-90, -89.9, 0, 0.2)]
+    for min_lat, max_lat, min_lon, max_lon in bboxes:
+        grid_dict = grid_slice(grid, min_lat, max_lat, min_lon, max_lon)
+        da1 = da.sel(lat=slice(min_lat, max_lat), lon=slice(min_lon, max_lon))
+        assert np.array_equal(grid_dict['lon'], da1.lon.values)
+        assert np.array_equal(grid_dict['lat'], da1.lat.values)
+
+    assert grid_slice(grid, -50, -40, 165, 170)['lat_slice'] == slice(400, 500)
+    assert grid_slice(grid, -49.95, -40.05, 165.05, 169.95)['lon_slice'] == slice(3450, 3500)
+    assert grid_slice(grid, -45, -45, 170, 170)['lon_slice'] == slice(3500, 3500)
+
+    ## The cells at the antimeridian and the poles are in the first and last tiles
+    assert bbox_tiles(grid, -90, -89.9, -180, -179.9) == {'0_0'}
+    assert bbox_tiles(grid, 89.95, 90, 179.95, 180) == {'71_35'}
+    assert bbox_tiles(grid, -90, 90, 179, 180) == set('71_{j}'.format(j=j) for j in range(36))
+    assert bbox_tiles(grid, 85, 95, -185, -175) == {'0_35'}
+    extent = tiles_extent(grid, {'71_35'})
+    assert extent == (float(grid['lat'][1750]), float(grid['lat'][-1]), float(grid['lon'][3550]), float(grid['lon'][-1]))
+    assert bbox_tiles(grid, *extent) == {'71_35'}
+
+    ## A bounding box across the antimeridian (min_lon > max_lon) is empty like xarray's sel
+    assert bbox_tiles(grid, -10, 10, 179, -179) == set()
+
+    ## A bounding box on a tile edge only has the tiles on one side (165.0 is between the cells of tiles 68 and 69)
+    assert bbox_tiles(grid, -45.05, -45.05, 160, 165) == {'68_8'}
+    assert bbox_tiles(grid, -45.05, -45.05, 165, 170) == {'69_8'}
+    assert bbox_tiles(grid, -45.05, -45.05, 164.95, 165.05) == {'68_8', '69_8'}
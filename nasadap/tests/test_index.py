@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the sqlite granule index.
+"""
+import os
+import pickle
+import pandas as pd
+from nasadap.index import open_index, index_variables, index_sources, index_tiles, update_index, query_index, old_index_name
+from nasadap.core import changed_granules
+
+###############################
+### Parameters
+
+master_dataset_list = ['precipitationCal', 'randomError']
+names = ['3B-HHR-E.MS.MRG.3IMERG.20190328-S000000-E002959.0000.V06B.nc4', '3B-HHR-E.MS.MRG.3IMERG.20190328-S003000-E005959.0030.V06B.nc4']
+
+###############################
+### Tests
+
+
+def test_update_index(tmp_path):
+    product_path = str(tmp_path)
+    paths = [os.path.join(product_path, n) for n in names]
+    conn = open_index(product_path, master_dataset_list)
+
+    update_index(conn, [{'path': paths[0], 'variables': ['precipitationCal'], 'size': 10, 'min_lat': -49.0}, {'path': paths[1], 'variables': [], 'status': 'not_found'}])
+    update_index(conn, [{'path': paths[0], 'variables': ['randomError'], 'size': 20, 'min_lat': -50.0, 'tiles': {'69_8'}}])
+
+    assert index_variables(conn, paths) == {paths[0]: set(master_dataset_list)}
+
+    df = query_index(conn, '2019-03-28', '2019-03-28 00:00')
+    assert list(df['path']) == [paths[0]]
+    assert df['size'].iloc[0] == 20
+    assert df['min_lat'].iloc[0] == -50.0
+    assert index_tiles(conn, paths) == {paths[0]: {'randomError': {'69_8'}}}
+    assert df['to_date'].iloc[0] == pd.Timestamp('2019-03-28 00:29:59')
+    assert len(query_index(conn, status=None)) == 2
+    conn.close()
+
+
+def test_pickle_migration(tmp_path):
+    product_path = str(tmp_path)
+    paths = [os.path.join(product_path, n) for n in names]
+    with open(paths[0], 'wb') as f:
+        f.write(b'0')
+    with open(os.path.join(product_path, old_index_name), 'wb') as handle:
+        pickle.dump(set(paths), handle)
+
+    conn = open_index(product_path, master_dataset_list)
+    assert index_variables(conn, paths) == {paths[0]: set(master_dataset_list)}
+    conn.close()
+
+
+def test_changed_granules(tmp_path):
+    product_path = str(tmp_path)
+    paths = [os.path.join(product_path, n) for n in names]
+    conn = open_index(product_path, master_dataset_list)
+    update_index(conn, [{'path': paths[0], 'variables': ['precipitationCal'], 'modified_date': '2019-03-28 04:14:36+00:00', 'source_size': 8062743}, {'path': paths[1], 'variables': ['precipitationCal']}])
+    cached = index_sources(conn, paths)
+    assert cached == {paths[0]: ('2019-03-28 04:14:36+00:00', 8062743), paths[1]: (None, None)}
+    conn.close()
+
+    sources = {paths[0]: ('2019-03-28T04:14:36+00:00', 8062743), paths[1]: ('2019-03-28 04:14:36+00:00', 8062743)}
+    assert changed_granules(cached, sources) == ([], [paths[1]])
+    sources[paths[0]] = ('2019-03-28 04:14:36+00:00', 8062744)
+    assert changed_granules(cached, sources) == ([paths[0]], [paths[1]])
+    sources[paths[0]] = ('2019-04-28 04:14:36+00:00', 8062743)
+    assert changed_granules(cached, sources) == ([paths[0]], [paths[1]])
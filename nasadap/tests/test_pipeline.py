@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the pipelined execution.
+"""
+from time import perf_counter, sleep
+import pytest
+from nasadap.pipeline import run_pipeline
+
+###############################
+### Tests
+
+
+def slow(func, wait):
+    def stage(x):
+        sleep(wait)
+        return func(x)
+    return stage
+
+
+def test_run_pipeline():
+    t1 = perf_counter()
+    output = list(run_pipeline(range(6), [slow(lambda x: x + 1, 0.1), slow(lambda x: x * 2, 0.1), slow(str, 0.1)]))
+    elapsed = perf_counter() - t1
+
+    assert output == ['2', '4', '6', '8', '10', '12']
+    assert elapsed < 1.4
+
+
+def test_run_pipeline_error():
+    def fail(x):
+        if x == 3:
+            raise ValueError('bad item')
+        return x
+
+    output = []
+    with pytest.raises(ValueError, match='bad item'):
+        for x in run_pipeline(range(100), [fail, str]):
+            output.append(x)
+    assert output == ['0', '1', '2']
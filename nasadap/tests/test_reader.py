@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the batched reader of the cached netcdf granules.
+"""
+import os
+import numpy as np
+import pandas as pd
+import xarray as xr
+from nasadap.reader import read_granules, decode_times
+
+###############################
+### Parameters
+
+lon = np.arange(160.05, 162, 0.1, dtype='f4')
+lat = np.arange(-49.95, -48, 0.1, dtype='f4')
+
+
+def granule(path, time, value, lon_slice=slice(None), lat_slice=slice(None)):
+    data = np.full((1, len(lon), len(lat)), value, 'f4')[:, lon_slice, lat_slice]
+    data[0, 0, 0] = -9999.9
+    ds = xr.Dataset({'precipitationCal': (('time', 'lon', 'lat'), data, {'units': 'mm/hr', '_FillValue': np.float32(-9999.9)})}, coords={'time': pd.to_datetime([time]), 'lon': lon[lon_slice], 'lat': lat[lat_slice]}, attrs={'FileHeader': time})
+    ds.to_netcdf(path)
+    return path
+
+###############################
+### Tests
+
+
+def test_read_granules(tmp_path):
+    paths = [granule(os.path.join(str(tmp_path), '{}.nc4'.format(i)), t, i) for i, t in enumerate(['2019-03-28 00:29:59.999', '2019-03-28 00:59:59.999'])]
+    paths.append(granule(os.path.join(str(tmp_path), '2.nc4'), '2019-03-28 01:29:59.999', 2, slice(5, 10), slice(0, 8)))
+
+    ds = read_granules(paths, ['precipitationCal'], -49.5, -49, 160.3, 161)
+    ds0 = xr.open_mfdataset(paths[:2], concat_dim='time', combine='nested').sel(lat=slice(-49.5, -49), lon=slice(160.3, 161)).load()
+
+    assert ds.isel(time=slice(0, 2)).identical(ds0)
+    assert np.isnan(ds['precipitationCal'].values[2, 0, 0])
+    assert (ds['precipitationCal'].values[2, 2:, :3] == 2).all()
+    assert np.isnan(ds['precipitationCal'].values[2, :2]).all()
+    assert np.isnan(ds['precipitationCal'].values[2, :, 3:]).all()
+
+
+def test_decode_times():
+    times = decode_times([0, 30, 1.5], ['days since 2019-03-28 00:29:59.999', 'minutes since 2019-03-28 00:29:59.999', 'hours since 2019-03-28'])
+    assert list(times) == [pd.Timestamp('2019-03-28 00:29:59.999'), pd.Timestamp('2019-03-28 00:59:59.999'), pd.Timestamp('2019-03-28 01:30')]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the rollup pyramid.
+"""
+import numpy as np
+import pandas as pd
+import xarray as xr
+import pytest
+from nasadap.rollup import Rollup, check_levels
+
+###############################
+### Tests
+
+
+def test_rollup():
+    with pytest.raises(ValueError):
+        check_levels(['D', 'h'])
+
+    ## Three days of half-hourly granules in GMT+12 starting at local noon, one day at a time
+    times = pd.date_range('2019-03-28 12:29:59.999', periods=144, freq='30min')
+    data = np.random.default_rng(0).gamma(0.5, 2, (144, 3, 2)).astype('f4')
+    data[5, 0, 0] = np.nan
+    ds = xr.Dataset({'precipitationCal': (('time', 'lon', 'lat'), data, {'units': 'mm/hr'})}, coords={'time': times, 'lon': np.arange(3), 'lat': np.arange(2)})
+
+    rollup = Rollup(['h', 'D', 'M'], '30min')
+    for i in range(0, 144, 48):
+        rollup.add(ds.isel(time=slice(i, i + 48)))
+    days = pd.concat([rollup.pop()['D'].to_dataframe(), rollup.pop(True)['D'].to_dataframe()])
+
+    daily = ds.precipitationCal.to_series().groupby([ds.time.to_index().floor('D').repeat(6), 'lon', 'lat'])
+    assert days.index.get_level_values('time').unique().equals(pd.DatetimeIndex(['2019-03-28', '2019-03-29', '2019-03-30', '2019-03-31']))
+    assert np.allclose(days['precipitationCal_sum'].values, daily.sum().values * 0.5, rtol=1e-5)
+    assert np.allclose(days['precipitationCal_max'].values, daily.max().values)
+    assert days['precipitationCal_count'].values[0] == 23
+    assert days.groupby('time')['steps'].first().tolist() == [24, 48, 48, 24]
+    assert days.groupby('time')['complete'].first().tolist() == [1, 1, 1, 0]
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the adaptive download limiter.
+"""
+from nasadap.scheduler import AdaptiveLimiter
+
+###############################
+### Tests
+
+
+def test_limiter_increase():
+    limiter = AdaptiveLimiter(8, start_limit=2)
+    for i in range(5):
+        limiter.release(limiter.acquire())
+
+    stats = limiter.stats()
+    assert stats['limit'] == 4
+    assert stats['completed'] == 5
+    assert stats['in_flight'] == 0
+
+
+def test_limiter_decrease():
+    limiter = AdaptiveLimiter(8, start_limit=8)
+    starts = [limiter.acquire() for i in range(8)]
+    limiter.release(starts[0], 'throttled')
+    limiter.release(starts[1], 'error')
+    limiter.release(starts[2], 'not_found')
+
+    stats = limiter.stats()
+    assert stats['limit'] == 4
+    assert stats['decreases'] == 1
+    assert (stats['throttled'], stats['errors'], stats['not_found']) == (1, 1, 1)
+    assert stats['in_flight'] == 5
+
+
+def test_limiter_bounds():
+    limiter = AdaptiveLimiter(2, start_limit=2)
+    for i in range(10):
+        limiter.release(limiter.acquire())
+    assert limiter.stats()['limit'] == 2
+
+    limiter = AdaptiveLimiter(2, start_limit=1)
+    limiter.release(limiter.acquire(), 'error')
+    assert limiter.stats()['limit'] == 1
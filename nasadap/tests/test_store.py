@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the zarr cache store.
+"""
+import numpy as np
+import pandas as pd
+import xarray as xr
+import pytest
+from nasadap.store import write_store, read_store
+
+zarr = pytest.importorskip('zarr')
+
+###############################
+### Parameters
+
+grid = {'lon': np.arange(160.05, 180, 0.1, dtype='f4'), 'lat': np.arange(-49.95, -30, 0.1, dtype='f4'), 'lon_attrs': {'units': 'degrees_east'}, 'lat_attrs': {'units': 'degrees_north'}}
+
+
+def granule(time, value, ar='precipitationCal'):
+    lon = grid['lon'][50:60]
+    lat = grid['lat'][20:28]
+    data = np.full((1, len(lon), len(lat)), value, 'f4')
+    return xr.Dataset({ar: (('time', 'lon', 'lat'), data, {'units': 'mm/hr', '_FillValue': np.float32(-9999.9)})}, coords={'time': pd.to_datetime([time]), 'lon': lon, 'lat': lat}, attrs={'FileHeader': time})
+
+###############################
+### Tests
+
+
+def test_store(tmp_path):
+    store_dir = str(tmp_path)
+    ds_list = [granule('2019-03-31 23:29:59.999', 1), granule('2019-04-01 00:29:59.999', 2), granule('2019-03-31 22:29:59.999', 3)]
+    write_store(store_dir, ds_list, '30min', grid)
+    write_store(store_dir, [granule('2019-03-31 23:29:59.999', 4, 'randomError')], '30min', grid)
+
+    times = pd.to_datetime(['2019-03-31 22:00', '2019-03-31 22:30', '2019-03-31 23:00', '2019-04-01 00:00'])
+    ds = read_store(store_dir, times, ['precipitationCal', 'randomError'], '30min', -48, -47.2, 165, 166)
+
+    assert list(ds.time.to_index()) == list(pd.to_datetime(['2019-03-31 22:29:59.999', '2019-03-31 23:29:59.999', '2019-04-01 00:29:59.999']))
+    assert np.array_equal(ds.lon.values, grid['lon'][50:60])
+    assert np.array_equal(ds.lat.values, grid['lat'][20:28])
+    assert ds['lon'].attrs['units'] == 'degrees_east'
+    assert ds['precipitationCal'].attrs['units'] == 'mm/hr'
+    assert (ds['precipitationCal'].values[:, 0, 0] == [3, 1, 2]).all()
+    assert np.isnan(ds['randomError'].values[0]).all()
+    assert (ds['randomError'].values[1] == 4).all()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the tiled cache files.
+"""
+import os
+import numpy as np
+import pandas as pd
+import xarray as xr
+import netCDF4
+from nasadap.grid import grid_slice
+from nasadap.encoding import get_profile
+from nasadap.tiles import write_granule
+
+###############################
+### Parameters
+
+grid = {'dims': ('time', 'lon', 'lat'), 'lon': np.arange(150.05, 180, 0.1).astype('f4'), 'lat': np.arange(-49.95, -30, 0.1).astype('f4'), 'lon_attrs': {'units': 'degrees_east'}, 'lat_attrs': {'units': 'degrees_north'}}
+time = pd.to_datetime(['2019-03-28 00:29:59.999'])
+
+
+def region(min_lat, max_lat, min_lon, max_lon, variables):
+    grid_dict = grid_slice(grid, min_lat, max_lat, min_lon, max_lon)
+    lon, lat = grid_dict['lon'], grid_dict['lat']
+    data_vars = {}
+    for ar, value in variables.items():
+        data = np.full((1, len(lon), len(lat)), value, 'f4')
+        data[0, 0, 0] = -9999.9
+        data_vars[ar] = (('time', 'lon', 'lat'), data, {'units': 'mm/hr', '_FillValue': np.float32(-9999.9)})
+    return xr.Dataset(data_vars, coords={'time': time, 'lon': lon, 'lat': lat}, attrs={'FileHeader': 'StopGranuleDateTime=2019-03-28T00:29:59.999Z;\n'})
+
+
+def read(path, min_lat, max_lat, min_lon, max_lon):
+    with xr.open_dataset(path) as ds:
+        return ds.sel(lat=slice(min_lat, max_lat), lon=slice(min_lon, max_lon)).load()
+
+###############################
+### Tests
+
+
+def test_write_granule(tmp_path):
+    profile = get_profile('none')
+    path1 = str(tmp_path / 'one.nc4')
+    path2 = str(tmp_path / 'two.nc4')
+
+    ## Two regions that are far apart and a variable of one of them
+    write_granule(path1, grid, region(-50, -45, 150, 155, {'precipitationCal': 1}), profile)
+    write_granule(path2, grid, region(-50, -45, 150, 155, {'precipitationCal': 1}), profile)
+    write_granule(path2, grid, region(-35, -30, 175, 180, {'precipitationCal': 2}), profile)
+    write_granule(path2, grid, region(-50, -45, 150, 155, {'HQprecipitation': 3}), profile)
+
+    ds1 = read(path2, -50, -45, 150, 155)
+    ds2 = read(path2, -35, -30, 175, 180)
+    assert ds1.time.to_index().equals(time)
+    assert ds1.attrs['FileHeader'].startswith('StopGranuleDateTime')
+    assert ds1['precipitationCal'].attrs['units'] == 'mm/hr'
+    for ds, ar, value in [(ds1, 'precipitationCal', 1), (ds2, 'precipitationCal', 2), (ds1, 'HQprecipitation', 3)]:
+        values = ds[ar].values
+        assert np.isnan(values[0, 0, 0])
+        assert (values.ravel()[1:] == value).all()
+    assert np.isnan(read(path2, -40, -35, 160, 170)['precipitationCal']).all()
+
+    ## Only the tiles of the regions are stored rather than the rectangle around them
+    size1 = os.path.getsize(path1)
+    assert os.path.getsize(path2) < 3 * size1
+    assert os.path.getsize(path2) < 0.25 * 4 * len(grid['lon']) * len(grid['lat'])
+
+
+def test_convert_granule(tmp_path):
+    path = str(tmp_path / 'old.nc4')
+    region(-48, -46, 168, 171, {'precipitationCal': 1}).to_netcdf(path)
+    write_granule(path, grid, region(-35, -30, 175, 180, {'precipitationCal': 2}), get_profile('lossless'))
+
+    with netCDF4.Dataset(path) as nc:
+        assert len(nc.dimensions['lon']) == len(grid['lon'])
+    values = read(path, -48, -46, 168, 171)['precipitationCal'].values
+    assert np.isnan(values[0, 0, 0]) and (values.ravel()[1:] == 1).all()
+    assert (read(path, -34.9, -30.1, 175.1, 179.9)['precipitationCal'] == 2).all()
+    assert not [f for f in os.listdir(str(tmp_path)) if f.endswith('.tmp')]
+
+
+def test_mixed_encodings(tmp_path):
+    path = str(tmp_path / 'mixed.nc4')
+
+    ## The tiles appended with another profile keep the compression of the variable, and a new variable has the compression of the new profile
+    write_granule(path, grid, region(-50, -45, 150, 155, {'precipitationCal': 1}), get_profile('lossless'))
+    write_granule(path, grid, region(-35, -30, 175, 180, {'precipitationCal': 2, 'HQprecipitation': 3}), get_profile('none'))
+
+    with netCDF4.Dataset(path) as nc:
+        assert nc['precipitationCal'].filters()['zlib']
+        assert not nc['HQprecipitation'].filters()['zlib']
+    ds1 = read(path, -50, -45, 150, 155)
+    ds2 = read(path, -35, -30, 175, 180)
+    assert (ds1['precipitationCal'].values.ravel()[1:] == 1).all()
+    assert (ds2['precipitationCal'].values.ravel()[1:] == 2).all()
+    assert (ds2['HQprecipitation'].values.ravel()[1:] == 3).all()
+    assert np.isnan(ds1['HQprecipitation']).all()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the hdf5 transport against a local http server with range requests.
+"""
+import os
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+import numpy as np
+import pytest
+import requests
+from nasadap.transport import RangeFile, resolve_layout, hdf5_granule, data_url
+
+h5py = pytest.importorskip('h5py')
+
+###############################
+### Parameters
+
+file_header = 'StartGranuleDateTime=2019-03-28T00:00:00.000Z;\nStopGranuleDateTime=2019-03-28T00:29:59.999Z;\n'
+granule_path = '/opendap/hyrax/GPM_L3/GPM_3IMERGHHE.06/2019/087/3B-HHR-E.MS.MRG.3IMERG.20190328-S000000-E002959.0000.V06B.HDF5'
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def make_handler(content):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            start, stop = self.headers['Range'].split('=')[1].split('-')
+            body = content[int(start):(int(stop) + 1)]
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {start}-{stop}/{size}'.format(start=start, stop=stop, size=len(content)))
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+@pytest.fixture
+def server(tmp_path):
+    path = os.path.join(str(tmp_path), 'granule.HDF5')
+    data = np.arange(10 * 20, dtype='f4').reshape(1, 10, 20)
+    with h5py.File(path, 'w') as h5:
+        h5.attrs['FileHeader'] = np.bytes_(file_header)
+        grid = h5.create_group('Grid')
+        dset = grid.create_dataset('precipitationCal', data=data, chunks=(1, 4, 6), compression='gzip', shuffle=True, fillvalue=-9999.9)
+        dset.attrs['units'] = np.bytes_('mm/hr')
+
+    with open(path, 'rb') as f:
+        content = f.read()
+
+    httpd = ThreadingHTTPServer(('localhost', 0), make_handler(content))
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://localhost:{port}'.format(port=httpd.server_address[1]), data, content
+    httpd.shutdown()
+    httpd.server_close()
+
+###############################
+### Tests
+
+
+def test_data_url():
+    assert data_url('https://gpm1.gesdisc.eosdis.nasa.gov' + granule_path) == 'https://gpm1.gesdisc.eosdis.nasa.gov/data/GPM_L3/GPM_3IMERGHHE.06/2019/087/3B-HHR-E.MS.MRG.3IMERG.20190328-S000000-E002959.0000.V06B.HDF5'
+
+
+def test_range_file(server):
+    base_url, data, content = server
+    f = RangeFile(base_url + '/file', requests.Session(), block_size=100)
+    f.seek(150)
+    assert f.read(120) == content[150:270]
+    assert f.tell() == 270
+    assert f.read_ranges([(500, 10), (0, 5)]) == [content[500:510], content[0:5]]
+
+
+def test_hdf5_granule(server):
+    base_url, data, content = server
+    session = requests.Session()
+    layout = resolve_layout(base_url + granule_path, session, ['precipitationCal'])
+
+    assert layout['datasets']['precipitationCal']['path'] == 'Grid/precipitationCal'
+    assert layout['datasets']['precipitationCal']['chunks'] == (1, 4, 6)
+
+    grid_dict = {'index': (slice(0, 1), slice(3, 9), slice(5, 17))}
+    attrs, data_dict, attrs_dict = hdf5_granule(base_url + granule_path, session, ['precipitationCal'], grid_dict, layout)
+
+    assert attrs['FileHeader'] == file_header
+    assert attrs_dict['precipitationCal']['units'] == 'mm/hr'
+    assert np.array_equal(data_dict['precipitationCal'], data[grid_dict['index']])
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the zonal statistics.
+"""
+import os
+import numpy as np
+import pandas as pd
+import xarray as xr
+import pytest
+from nasadap.zonal import zonal_weights, zonal_mean, ring_cell_areas, ring_area, cell_edges
+
+pytest.importorskip('scipy')
+
+###############################
+### Parameters
+
+lon = np.arange(170.05, 171, 0.1)
+lat = np.arange(-44.95, -44, 0.1)
+
+square = {'type': 'Polygon', 'coordinates': [[[170.1, -44.9], [170.3, -44.9], [170.3, -44.7], [170.1, -44.7], [170.1, -44.9]]]}
+star = np.array([[170.5 + r * np.cos(a), -44.5 + r * np.sin(a)] for a, r in zip(np.linspace(0, 2 * np.pi, 20, endpoint=False), [0.35, 0.12] * 10)])
+holed = {'type': 'Polygon', 'coordinates': [[[170.1, -44.3], [170.5, -44.3], [170.5, -44.1], [170.1, -44.1]], [[170.2, -44.3], [170.3, -44.3], [170.3, -44.2], [170.2, -44.2]]]}
+
+###############################
+### Tests
+
+
+def test_ring_cell_areas():
+    areas = ring_cell_areas(star, cell_edges(lon), cell_edges(lat))
+    assert np.isclose(sum(areas.values()), abs(ring_area(star[:, 0], star[:, 1])))
+    assert max(areas.values()) <= 0.01 + 1e-12
+
+
+def test_zonal_mean(tmp_path):
+    zones = {'square': square, 'star': {'type': 'Polygon', 'coordinates': [star.tolist()]}, 'holed': holed}
+    w = zonal_weights(lon, lat, zones, cache_dir=str(tmp_path))
+    assert len(os.listdir(os.path.join(str(tmp_path), 'zonal'))) == 1
+    assert w['weights'][0].nnz == 4
+    assert w['weights'][2].nnz == 7
+    assert np.isclose(w['area'][0], w['weights'][0].toarray().reshape(len(lon), len(lat))[1:3, 1:3].sum())
+
+    data = np.random.default_rng(0).gamma(0.5, 2, (3, len(lon), len(lat))).astype('f4')
+    data[1, 1, 1] = np.nan
+    ds = xr.Dataset({'precipitationCal': (('time', 'lon', 'lat'), data, {'units': 'mm/hr'})}, coords={'time': pd.date_range('2019-03-28', periods=3, freq='30min'), 'lon': lon, 'lat': lat})
+    zm = zonal_mean(ds, zones, cache_dir=str(tmp_path), time_chunk=2)
+
+    assert list(zm['zone'].values) == ['square', 'star', 'holed']
+    cos = np.cos(np.deg2rad(lat[1:3]))
+    assert np.isclose(zm['precipitationCal'].values[0, 0], (data[0, 1:3, 1:3] * cos).sum() / (2 * cos.sum()))
+    assert np.isclose(zm['precipitationCal'].values[1, 0], (data[1, 1:3, 1:3] * cos)[[0, 1, 1], [1, 0, 1]].sum() / (cos[1] * 2 + cos[0]))
+    assert zm['precipitationCal'].attrs['units'] == 'mm/hr'
+
+    ## Only the rows and columns around the cells of the zones are read, which gives the same means
+    zm1 = zonal_mean(ds, {'square': square}, time_chunk=2)
+    assert np.allclose(zm1['precipitationCal'].values[:, 0], zm['precipitationCal'].values[:, 0])
+    away = {'type': 'Polygon', 'coordinates': [[[160, -40], [161, -40], [161, -39], [160, -40]]]}
+    zm2 = zonal_mean(ds, {'away': away})
+    assert np.isnan(zm2['precipitationCal'].values).all() and (zm2['area'].values == 0).all()
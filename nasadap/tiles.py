@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Tiled netcdf cache files of the granules. A cached granule has the whole grid of the product and its variables are chunked by the tiles of the grid (see grid.py). Only the chunks of the downloaded tiles are written (HDF5 doesn't allocate the chunks that are never written), so a granule cached for regions that are far apart only stores the tiles of those regions, and the tiles of a later download are written into the file without rewriting the others.
+"""
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import netCDF4
+from nasadap.grid import tile_cells
+from nasadap.encoding import compressions
+from nasadap.reader import netcdf_lock, hdf5_lock, nc_attrs, decode_times
+
+###############################################
+### Parameters
+
+granule_time_units = 'milliseconds since 1970-01-01'
+
+###############################################
+### Functions
+
+
+def is_tiled(nc, grid):
+    """
+    Function to check if an open cache file has the whole grid of the product.
+    """
+    return (len(nc.dimensions['lon']) == len(grid['lon'])) and (len(nc.dimensions['lat']) == len(grid['lat']))
+
+
+def read_region(nc):
+    """
+    Function to read all of the raw variables of an open cache file of the older layout (the bounding box of its downloads).
+
+    Returns
+    -------
+    dict
+        The time, lon, lat, global attributes, and the dict of variable name to the (time, lon, lat) values and attributes.
+    """
+    nc.set_auto_maskandscale(False)
+    variables = {}
+    for ar, var in nc.variables.items():
+        if ar in nc.dimensions:
+            continue
+        values = var[:]
+        if [d for d in var.dimensions if d != 'time'] == ['lat', 'lon']:
+            values = values.transpose(0, 2, 1)
+        variables[ar] = (values, nc_attrs(var))
+    time = nc['time']
+
+    return {'time': decode_times([time[0]], [time.getncattr('units')])[0], 'lon': nc['lon'][:], 'lat': nc['lat'][:], 'attrs': nc_attrs(nc), 'variables': variables}
+
+
+def dataset_region(ds):
+    """
+    Function to convert a raw granule dataset with the time, lon, and lat dims to the region dict of read_region.
+    """
+    variables = {ar: (ds[ar].transpose('time', 'lon', 'lat').values, ds[ar].attrs) for ar in ds.data_vars}
+    return {'time': ds.time.values[0], 'lon': ds.lon.values, 'lat': ds.lat.values, 'attrs': ds.attrs, 'variables': variables}
+
+
+def create_granule(nc, grid, time, attrs):
+    """
+    Function to create the dims, coordinates, and global attributes of a tiled cache file.
+    """
+    nc.createDimension('time', 1)
+    nc.createDimension('lon', len(grid['lon']))
+    nc.createDimension('lat', len(grid['lat']))
+
+    var = nc.createVariable('time', 'i8', ('time',))
+    var.units = granule_time_units
+    var[:] = (pd.Timestamp(time) - pd.Timestamp('1970-01-01')) // pd.Timedelta('1ms')
+
+    for coord in ['lon', 'lat']:
+        values = np.asarray(grid[coord])
+        var = nc.createVariable(coord, values.dtype.newbyteorder('='), (coord,), **compressions['zlib'])
+        var.setncatts({k: v for k, v in grid[coord + '_attrs'].items() if k != '_FillValue'})
+        var[:] = values
+
+    nc.setncatts(attrs)
+
+
+def write_region(nc, grid, region, profile):
+    """
+    Function to write the raw variables of a region into its tiles of an open tiled cache file. The variables that aren't in the file yet are created with the compression of the encoding profile.
+    """
+    lon, lat = region['lon'], region['lat']
+    if (len(lon) == 0) or (len(lat) == 0):
+        return
+    i = int(np.abs(grid['lon'] - lon[0]).argmin())
+    j = int(np.abs(grid['lat'] - lat[0]).argmin())
+    lon_cells, lat_cells = tile_cells(grid)
+    chunks = (1, min(lon_cells, len(grid['lon'])), min(lat_cells, len(grid['lat'])))
+
+    for ar, (values, attrs) in region['variables'].items():
+        values = values.astype(values.dtype.newbyteorder('='), copy=False)
+        if ar not in nc.variables:
+            attrs = dict(attrs)
+            fill_value = attrs.pop('_FillValue', None)
+            var = nc.createVariable(ar, values.dtype, ('time', 'lon', 'lat'), fill_value=fill_value, chunksizes=chunks, **compressions[profile['compression']])
+            var.setncatts(attrs)
+        var = nc[ar]
+        var.set_auto_maskandscale(False)
+        var[:, i:(i + values.shape[1]), j:(j + values.shape[2])] = values
+
+
+def write_granule(path, grid, ds, profile):
+    """
+    Function to write the variables of a downloaded granule into its tiled cache file. The file is created if it doesn't exist, and a cache file of the older layout is converted with its data. The file is written under a temporary name and renamed, so processes that share the cache never read a partial file.
+
+    Parameters
+    ----------
+    path : str
+        The path of the cache file.
+    grid : dict
+        The grid descriptor of the product.
+    ds : xarray dataset
+        The raw (not decoded) granule with the time, lon, and lat dims. Its lon and lat must be a block of the grid.
+    profile : dict
+        The encoding profile of the variables that are created.
+    """
+    temp_path = '{path}.{pid}.tmp'.format(path=path, pid=os.getpid())
+    region = dataset_region(ds)
+    mode = 'w'
+    old = None
+    with netcdf_lock, hdf5_lock:
+        if os.path.isfile(path):
+            with netCDF4.Dataset(path) as nc:
+                if not is_tiled(nc, grid):
+                    old = read_region(nc)
+            if old is None:
+                shutil.copyfile(path, temp_path)
+                mode = 'a'
+
+        with netCDF4.Dataset(temp_path, mode) as nc:
+            if 'lon' not in nc.dimensions:
+                create_granule(nc, grid, region['time'], (old or region)['attrs'])
+            if old is not None:
+                write_region(nc, grid, old, profile)
+            write_region(nc, grid, region, profile)
+
+    os.replace(temp_path, path)
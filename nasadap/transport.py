@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+"""
+Transports to read the bounding box subset of a granule. 'dap' reads it via opendap and 'hdf5' reads it from the raw HDF5 file with http range requests.
+"""
+import zlib
+import itertools
+import numpy as np
+import pandas as pd
+from pydap.client import open_url
+from nasadap.grid import get_variable, fix_attributes
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+###############################################
+### Parameters
+
+transports = ['dap', 'hdf5']
+block_size = 2**16
+max_gap = 2**16
+h5_internal_attrs = ['DIMENSION_LIST', 'REFERENCE_LIST', 'CLASS', 'NAME', '_Netcdf4Dimid', '_Netcdf4Coordinates', '_NCProperties', '_nc3_strict']
+h5_deflate = 1
+h5_shuffle = 2
+
+###############################################
+### Functions
+
+
+def granule_time(attrs):
+    """
+    Function to get the end time of a granule from its FileHeader attribute.
+    """
+    ds_date1 = attrs['FileHeader'].split(';\n')
+    ds_date2 = dict([t.split('=') for t in ds_date1 if t != ''])
+    ds_date = pd.to_datetime([ds_date2['StopGranuleDateTime']]).tz_convert(None)
+    return ds_date
+
+
+def dap_granule(url, session, dataset_list, grid_dict):
+    """
+    Function to read the index hyperslab of the dataset_list variables of a granule via opendap.
+
+    Returns
+    -------
+    tuple
+        The global attributes, the data of the variables, and the attributes of the variables.
+    """
+    dataset = open_url(url, session=session)
+    attrs = fix_attributes(dataset.attributes)
+
+    data = {}
+    var_attrs = {}
+    for ar in dataset_list:
+        data[ar] = get_variable(dataset, ar, grid_dict['index'])
+        var_attrs[ar] = fix_attributes(dataset[ar].attributes)
+
+    return attrs, data, var_attrs
+
+
+def data_url(url):
+    """
+    Function to convert an opendap granule url to the url of the raw file.
+    """
+    if 'hyrax/' in url:
+        split_text = 'hyrax/'
+    else:
+        split_text = 'opendap/'
+    base_url = url.split('/opendap/')[0]
+    return '/'.join([base_url, 'data', url.split(split_text)[1]])
+
+
+class RangeFile(object):
+    """
+    Class of a read-only file object over http range requests. The reads are cached in blocks so that the many small metadata reads of the HDF5 library are coalesced.
+
+    Parameters
+    ----------
+    url : str
+        The url of the file.
+    session : requests.Session
+        The authenticated session.
+    prefetch : list of int or None
+        The blocks to get when the file is opened.
+    block_size : int
+        The size of the blocks in bytes.
+
+    Returns
+    -------
+    RangeFile object
+    """
+    def __init__(self, url, session, prefetch=None, block_size=block_size):
+        self.url = url
+        self.session = session
+        self.block_size = block_size
+        self.size = None
+        self.blocks = {}
+        self.touched = set()
+        self.requests = 0
+        self.bytes = 0
+        self.pos = 0
+        self._fetch_blocks([0])
+        if prefetch:
+            self._fetch_blocks(prefetch)
+
+    def _get_range(self, start, stop):
+        resp = self.session.get(self.url, headers={'Range': 'bytes={start}-{stop}'.format(start=start, stop=stop - 1)})
+        resp.raise_for_status()
+        if resp.status_code != 206:
+            resp.close()
+            raise IOError('The server does not support range requests for ' + self.url)
+        if self.size is None:
+            self.size = int(resp.headers['Content-Range'].rsplit('/', 1)[1])
+        content = resp.content
+        self.requests += 1
+        self.bytes += len(content)
+        return content
+
+    def _fetch_blocks(self, blocks):
+        if self.size is not None:
+            n_blocks = -(-self.size // self.block_size)
+            blocks = [b for b in blocks if b < n_blocks]
+        missing = sorted(set(b for b in blocks if b not in self.blocks))
+        for k, g in itertools.groupby(enumerate(missing), lambda x: x[1] - x[0]):
+            run = [b for i, b in g]
+            start = run[0] * self.block_size
+            stop = (run[-1] + 1) * self.block_size
+            if self.size is not None:
+                stop = min(stop, self.size)
+            content = self._get_range(start, stop)
+            for b in run:
+                offset = (b - run[0]) * self.block_size
+                self.blocks[b] = content[offset:(offset + self.block_size)]
+
+    def read_ranges(self, ranges):
+        """
+        Read many byte ranges outside of the block cache. Ranges closer than max_gap are read with one request.
+
+        Parameters
+        ----------
+        ranges : list of tuple
+            The (offset, size) of the ranges.
+
+        Returns
+        -------
+        list of bytes
+            In the same order as the ranges.
+        """
+        order = sorted(range(len(ranges)), key=lambda i: ranges[i][0])
+        output = [None] * len(ranges)
+        groups = []
+        for i in order:
+            offset, size = ranges[i]
+            if groups and (offset - groups[-1][1]) <= max_gap:
+                groups[-1][1] = max(groups[-1][1], offset + size)
+                groups[-1][2].append(i)
+            else:
+                groups.append([offset, offset + size, [i]])
+        for start, stop, members in groups:
+            content = self._get_range(start, stop)
+            for i in members:
+                offset, size = ranges[i]
+                output[i] = content[(offset - start):(offset - start + size)]
+        return output
+
+    def read(self, size=-1):
+        if (size is None) or (size < 0):
+            size = self.size - self.pos
+        size = max(min(size, self.size - self.pos), 0)
+        if size == 0:
+            return b''
+        first = self.pos // self.block_size
+        last = (self.pos + size - 1) // self.block_size
+        blocks = list(range(first, last + 1))
+        self.touched.update(blocks)
+        self._fetch_blocks(blocks)
+        content = b''.join(self.blocks[b] for b in blocks)
+        offset = self.pos - first * self.block_size
+        self.pos += size
+        return content[offset:(offset + size)]
+
+    def readinto(self, buffer):
+        content = self.read(len(buffer))
+        buffer[:len(content)] = content
+        return len(content)
+
+    def seek(self, offset, whence=0):
+        if whence == 0:
+            self.pos = offset
+        elif whence == 1:
+            self.pos += offset
+        else:
+            self.pos = self.size + offset
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def writable(self):
+        return False
+
+    def close(self):
+        self.blocks = {}
+
+
+def h5_attributes(attributes):
+    """
+    Function to convert the HDF5 attributes to the same types as the opendap attributes. The HDF5/netCDF internal attributes are removed.
+    """
+    attrs = {}
+    for k, v in attributes.items():
+        if k in h5_internal_attrs:
+            continue
+        if isinstance(v, bytes):
+            v = v.decode()
+        elif isinstance(v, np.ndarray):
+            if v.dtype.kind == 'S':
+                v = [i.decode() for i in v.ravel()]
+            else:
+                v = v.ravel()
+            if len(v) == 1:
+                v = v[0]
+        attrs[k] = v
+
+    return attrs
+
+
+def find_h5_paths(h5, names):
+    """
+    Function to find the paths of the named datasets in an HDF5 file (e.g. Grid/precipitationCal).
+    """
+    paths = {}
+
+    def visit(path, obj):
+        name = path.rsplit('/', 1)[-1]
+        if isinstance(obj, h5py.Dataset) and (name in names) and (name not in paths):
+            paths[name] = path
+
+    h5.visititems(visit)
+    missing = set(names).difference(paths)
+    if missing:
+        raise ValueError('Could not find ' + ', '.join(missing) + ' in the HDF5 file')
+    return paths
+
+
+def resolve_layout(url, session, dataset_names):
+    """
+    Function to resolve the HDF5 layout of a product from one of its granules. The layout has the paths, chunk shapes, and filters of the datasets, and the blocks of the file that the HDF5 library read to open the file and to locate the chunks. The blocks are prefetched in one go for the other granules.
+
+    Parameters
+    ----------
+    url : str
+        The opendap url of a granule.
+    session : requests.Session
+        The authenticated session.
+    dataset_names : list of str
+        The dataset types of the product.
+
+    Returns
+    -------
+    dict
+    """
+    if h5py is None:
+        raise ImportError('The hdf5 transport requires h5py')
+    f = RangeFile(data_url(url), session)
+    with h5py.File(f, 'r') as h5:
+        paths = find_h5_paths(h5, dataset_names)
+        datasets = {}
+        for name, path in paths.items():
+            dset = h5[path]
+            plist = dset.id.get_create_plist()
+            filters = [plist.get_filter(i)[0] for i in range(plist.get_nfilters())]
+            datasets[name] = {'path': path, 'chunks': dset.chunks, 'filters': filters, 'dtype': dset.dtype, 'fillvalue': dset.fillvalue}
+            if raw_chunks(datasets[name]) and dset.id.get_num_chunks():
+                dset.id.get_chunk_info(0)
+
+    layout = {'datasets': datasets, 'blocks': sorted(f.touched), 'block_size': f.block_size}
+    return layout
+
+
+def raw_chunks(dataset):
+    """
+    Function to determine if the chunks of a dataset can be read and decoded directly rather than through the HDF5 library.
+    """
+    return (dataset['chunks'] is not None) and set(dataset['filters']).issubset([h5_deflate, h5_shuffle]) and hasattr(h5py.h5d.DatasetID, 'get_chunk_info_by_coord')
+
+
+def chunk_coords(index, chunks):
+    """
+    Function to get the start coordinates of the chunks that intersect an index hyperslab.
+    """
+    ranges = [range((s.start // c) * c, s.stop, c) for s, c in zip(index, chunks)]
+    return list(itertools.product(*ranges))
+
+
+def decode_chunk(content, filters, filter_mask, dtype, chunks):
+    """
+    Function to decode a raw HDF5 chunk. The filters are undone in reverse order.
+    """
+    for i, f in reversed(list(enumerate(filters))):
+        if filter_mask & (1 << i):
+            continue
+        if f == h5_deflate:
+            content = zlib.decompress(content)
+        elif f == h5_shuffle:
+            content = np.frombuffer(content, np.uint8).reshape(dtype.itemsize, -1).T.tobytes()
+    return np.frombuffer(content, dtype).reshape(chunks)
+
+
+def hdf5_granule(url, session, dataset_list, grid_dict, layout):
+    """
+    Function to read the index hyperslab of the dataset_list variables of a granule from the raw HDF5 file with http range requests. The chunk locations are read via the HDF5 library and the chunks themselves are read and decoded directly when possible.
+
+    Returns
+    -------
+    tuple
+        The global attributes, the data of the variables, and the attributes of the variables.
+    """
+    if h5py is None:
+        raise ImportError('The hdf5 transport requires h5py')
+    index = grid_dict['index']
+    f = RangeFile(data_url(url), session, layout['blocks'], layout['block_size'])
+
+    data = {}
+    var_attrs = {}
+    chunk_info = {}
+    with h5py.File(f, 'r') as h5:
+        attrs = h5_attributes(h5.attrs)
+        for ar in dataset_list:
+            dataset = layout['datasets'][ar]
+            dset = h5[dataset['path']]
+            var_attrs[ar] = h5_attributes(dset.attrs)
+            if raw_chunks(dataset):
+                chunk_info[ar] = [(c, dset.id.get_chunk_info_by_coord(c)) for c in chunk_coords(index, dataset['chunks'])]
+            else:
+                data[ar] = dset[index]
+
+    for ar, infos in chunk_info.items():
+        dataset = layout['datasets'][ar]
+        chunks = dataset['chunks']
+        shape = [s.stop - s.start for s in index]
+        arr = np.full(shape, dataset['fillvalue'], dataset['dtype'])
+        stored = [(c, i) for c, i in infos if i.byte_offset is not None]
+        contents = f.read_ranges([(i.byte_offset, i.size) for c, i in stored])
+        for (c, i), content in zip(stored, contents):
+            chunk = decode_chunk(content, dataset['filters'], i.filter_mask, dataset['dtype'], chunks)
+            src = tuple(slice(max(s.start - c0, 0), min(s.stop - c0, n)) for s, c0, n in zip(index, c, chunks))
+            dst = tuple(slice(c0 + s1.start - s.start, c0 + s1.stop - s.start) for s, c0, s1 in zip(index, c, src))
+            arr[dst] = chunk[src]
+        data[ar] = arr
+
+    return attrs, data, var_attrs
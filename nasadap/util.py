@@ -2,14 +2,14 @@
 """
 Utility functions.
 """
-import requests
 from re import search, IGNORECASE
 import os
+import numpy as np
 import pandas as pd
-from xmltodict import parse
-from multiprocessing.pool import ThreadPool
-from time import sleep
 import itertools
+from io import BytesIO
+from lxml import etree
+from nasadap.crawler import fetch_catalogs
 
 ###############################################
 ### Parameters
@@ -31,34 +31,303 @@ master_datasets = {'3IMERGHHE': ['precipitationQualityIndex', 'IRkalmanFilterWei
                    '3IMERGHHL': ['precipitationQualityIndex', 'IRkalmanFilterWeight', 'precipitationCal', 'HQprecipitation', 'probabilityLiquidPrecipitation', 'randomError', 'IRprecipitation'],
                    '3IMERGHH': ['precipitationQualityIndex', 'IRkalmanFilterWeight', 'precipitationCal', 'HQprecipitation', 'probabilityLiquidPrecipitation', 'randomError', 'IRprecipitation']}
 
+product_freq = {'3IMERGHHE': '30min', '3IMERGHHL': '30min', '3IMERGHH': '30min'}
+
+thredds_ns = '{http://www.unidata.ucar.edu/namespaces/thredds/InvCatalog/v1.0}'
+
+## Offsets of the date, start time, and end time digits from the '-S' in the granule names
+granule_time_offsets = np.array(list(range(-8, 0)) + list(range(2, 8)) + list(range(10, 16)))
+
 
 
 ###############################################
 ### Functions
 
 
+def parse_catalog_xml(content, tag='dataset'):
+    """
+    Function to parse the entries of a THREDDS catalog.xml from the Hyrax server. The elements are streamed via lxml's iterparse and are cleared once parsed. Entries with '.xml' in their name are skipped.
+
+    Parameters
+    ----------
+    content : bytes
+        The catalog.xml content.
+    tag : str
+        The THREDDS element to parse. Either 'dataset' for the files or 'catalogRef' for the sub-directories.
+
+    Returns
+    -------
+    dict of list
+        Columns of name, ID, size, and modified. The size and modified are None when they are not provided.
+    """
+    cat_dict = {'name': [], 'ID': [], 'size': [], 'modified': []}
+    size_tag = thredds_ns + 'dataSize'
+    date_tag = thredds_ns + 'date'
+    is_dataset = tag == 'dataset'
+
+    for event, elem in etree.iterparse(BytesIO(content), events=('end',), tag=thredds_ns + tag):
+        name = elem.get('name')
+        size = elem.findtext(size_tag)
+        if (is_dataset and (size is None)) or ('.xml' in name):
+            continue
+        cat_dict['name'].append(name)
+        cat_dict['ID'].append(elem.get('ID'))
+        cat_dict['size'].append(int(size) if size is not None else None)
+        cat_dict['modified'].append(elem.findtext(date_tag))
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+    return cat_dict
+
+
+def parse_dates_xml(date, content):
+    """
+    Function to parse the granules of a day catalog.xml.
+
+    Parameters
+    ----------
+    date : Timestamp
+        The date of the day catalog.
+    content : bytes
+        The catalog.xml content.
+
+    Returns
+    -------
+    dict of list
+        The columns of parse_catalog_xml plus the date.
+    """
+    cat_dict = parse_catalog_xml(content, 'dataset')
+    cat_dict['date'] = [date] * len(cat_dict['name'])
+
+    return cat_dict
+
+
 def parse_dates(date, url):
     """
+    Function to get and parse the granules of a day catalog.
+    """
+    content = fetch_catalogs([url])[0]
+
+    return parse_dates_xml(date, content)
+
+
+def parse_refs_xml(content):
+    """
+    Function to parse the sub-catalog references (e.g. years or days) of a Hyrax catalog.xml.
+
+    Parameters
+    ----------
+    content : bytes
+        The catalog.xml content.
+
+    Returns
+    -------
+    list of list
+        [name, ID, modified_date] for each reference. The modified_date is None if the server does not provide it.
+    """
+    cat_dict = parse_catalog_xml(content, 'catalogRef')
+    lst1 = [list(r) for r in zip(cat_dict['name'], cat_dict['ID'], cat_dict['modified'])]
+
+    return lst1
+
+
+def parse_catalog_refs(url):
+    """
+    Function to get and parse the sub-catalog references of a Hyrax catalog directory.
+
+    Parameters
+    ----------
+    url : str
+        The url of the catalog directory (without the catalog.xml).
+
+    Returns
+    -------
+    list of list
+        [name, ID, modified_date] for each reference.
+    """
+    content = fetch_catalogs([url])[0]
+
+    return parse_refs_xml(content)
+
+
+def decode_granule_names(names):
+    """
+    Function to decode the start and end times of the granules from their file names (e.g. 3B-HHR.MS.MRG.3IMERG.20190328-S000000-E002959.0000.V06B.HDF5). The digits are sliced out of a fixed width byte array at fixed offsets from the '-S' and converted in one vectorized pass.
+
+    Parameters
+    ----------
+    names : list or ndarray of str
+        The granule file names.
+
+    Returns
+    -------
+    tuple of ndarray
+        from_date and to_date as datetime64[ns]. Names that can't be decoded are NaT.
+    """
+    arr = np.asarray(names, dtype='S')
+    n = len(arr)
+    if n == 0:
+        empty = np.array([], dtype='datetime64[ns]')
+        return empty, empty.copy()
+
+    chars = np.frombuffer(arr.tobytes(), dtype=np.uint8).reshape(n, arr.dtype.itemsize)
+    pos = np.char.find(arr, b'-S')
+    valid = (pos >= 8) & (pos + granule_time_offsets[-1] < arr.dtype.itemsize)
+    idx = np.where(valid, pos, 8)[:, None] + granule_time_offsets
+    digits = np.take_along_axis(chars, idx, axis=1).astype(np.int64) - 48
+    valid = valid & ((digits >= 0) & (digits <= 9)).all(axis=1)
+
+    year = digits[:, 0:4].dot([1000, 100, 10, 1])
+    month = digits[:, 4:6].dot([10, 1])
+    day = digits[:, 6:8].dot([10, 1])
+    start = digits[:, 8:14].dot([36000, 3600, 600, 60, 10, 1])
+    end = digits[:, 14:20].dot([36000, 3600, 600, 60, 10, 1])
+    valid = valid & (month >= 1) & (month <= 12) & (day >= 1) & (day <= 31)
+
+    date = (np.where(valid, year, 1970) - 1970).astype('datetime64[Y]').astype('datetime64[M]') + (np.where(valid, month, 1) - 1).astype('timedelta64[M]')
+    date = date.astype('datetime64[D]') + (np.where(valid, day, 1) - 1).astype('timedelta64[D]')
+    date = date.astype('datetime64[ns]')
+
+    from_date = date + start.astype('timedelta64[s]')
+    to_date = date + end.astype('timedelta64[s]')
+    from_date[~valid] = np.datetime64('NaT')
+    to_date[~valid] = np.datetime64('NaT')
+
+    return from_date, to_date
+
+
+def process_date_list(date_lst, mission, product, version):
+    """
+    Function to convert the output dicts of parse_dates_xml to the catalog DataFrame returned by parse_nasa_catalog.
+    """
+    cols = {col: list(itertools.chain.from_iterable(d[col] for d in date_lst)) for col in ['name', 'ID', 'size', 'modified']}
+    date_df = pd.DataFrame(cols).rename(columns={'name': 'file_name', 'ID': 'file_url', 'size': 'file_size', 'modified': 'modified_date'})
+    date_df['modified_date'] = pd.to_datetime(date_df['modified_date'], format='%Y-%m-%dT%H:%M:%S', errors='coerce', utc=True)
+    from_date, to_date = decode_granule_names(date_df['file_name'].values)
+    date_df['from_date'] = pd.DatetimeIndex(from_date).tz_localize('utc')
+    date_df['to_date'] = pd.DatetimeIndex(to_date).tz_localize('utc')
+
+    ## Add in extra columns and return
+    date_df['mission'] = mission
+    date_df['product'] = product
+    date_df['version'] = version
+
+    return date_df
+
+
+def get_product_dir(mission, product, version):
+    """
+    Function to get the name of the product directory on the Hyrax server from the file path template.
+    """
+    products = mission_product_dict[mission]['products']
+    if product not in products:
+        raise ValueError('product must be one of: ' + ', '.join(products.keys()))
+    product_dir = products[product].split('/')[0].format(mission=mission.upper(), product=product, version=version)
 
+    return product_dir
+
+
+def year_days(year, days_lst, base_url):
     """
-    counter = 4
-    while counter > 0:
-        date_xml = requests.get(url + '/catalog.xml')
-        if date_xml.status_code == 200:
-            break
-        else:
-            print('Retrying in 3 seconds...')
-            counter = counter - 1
-            sleep(3)
-    date_lst = parse(date_xml.content)['thredds:catalog']['thredds:dataset']['thredds:dataset']
-    if not isinstance(date_lst, list):
-        date_lst = [date_lst]
-    date_lst = [d for d in date_lst if not '.xml' in d['@name']]
-    lst1 = [[date, d['@name'].split('-S')[1][:6], d['@name'].split('0-E')[1][:6], d['@name'], d['@ID'], int(d['thredds:dataSize']['#text']), d['thredds:date']['#text']] for d in date_lst]
+    Function to convert the parsed references of a year catalog to [date, url] for each day.
+    """
+    lst1 = [[pd.Timestamp(str(year)) + pd.Timedelta(days=int(d[0]) - 1), base_url + d[1]] for d in days_lst]
 
     return lst1
 
 
+def bound_days(years_url, base_url, years, from_date=None, to_date=None):
+    """
+    Function to find the first and last available days by only walking the outer year catalogs. The first and last years are requested together, and the inner years are only requested while the outer years have no days in the requested period.
+
+    Returns
+    -------
+    list of list
+        [date, url] for the first and last days.
+    """
+    if isinstance(from_date, str):
+        years = [y for y in years if y >= pd.Timestamp(from_date).year]
+    if isinstance(to_date, str):
+        years = [y for y in years if y <= pd.Timestamp(to_date).year]
+    years = sorted(years)
+
+    def filter_days(year, content):
+        days = year_days(year, parse_refs_xml(content), base_url)
+        if isinstance(from_date, str):
+            days = [d for d in days if d[0] >= pd.Timestamp(from_date)]
+        if isinstance(to_date, str):
+            days = [d for d in days if d[0] <= pd.Timestamp(to_date)]
+        return sorted(days)
+
+    def outer_day(years1, i):
+        for y in years1:
+            if y not in days_dict:
+                return None
+            if days_dict[y]:
+                return days_dict[y][i]
+        return None
+
+    days_dict = {}
+    first_day = None
+    last_day = None
+    i = 0
+    while ((first_day is None) or (last_day is None)) and (i < len(years)):
+        batch = []
+        if first_day is None:
+            batch.append(years[i])
+        if (last_day is None) and (years[-1 - i] not in batch):
+            batch.append(years[-1 - i])
+        batch = [y for y in batch if y not in days_dict]
+        contents = fetch_catalogs(['/'.join([years_url, str(y)]) for y in batch])
+        for y, content in zip(batch, contents):
+            days_dict[y] = filter_days(y, content)
+        first_day = outer_day(years, 0)
+        last_day = outer_day(years[::-1], -1)
+        i += 1
+
+    if first_day is None:
+        raise ValueError('No data available in the requested period')
+
+    return [first_day, last_day]
+
+
+def get_catalog_bounds(mission, product, version, from_date=None, to_date=None):
+    """
+    Function to get the first and last available granules of a product and version. Only the outer year and day catalogs are requested, so it generally takes five requests to the server.
+
+    Parameters
+    ----------
+    mission : str
+        Mission name.
+    product : str
+        The product associated with the mission.
+    version : int
+        The product version.
+    from_date : str or None
+        The start date to query.
+    end_date : str or None
+        The end date to query.
+
+    Returns
+    -------
+    DataFrame
+        The first and last granules with the same columns as parse_nasa_catalog.
+    """
+    base_url = mission_product_dict[mission]['base_url']
+    years_url = '/'.join([base_url, 'opendap/hyrax', mission_product_dict[mission]['process_level'], get_product_dir(mission, product, version)])
+    years = [int(y[0]) for y in parse_catalog_refs(years_url)]
+    if not years:
+        raise ValueError('No combination of product and version in specified mission')
+
+    days = bound_days(years_url, base_url, years, from_date, to_date)
+    contents = fetch_catalogs([d[1] for d in days])
+    big_lst = [parse_dates_xml(days[0][0], contents[0]), parse_dates_xml(days[1][0], contents[1])]
+
+    date_df = process_date_list(big_lst, mission, product, version).sort_values('from_date')
+
+    return date_df.iloc[[0, -1]].reset_index(drop=True)
+
 
 def parse_nasa_catalog(mission, product, version, from_date=None, to_date=None, min_max=False):
     """
@@ -91,61 +360,42 @@ def parse_nasa_catalog(mission, product, version, from_date=None, to_date=None,
     ## mission/product parse
     base_url = mission_product_dict[mission]['base_url']
     mis_url = '/'.join([base_url, 'opendap/hyrax',  mission_product_dict[mission]['process_level']])
-    prod_xml = requests.get(mis_url + '/catalog.xml')
-    prod_lst = parse(prod_xml.content)['thredds:catalog']['thredds:dataset']['thredds:catalogRef']
-    prod1 = [p for p in prod_lst if (product in p['@name']) & (str(version) in p['@name'])]
+    prod_lst = parse_catalog_refs(mis_url)
+    prod1 = [p for p in prod_lst if (product in p[0]) & (str(version) in p[0])]
     if not prod1:
         raise ValueError('No combination of product and version in specified mission')
 
     ## Parse available years
-    years_url = '/'.join([mis_url, prod1[0]['@name']])
-    years_xml = requests.get(years_url + '/catalog.xml')
-    years_lst = parse(years_xml.content)['thredds:catalog']['thredds:dataset']['thredds:catalogRef']
-    if isinstance(years_lst, list):
-        years_dict = {int(y['@name']): y for y in years_lst}
-    else:
-        years_dict = {int(years_lst['@name']): years_lst}
+    years_url = '/'.join([mis_url, prod1[0][0]])
+    years_lst = parse_catalog_refs(years_url)
+    years = [int(y[0]) for y in years_lst]
 
     ## Parse available months/days of the year
-    big_lst = []
-    for y in years_dict:
-        my_url = '/'.join([years_url, str(y)])
-        my_xml = requests.get(my_url + '/catalog.xml')
-        my_lst = parse(my_xml.content)['thredds:catalog']['thredds:dataset']['thredds:catalogRef']
-        if not isinstance(my_lst, list):
-            my_lst = [my_lst]
-        big_lst.extend([[y, int(d['@name']), base_url + d['@ID']] for d in my_lst])
-
-    my_df = pd.DataFrame(big_lst, columns=['year', 'dayofyear', 'url'])
-    my_df['date'] = pd.to_datetime(my_df.year.astype(str)) + pd.to_timedelta(my_df.dayofyear - 1, unit='D')
-    my_df.drop(['year', 'dayofyear'], axis=1, inplace=True)
-
-    ## Get all requested dates
-    if isinstance(from_date, str):
-        my_df = my_df[(my_df.date >= from_date)]
+    if min_max:
+        iter1 = bound_days(years_url, base_url, years, from_date, to_date)
+    else:
+        contents = fetch_catalogs(['/'.join([years_url, str(y)]) for y in years])
+        big_lst = []
+        for y, content in zip(years, contents):
+            big_lst.extend(year_days(y, parse_refs_xml(content), base_url))
 
-    if isinstance(to_date, str):
-        my_df = my_df[(my_df.date <= to_date)]
+        my_df = pd.DataFrame(big_lst, columns=['date', 'url'])
 
-    if min_max:
-        my_df = my_df.iloc[[0, -1]]
+        ## Get all requested dates
+        if isinstance(from_date, str):
+            my_df = my_df[(my_df.date >= from_date)]
 
-    iter1 = [(row.date, row.url) for index, row in my_df.iterrows()]
-    big_lst = ThreadPool(30).starmap(parse_dates, iter1)
-    big_lst2 = list(itertools.chain.from_iterable(big_lst))
+        if isinstance(to_date, str):
+            my_df = my_df[(my_df.date <= to_date)]
 
-    date_df = pd.DataFrame(big_lst2, columns=['date', 'start_time', 'end_time', 'file_name', 'file_url', 'file_size', 'modified_date'])
-    date_df['modified_date'] = pd.to_datetime(date_df['modified_date'] + '+00')
-    date_df['start_time'] = pd.to_datetime(date_df['start_time'], format='%H%M%S', errors='coerce').dt.time.astype(str) + 'Z+00'
-    date_df['end_time'] = pd.to_datetime(date_df['end_time'], format='%H%M%S', errors='coerce').dt.time.astype(str) + 'Z+00'
-    date_df['from_date'] = pd.to_datetime(date_df['date'].astype(str) + 'T' +  date_df['start_time'])
-    date_df['to_date'] = pd.to_datetime(date_df['date'].astype(str) + 'T' +  date_df['end_time'])
-    date_df.drop(['date', 'start_time', 'end_time'], axis=1, inplace=True)
+        iter1 = my_df.values.tolist()
 
-    ## Add in extra columns and return
-    date_df['mission'] = mission
-    date_df['product'] = product
-    date_df['version'] = version
+    contents = fetch_catalogs([d[1] for d in iter1])
+    big_lst2 = []
+    for d, content in zip(iter1, contents):
+        big_lst2.append(parse_dates_xml(d[0], content))
+
+    date_df = process_date_list(big_lst2, mission, product, version)
 
     return date_df
 
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+Zonal statistics of the gridded data over polygons (e.g. catchments). The grid of a product is fixed, so the area weights of the grid cells in each zone are computed once as a sparse matrix and cached. A (time, lon, lat) dataset is then reduced to (time, zone) with a sparse matrix multiply per chunk of time steps.
+"""
+import os
+import pickle
+import hashlib
+import numpy as np
+import xarray as xr
+
+try:
+    import scipy.sparse as sparse
+except ImportError:
+    sparse = None
+
+###############################################
+### Parameters
+
+weights_dir_name = 'zonal'
+weights_file_name = '{key}.pickle'
+earth_radius = 6371.0088
+zonal_time_chunk = 2000
+
+## Intersections smaller than this (in square degrees, about 1 m2) are rounding errors
+min_area = 1e-10
+
+###############################################
+### Functions
+
+
+def geo_interface(geom):
+    """
+    Function to get the GeoJSON like mapping of a geometry, feature, or collection. Objects with a __geo_interface__ (e.g. shapely geometries and geopandas GeoDataFrames) are converted.
+    """
+    if hasattr(geom, '__geo_interface__'):
+        geom = geom.__geo_interface__
+    if not isinstance(geom, dict) or ('type' not in geom):
+        raise ValueError('The zones must be GeoJSON like mappings or have a __geo_interface__')
+    return geom
+
+
+def zone_polygons(zones, zone_field=None):
+    """
+    Function to get the polygons of the zones as lists of (exterior, holes) rings of lon/lat arrays.
+
+    Parameters
+    ----------
+    zones : dict or FeatureCollection
+        A dict of zone name to a Polygon or MultiPolygon, or a FeatureCollection of polygon features (e.g. a GeoDataFrame). The coordinates must be in WGS84 decimal degrees.
+    zone_field : str or None
+        The property of the features with the zone names. If None, the feature ids are used.
+
+    Returns
+    -------
+    dict of zone to list of (ndarray, list of ndarray)
+    """
+    if isinstance(zones, dict) and ('type' not in zones):
+        geoms = {zone: geo_interface(geom) for zone, geom in zones.items()}
+    else:
+        collection = geo_interface(zones)
+        if collection['type'] != 'FeatureCollection':
+            raise ValueError('zones must be a dict of geometries or a FeatureCollection')
+        geoms = {}
+        for i, feature in enumerate(collection['features']):
+            zone = feature['properties'][zone_field] if zone_field is not None else feature.get('id', i)
+            geoms[zone] = feature['geometry']
+
+    polygons = {}
+    for zone, geom in geoms.items():
+        geom = geo_interface(geom)
+        if geom['type'] == 'Polygon':
+            parts = [geom['coordinates']]
+        elif geom['type'] == 'MultiPolygon':
+            parts = geom['coordinates']
+        else:
+            raise ValueError('The geometry of zone {zone} must be a Polygon or MultiPolygon'.format(zone=zone))
+        polygons[zone] = [(np.asarray(rings[0], 'f8')[:, :2], [np.asarray(r, 'f8')[:, :2] for r in rings[1:]]) for rings in parts]
+
+    return polygons
+
+
+def cell_edges(centres):
+    """
+    Function to get the cell edges of a regular grid from the cell centres.
+    """
+    centres = np.asarray(centres, 'f8')
+    if (len(centres) < 2) or (np.diff(centres) <= 0).any():
+        raise ValueError('The lon and lat must be increasing with at least two cells')
+    mid = (centres[1:] + centres[:-1]) / 2
+    return np.concatenate([[centres[0] - (mid[0] - centres[0])], mid, [centres[-1] + (centres[-1] - mid[-1])]])
+
+
+def clip_ring(x, y, c, axis, above):
+    """
+    Function to clip a ring to a half plane (Sutherland-Hodgman). The half plane is where the x (axis 0) or y (axis 1) values are above or below c.
+    """
+    v = x if axis == 0 else y
+    inside = v >= c if above else v <= c
+    x0, y0, v0, inside0 = np.roll(x, 1), np.roll(y, 1), np.roll(v, 1), np.roll(inside, 1)
+    cross = inside != inside0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = (c - v0) / (v - v0)
+        if axis == 0:
+            ix, iy = np.full(len(x), c), y0 + t * (y - y0)
+        else:
+            ix, iy = x0 + t * (x - x0), np.full(len(y), c)
+    mask = np.stack([cross, inside], 1).ravel()
+    return np.stack([ix, x], 1).ravel()[mask], np.stack([iy, y], 1).ravel()[mask]
+
+
+def ring_area(x, y):
+    """
+    Function to get the signed area of a ring with the shoelace formula.
+    """
+    return 0.5 * np.sum(x * np.roll(y, -1) - np.roll(x, -1) * y)
+
+
+def ring_cell_areas(ring, lon_edges, lat_edges):
+    """
+    Function to get the areas (in square degrees) of the intersections of a ring with the grid cells. The ring is clipped to each column of cells and then to each cell of the column.
+
+    Returns
+    -------
+    dict of (lon index, lat index) to area
+    """
+    x, y = ring[:, 0], ring[:, 1]
+    if (x[0] == x[-1]) and (y[0] == y[-1]):
+        x, y = x[:-1], y[:-1]
+    areas = {}
+    i0 = max(np.searchsorted(lon_edges, x.min(), 'right') - 1, 0)
+    i1 = min(np.searchsorted(lon_edges, x.max(), 'left'), len(lon_edges) - 1)
+    for i in range(i0, i1):
+        cx, cy = clip_ring(x, y, lon_edges[i], 0, True)
+        cx, cy = clip_ring(cx, cy, lon_edges[i + 1], 0, False)
+        if len(cx) < 3:
+            continue
+        j0 = max(np.searchsorted(lat_edges, cy.min(), 'right') - 1, 0)
+        j1 = min(np.searchsorted(lat_edges, cy.max(), 'left'), len(lat_edges) - 1)
+        for j in range(j0, j1):
+            rx, ry = clip_ring(cx, cy, lat_edges[j], 1, True)
+            rx, ry = clip_ring(rx, ry, lat_edges[j + 1], 1, False)
+            if len(rx) >= 3:
+                area = abs(ring_area(rx, ry))
+                if area > min_area:
+                    areas[(i, j)] = area
+    return areas
+
+
+def zonal_weights(lon, lat, zones, zone_field=None, cache_dir=None):
+    """
+    Function to get the sparse matrix of the area weights of the grid cells in each zone. The weight of a cell is the area (in km2) of its intersection with the zone. If cache_dir is passed, then the weights are cached in the zonal folder and reused for the same grid and zones.
+
+    Parameters
+    ----------
+    lon : array
+        The increasing lon of the cell centres.
+    lat : array
+        The increasing lat of the cell centres.
+    zones : dict or FeatureCollection
+        See zone_polygons.
+    zone_field : str or None
+        See zone_polygons.
+    cache_dir : str or None
+        The cache directory of the weights (e.g. the cache_dir of the Nasa class).
+
+    Returns
+    -------
+    dict
+        The zones, the weights as a scipy csr matrix of zones by cells (in the order of the flattened lon, lat grid), and the areas of the zones within the grid.
+    """
+    if sparse is None:
+        raise ImportError('The zonal statistics require scipy')
+
+    lon = np.asarray(lon, 'f8')
+    lat = np.asarray(lat, 'f8')
+    polygons = zone_polygons(zones, zone_field)
+
+    if cache_dir is not None:
+        key = hashlib.sha1(lon.tobytes() + lat.tobytes())
+        for zone, parts in polygons.items():
+            key.update(repr(zone).encode())
+            for exterior, holes in parts:
+                for ring in [exterior] + holes:
+                    key.update(ring.tobytes())
+        weights_path = os.path.join(cache_dir, weights_dir_name, weights_file_name.format(key=key.hexdigest()))
+        if os.path.isfile(weights_path):
+            with open(weights_path, 'rb') as handle:
+                return pickle.load(handle)
+
+    lon_edges = cell_edges(lon)
+    lat_edges = cell_edges(lat)
+    cos_lat = np.cos(np.deg2rad(lat))
+    km2 = (np.pi / 180 * earth_radius)**2
+
+    rows, cols, values = [], [], []
+    for row, (zone, parts) in enumerate(polygons.items()):
+        cells = {}
+        for exterior, holes in parts:
+            for sign, ring in [(1, exterior)] + [(-1, h) for h in holes]:
+                for cell, area in ring_cell_areas(ring, lon_edges, lat_edges).items():
+                    cells[cell] = cells.get(cell, 0) + sign * area
+        for (i, j), area in cells.items():
+            if area > min_area:
+                rows.append(row)
+                cols.append(i * len(lat) + j)
+                values.append(area * km2 * cos_lat[j])
+
+    weights = sparse.csr_matrix((values, (rows, cols)), shape=(len(polygons), len(lon) * len(lat)))
+    output = {'zones': list(polygons), 'weights': weights, 'area': np.asarray(weights.sum(1)).ravel()}
+
+    if cache_dir is not None:
+        os.makedirs(os.path.dirname(weights_path), exist_ok=True)
+        temp_path = '{path}.{pid}.tmp'.format(path=weights_path, pid=os.getpid())
+        with open(temp_path, 'wb') as handle:
+            pickle.dump(output, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, weights_path)
+
+    return output
+
+
+def zonal_mean(ds, zones, zone_field=None, cache_dir=None, time_chunk=zonal_time_chunk):
+    """
+    Function to get the area weighted means of the variables of a dataset over zones (e.g. catchment averaged rainfall). The cells without data (NaN) are left out of the means of their time steps. The data is reduced a chunk of time steps at a time with sparse matrix multiplies, so datasets from the zarr cache don't need to fit in memory.
+
+    Parameters
+    ----------
+    ds : xarray dataset
+        The data with lon, lat, and time dims (e.g. from Nasa.get_data).
+    zones : dict or FeatureCollection
+        A dict of zone name to a Polygon or MultiPolygon, or a FeatureCollection of polygon features (e.g. a GeoDataFrame). The coordinates must be in WGS84 decimal degrees.
+    zone_field : str or None
+        The property of the features with the zone names. If None, the feature ids are used.
+    cache_dir : str or None
+        The cache directory of the weights. If None, the weights aren't cached.
+    time_chunk : int
+        The number of time steps reduced at a time.
+
+    Returns
+    -------
+    xarray dataset
+        With time and zone dims and the area (km2) of each zone within the grid.
+    """
+    w = zonal_weights(ds['lon'].values, ds['lat'].values, zones, zone_field, cache_dir)
+
+    ## Only the rows and columns of the grid around the cells in the zones are read, then the cells in the zones are taken from them
+    weights = w['weights'].tocsc()
+    cells = np.flatnonzero(np.diff(weights.indptr))
+    weights = weights[:, cells].tocsr()
+    n_lat = len(ds['lat'])
+    lon_index, lat_index = cells // n_lat, cells % n_lat
+    lon_slice = slice(int(lon_index.min()), int(lon_index.max()) + 1) if len(cells) else slice(0, 0)
+    lat_slice = slice(int(lat_index.min()), int(lat_index.max()) + 1) if len(cells) else slice(0, 0)
+    cells = (lon_index - lon_slice.start) * (lat_slice.stop - lat_slice.start) + (lat_index - lat_slice.start)
+
+    data_vars = {}
+    for ar in ds.data_vars:
+        da = ds[ar].transpose('time', 'lon', 'lat').isel(lon=lon_slice, lat=lat_slice)
+        dtype = np.result_type(da.dtype, np.float32)
+        means = [np.empty((0, len(w['zones'])), dtype)]
+        for i in range(0, len(ds['time']), time_chunk):
+            values = da.isel(time=slice(i, i + time_chunk)).values
+            values = values.reshape(len(values), -1)[:, cells].T
+            valid = ~np.isnan(values)
+            total = weights @ np.where(valid, values, 0)
+            area = weights @ valid.astype('f8')
+            with np.errstate(invalid='ignore', divide='ignore'):
+                means.append((total / area).T)
+        data_vars[ar] = (('time', 'zone'), np.concatenate(means).astype(dtype), dict(ds[ar].attrs, cell_methods='area: mean'))
+
+    return xr.Dataset(data_vars, coords={'time': ds['time'], 'zone': w['zones'], 'area': ('zone', w['area'], {'units': 'km2'})}, attrs=ds.attrs)
@@ -18,7 +18,7 @@ version = '1.3.1'
 if os.environ.get('READTHEDOCS', False) == 'True':
     INSTALL_REQUIRES = []
 else:
-    INSTALL_REQUIRES = ['xarray', 'pydap', 'lxml', 'requests', 'dask', 'netCDF4', 'xmltodict']
+    INSTALL_REQUIRES = ['xarray', 'pydap', 'lxml', 'requests', 'dask', 'netCDF4', 'aiohttp']
 
 # Get the long description from the README file
 with open(os.path.join(here, 'README.rst'), encoding='utf-8') as f:
@@ -149,10 +149,11 @@ setup(
     #
     # Similar to `install_requires` above, these must be valid existing
     # projects.
-    #extras_require={  # Optional
-    #    'dev': ['check-manifest'],
-    #    'test': ['coverage'],
-    #},
+    extras_require={  # Optional
+        'hdf5': ['h5py'],
+        'zarr': ['zarr', 'dask'],
+        'zonal': ['scipy'],
+    },
 
     # If there are data files included in your packages that need to be
     # installed, specify them here.